@@ -0,0 +1,3 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
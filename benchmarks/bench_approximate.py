@@ -0,0 +1,53 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+from nlprov.approximate import MinHashLSH, RandomProjectionLSH, \
+    benchmark_recall
+from benchmarks.common import SIZES, vectorized_corpus, queries
+# Shared by every suite, so asv builds the corpora once per run
+from benchmarks.common import setup_cache  # noqa: F401
+
+indexes = {'minhash': MinHashLSH, 'random_projection': RandomProjectionLSH}
+
+
+class ApproximateSearch:
+    """
+    Approximate top 10 search with the LSH indexes, with its recall and
+    speedup against exact search.
+    """
+
+    params = (SIZES, list(indexes))
+    param_names = ['n_docs', 'index']
+    number = 1
+    repeat = 1
+    warmup_time = 0
+    timeout = 36000
+
+    def setup(self, n_docs, index):
+        old_mat, vectorizer_obj = vectorized_corpus(n_docs)
+        self.new_mat = queries(vectorizer_obj)
+        self.index = indexes[index]().add(old_mat)
+
+    def time_query(self, *params):
+        self.index.query(self.new_mat, top_k=10)
+
+    def peakmem_query(self, *params):
+        self.index.query(self.new_mat, top_k=10)
+
+    def track_recall(self, *params):
+        return benchmark_recall(self.index, self.new_mat, top_k=10)['recall']
+
+    track_recall.unit = 'recall@10'
+
+    def track_speedup(self, *params):
+        result = benchmark_recall(self.index, self.new_mat, top_k=10)
+        return result['exact_seconds'] / result['approx_seconds']
+
+    track_speedup.unit = 'x'
+
+    def track_mean_candidates(self, *params):
+        return benchmark_recall(self.index, self.new_mat,
+                                top_k=10)['mean_candidates']
+
+    track_mean_candidates.unit = 'documents'
@@ -0,0 +1,106 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import spacy
+
+from nlprov.preprocessing import preprocess_text
+from nlprov.cache import PreprocessCache
+from benchmarks.common import SIZES, synthetic_corpus, profile, throughput
+# Shared by every suite, so asv builds the corpora once per run
+from benchmarks.common import setup_cache  # noqa: F401
+
+
+class PreprocessText:
+    """
+    preprocess_text over every combination of its processing options.
+    """
+
+    params = (SIZES, ['none', 'lemma', 'stem'], [False, True], [False, True],
+              [False, True])
+    param_names = ['n_docs', 'morphology', 'token_list', 'eng_lang',
+                   'stop_words']
+    number = 1
+    repeat = 1
+    warmup_time = 0
+    timeout = 36000
+
+    def setup(self, n_docs, morphology, token_list, eng_lang, stop_words):
+        self.text = synthetic_corpus(n_docs)
+        self.kwargs = {'lemma': morphology == 'lemma',
+                       'stem': morphology == 'stem',
+                       'token_list': token_list, 'eng_lang': eng_lang,
+                       'stop_words': stop_words}
+        # Load the spaCy models and language detector outside of the timings
+        preprocess_text(self.text[:100], **self.kwargs)
+
+    def run(self):
+        return preprocess_text(self.text, **self.kwargs)
+
+    def time_preprocess_text(self, *params):
+        self.run()
+
+    def peakmem_preprocess_text(self, *params):
+        self.run()
+
+    def track_throughput(self, n_docs, *params):
+        return throughput(self.run, n_docs)
+
+    track_throughput.unit = 'docs/s'
+
+    def track_peak_bytes(self, *params):
+        return profile(self.run, 'preprocess_text')['peak_bytes']
+
+    track_peak_bytes.unit = 'bytes'
+
+
+class PreprocessPerformanceOptions:
+    """
+    preprocess_text with the options that change how, not what, it
+    processes, against the same lemmatizing or stemming baseline.
+    """
+
+    options = {'baseline_lemma': {'lemma': True},
+               'baseline_stem': {'stem': True},
+               'dedup_raw': {'stem': True, 'dedup': 'raw'},
+               'dedup_normalized': {'stem': True, 'dedup': 'normalized'},
+               'whitespace_tokenizer': {'stem': True,
+                                        'tokenizer': 'whitespace'},
+               'lookup_lemma': {'lemma': True, 'lemma_mode': 'lookup'},
+               'n_process_2': {'lemma': True, 'n_process': 2},
+               'cache_hits': {'stem': True}}
+
+    params = (SIZES, list(options))
+    param_names = ['n_docs', 'option']
+    number = 1
+    repeat = 1
+    warmup_time = 0
+    timeout = 36000
+
+    def setup(self, n_docs, option):
+        if option == 'lookup_lemma' and \
+                not spacy.util.is_package('spacy-lookups-data'):
+            # Skipped without spacy-lookups-data
+            raise NotImplementedError
+
+        self.text = synthetic_corpus(n_docs)
+        self.kwargs = dict(self.options[option])
+        if option == 'cache_hits':
+            self.kwargs['cache'] = PreprocessCache(':memory:')
+            preprocess_text(self.text, **self.kwargs)
+        else:
+            preprocess_text(self.text[:100], **self.kwargs)
+
+    def run(self):
+        return preprocess_text(self.text, **self.kwargs)
+
+    def time_preprocess_text(self, *params):
+        self.run()
+
+    def peakmem_preprocess_text(self, *params):
+        self.run()
+
+    def track_throughput(self, n_docs, *params):
+        return throughput(self.run, n_docs)
+
+    track_throughput.unit = 'docs/s'
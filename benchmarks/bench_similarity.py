@@ -0,0 +1,101 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import warnings
+
+from nlprov.similarity_calc import supported_metrics, \
+    similarity_calculation, SimilarityEngine
+from benchmarks.common import SIZES, MAX_FULL_SIMILARITY_DOCS, \
+    vectorized_corpus, queries, profile, throughput
+# Shared by every suite, so asv builds the corpora once per run
+from benchmarks.common import setup_cache  # noqa: F401
+
+
+class SimilarityCalculation:
+    """
+    Full n x d similarities of new documents with the corpus for every
+    supported metric.
+    """
+
+    params = (SIZES, supported_metrics, [False, True])
+    param_names = ['n_docs', 'metric', 'compact']
+    number = 1
+    repeat = 1
+    warmup_time = 0
+    timeout = 36000
+
+    def setup(self, n_docs, metric, compact):
+        if n_docs > MAX_FULL_SIMILARITY_DOCS:
+            # The n x d output and dense fallbacks don't scale, see the
+            # top k benchmarks instead
+            raise NotImplementedError
+
+        self.old_mat, vectorizer_obj = vectorized_corpus(n_docs)
+        self.new_mat = queries(vectorizer_obj)
+        self.metric = metric
+        self.compact = compact
+        warnings.simplefilter('ignore')
+
+    def run(self):
+        return similarity_calculation(self.new_mat, self.old_mat,
+                                      self.metric, compact=self.compact)
+
+    def time_similarity_calculation(self, *params):
+        self.run()
+
+    def peakmem_similarity_calculation(self, *params):
+        self.run()
+
+    def track_throughput(self, *params):
+        # Comparisons of a new with an old document per second
+        return throughput(self.run, self.new_mat.shape[0] *
+                          self.old_mat.shape[0])
+
+    track_throughput.unit = 'pairs/s'
+
+    def track_peak_bytes(self, *params):
+        return profile(self.run, 'similarity_calculation')['peak_bytes']
+
+    track_peak_bytes.unit = 'bytes'
+
+
+class TopKSearch:
+    """
+    Top 10 most similar corpus documents with the memory budgeted
+    SimilarityEngine, single and multi-threaded.
+    """
+
+    params = (SIZES, supported_metrics, [1, -1])
+    param_names = ['n_docs', 'metric', 'n_jobs']
+    number = 1
+    repeat = 1
+    warmup_time = 0
+    timeout = 36000
+
+    def setup(self, n_docs, metric, n_jobs):
+        old_mat, vectorizer_obj = vectorized_corpus(n_docs)
+        self.new_mat = queries(vectorizer_obj)
+        self.engine = SimilarityEngine(old_mat, metric, n_jobs=n_jobs)
+        warnings.simplefilter('ignore')
+
+    def run(self):
+        return self.engine.similarities(self.new_mat, top_k=10)
+
+    def time_top_k(self, *params):
+        self.run()
+
+    def peakmem_top_k(self, *params):
+        self.run()
+
+    def track_throughput(self, *params):
+        return throughput(self.run, self.new_mat.shape[0] *
+                          self.engine.old_mat.shape[0])
+
+    track_throughput.unit = 'pairs/s'
+
+    def track_peak_bytes(self, *params):
+        self.run()
+        return self.engine.report['peak_bytes']
+
+    track_peak_bytes.unit = 'bytes'
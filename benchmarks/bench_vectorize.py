@@ -0,0 +1,71 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+from nlprov.vectorize import vectorize_text, vectorize_new_text
+from benchmarks.common import SIZES, VEC_TYPES, preprocessed_corpus, \
+    vectorized_corpus, preprocessed_queries, profile, throughput
+# Shared by every suite, so asv builds the corpora once per run
+from benchmarks.common import setup_cache  # noqa: F401
+
+
+class VectorizeText:
+    """
+    Fitting every vec_type on the preprocessed corpus, in float64 and in the
+    compact float32 representation.
+    """
+
+    params = (SIZES, VEC_TYPES, [False, True])
+    param_names = ['n_docs', 'vec_type', 'compact']
+    number = 1
+    repeat = 1
+    warmup_time = 0
+    timeout = 36000
+
+    def setup(self, n_docs, vec_type, compact):
+        self.text = preprocessed_corpus(n_docs)
+        self.vec_type = vec_type
+        self.compact = compact
+
+    def run(self):
+        return vectorize_text(self.text, self.vec_type, compact=self.compact)
+
+    def time_vectorize_text(self, *params):
+        self.run()
+
+    def peakmem_vectorize_text(self, *params):
+        self.run()
+
+    def track_throughput(self, *params):
+        return throughput(self.run, len(self.text))
+
+    track_throughput.unit = 'docs/s'
+
+    def track_peak_bytes(self, *params):
+        return profile(self.run, 'vectorize_text')['peak_bytes']
+
+    track_peak_bytes.unit = 'bytes'
+
+    def track_matrix_bytes(self, *params):
+        vectorized, _ = self.run()
+        return (vectorized.data.nbytes + vectorized.indices.nbytes +
+                vectorized.indptr.nbytes)
+
+    track_matrix_bytes.unit = 'bytes'
+
+
+class VectorizeNewText:
+    """
+    Vectorizing new documents with a vectorizer fitted on the corpus.
+    """
+
+    params = (SIZES, VEC_TYPES)
+    param_names = ['n_docs', 'vec_type']
+    timeout = 36000
+
+    def setup(self, n_docs, vec_type):
+        _, self.vectorizer_obj = vectorized_corpus(n_docs, vec_type)
+        self.text = preprocessed_queries()
+
+    def time_vectorize_new_text(self, *params):
+        vectorize_new_text(self.text, self.vectorizer_obj)
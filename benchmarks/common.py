@@ -0,0 +1,205 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import os
+import time
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from spacy.lang.en.stop_words import STOP_WORDS
+
+from nlprov.preprocessing import preprocess_text
+from nlprov.vectorize import vectorize_text
+from nlprov.storage import save_vectorized, load_vectorized
+from nlprov.instrumentation import Profiler
+
+# Corpus sizes to benchmark, e.g. NLPROV_BENCHMARK_SIZES=10000,1000000,10000000
+SIZES = [int(size) for size in
+         os.environ.get('NLPROV_BENCHMARK_SIZES', '10000,100000').split(',')]
+
+# Largest corpus the n x d similarity matrix is benchmarked on, above it
+# only top k search is
+MAX_FULL_SIMILARITY_DOCS = 100000
+
+# Number of new documents scored against the corpus
+N_QUERIES = 100
+
+VEC_TYPES = ['count', 'tfidf', 'hashing', 'hashing_tfidf']
+
+# Directory the corpora are built in once and loaded from by every benchmark.
+# asv runs setup_cache in its cache directory, which is also the working
+# directory of the benchmarks.
+DATA_DIR = os.environ.get('NLPROV_BENCHMARK_DATA', 'nlprov_benchmark_data')
+
+_CONTENT_STEMS = ['patient', 'device', 'report', 'pain', 'product', 'doctor',
+                  'nurse', 'hospital', 'surgery', 'implant', 'knee', 'hip',
+                  'lens', 'contact', 'eye', 'skin', 'cream', 'tablet', 'dose',
+                  'package', 'label', 'batch', 'complaint', 'issue', 'break',
+                  'leak', 'crack', 'burn', 'itch', 'swell', 'dog', 'cat',
+                  'duck', 'pony', 'run', 'walk', 'open', 'close', 'clean',
+                  'replace', 'return', 'order', 'ship', 'deliver', 'test',
+                  'measure', 'monitor', 'treat', 'heal', 'use', 'apply',
+                  'remove', 'insert', 'store', 'check', 'call', 'help',
+                  'work', 'feel', 'look']
+_SUFFIXES = ['', 's', 'ed', 'ing', 'er', 'ers', 'ly', 'ness', 'ment',
+             'able', 'ation', 'ful']
+
+# Non-english documents for the language detection to drop
+_FOREIGN = ["le patient a signalé une douleur après la chirurgie",
+            "das produkt ist beschädigt und muss ersetzt werden",
+            "el paciente tiene dolor en la rodilla después del implante"]
+
+
+@lru_cache(maxsize=None)
+def vocabulary():
+    """
+    English-like vocabulary: stop words, which are the most frequent tokens
+    as in natural text, followed by inflections of content words.
+    """
+    content = [stem + suffix for suffix in _SUFFIXES
+               for stem in _CONTENT_STEMS]
+    return sorted(STOP_WORDS) + content
+
+
+def generate_corpus(n_docs: int,
+                    seed: int = 0,
+                    mean_length: int = 20):
+    """
+    Reproducible corpus of raw documents: Zipf distributed words,
+    capitalized sentences with punctuation, 5% non-english documents and 1%
+    missing values.
+
+    :param n_docs: Number of documents.
+    :param seed: Seed of the random generator.
+    :param mean_length: Mean number of words per document.
+
+    :return: Pandas Series of strings.
+    """
+    rng = np.random.default_rng(seed)
+    words = vocabulary()
+    frequencies = 1 / np.arange(1, len(words) + 1)
+    frequencies /= frequencies.sum()
+
+    docs = []
+    chunk = 100000
+    for start in range(0, n_docs, chunk):
+        lengths = rng.poisson(mean_length, min(chunk, n_docs - start)) + 1
+        tokens = rng.choice(len(words), size=lengths.sum(),
+                            p=frequencies).tolist()
+        ends = np.cumsum(lengths).tolist()
+        begin = 0
+        for end in ends:
+            docs.append(' '.join([words[token] for token in
+                                  tokens[begin:end]]).capitalize() + '.')
+            begin = end
+
+    docs = pd.Series(docs, dtype=object)
+    docs[::20] = [_FOREIGN[i % len(_FOREIGN)]
+                  for i in range(len(docs[::20]))]
+    docs[7::100] = None
+    return docs
+
+
+def _data_path(*parts):
+    return os.path.join(DATA_DIR, '_'.join(str(part) for part in parts))
+
+
+def _cached_series(name: str, build):
+    path = _data_path(name) + '.pkl'
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        build().to_pickle(path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    return pd.read_pickle(path)
+
+
+def synthetic_corpus(n_docs: int,
+                     seed: int = 0):
+    """
+    :return: Pandas Series, the corpus of generate_corpus, built on first
+        use.
+    """
+    return _cached_series('corpus_{}_{}'.format(n_docs, seed),
+                          lambda: generate_corpus(n_docs, seed))
+
+
+def preprocessed_corpus(n_docs: int):
+    """
+    :return: Pandas Series, the synthetic corpus preprocessed with the
+        default options, built on first use.
+    """
+    return _cached_series('preprocessed_{}'.format(n_docs),
+                          lambda: preprocess_text(synthetic_corpus(n_docs)))
+
+
+def vectorized_corpus(n_docs: int,
+                      vec_type: str = 'count'):
+    """
+    :return: A tuple containing the vectorized preprocessed corpus, memory
+        mapped, and the fitted vectorizer, built on first use.
+    """
+    path = _data_path('vectorized', n_docs, vec_type)
+    if not os.path.exists(os.path.join(path, 'vectorized.json')):
+        save_vectorized(path, *vectorize_text(preprocessed_corpus(n_docs),
+                                              vec_type))
+
+    return load_vectorized(path)
+
+
+def preprocessed_queries():
+    """
+    :return: Pandas Series, new synthetic documents preprocessed with the
+        default options.
+    """
+    return _cached_series(
+        'queries_{}'.format(N_QUERIES),
+        lambda: preprocess_text(synthetic_corpus(N_QUERIES, seed=1)))
+
+
+def queries(vectorizer_obj):
+    """
+    :return: doc-feature matrix of new synthetic documents.
+    """
+    return vectorizer_obj.transform(preprocessed_queries())
+
+
+def setup_cache():
+    """
+    Builds every corpus once per asv run. The suites import this function,
+    so asv shares its cache between them instead of rebuilding the corpora
+    in the setup of every benchmark and parameter combination.
+    """
+    for n_docs in SIZES:
+        for vec_type in VEC_TYPES:
+            vectorized_corpus(n_docs, vec_type)
+    preprocessed_queries()
+
+
+setup_cache.timeout = 36000
+
+
+def profile(func,
+            stage_name: str):
+    """
+    Runs func under a memory tracking Profiler.
+
+    :return: dict recorded for the stage, with seconds, rows_in, rows_out
+        and peak_bytes.
+    """
+    with Profiler(track_memory=True) as profiler:
+        func()
+
+    report = profiler.report()
+    return report[report['stage'] == stage_name].iloc[-1].to_dict()
+
+
+def throughput(func,
+               n_docs: int):
+    """
+    :return: Documents per second of a single run of func.
+    """
+    start = time.perf_counter()
+    func()
+    return n_docs / (time.perf_counter() - start)
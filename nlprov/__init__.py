@@ -2,14 +2,199 @@
 Copyright © 2020 Johnson & Johnson
 """
 
-import en_core_web_sm
+import threading
+import spacy
 
+DEFAULT_MODEL = 'en_core_web_sm'
+DEFAULT_DISABLE = ('parser', 'ner', 'textcat')
 
-def get_spacy_nlp():
+# Trained components of the spaCy pipeline packages. Excluding all of them
+# leaves only the tokenizer, without loading any model weights.
+PIPELINE_COMPONENTS = ('transformer', 'tok2vec', 'tagger', 'morphologizer',
+                       'parser', 'senter', 'attribute_ruler', 'lemmatizer',
+                       'trainable_lemmatizer', 'ner', 'entity_ruler',
+                       'entity_linker', 'spancat', 'textcat',
+                       'textcat_multilabel')
+
+# Process-wide registry of loaded spaCy pipelines, keyed by model name, the
+# sets of disabled and excluded components and the lemmatizer mode.
+_spacy_registry = {}
+_spacy_registry_lock = threading.RLock()
+
+
+def _registry_key(model: str, disable, exclude=(), lemmatizer: str = None):
+    return (model, tuple(sorted(set(disable))), tuple(sorted(set(exclude))),
+            lemmatizer)
+
+
+def _load_spacy_nlp(model: str, disable, exclude, lemmatizer):
     try:
-        spacy_nlp = en_core_web_sm.load(disable=['parser', 'ner', 'textcat'])
+        spacy_nlp = spacy.load(model, disable=list(disable),
+                               exclude=list(exclude))
     except OSError:
         # We should tell the user explicitly what they need to do.
-        raise Exception("Please run `python -m spacy download en_core_web_sm` locally.")
+        raise Exception("Please run `python -m spacy download {}` "
+                        "locally.".format(model))
+
+    if lemmatizer == 'lookup':
+        # Lookup lemmatization needs no part-of-speech tags, so it works
+        # without the statistical tagger
+        spacy_nlp.add_pipe('lemmatizer', name='lookup_lemmatizer',
+                           config={'mode': 'lookup'})
+        try:
+            spacy_nlp.get_pipe('lookup_lemmatizer').initialize()
+        except ValueError:
+            raise Exception("Please run `pip install spacy-lookups-data` to "
+                            "use lookup lemmatization.")
+    elif lemmatizer is not None:
+        raise Exception('lemmatizer must be None or lookup')
+
+    return spacy_nlp
+
+
+def get_spacy_nlp(model: str = DEFAULT_MODEL,
+                  disable: tuple = DEFAULT_DISABLE,
+                  exclude: tuple = (),
+                  lemmatizer: str = None):
+    """
+    Returns a spaCy pipeline from the process-wide registry, loading it on
+    first use. Subsequent calls with the same model and components return the
+    already loaded pipeline.
+
+    :param model: Name of (or path to) the spaCy model to load.
+    :param disable: Names of pipeline components to disable.
+    :param exclude: Names of pipeline components not to load at all.
+    :param lemmatizer: None keeps the model's own components, 'lookup' adds a
+        rule-based lookup lemmatizer (requires spacy-lookups-data).
+
+    :return: spaCy Language object.
+    """
+    key = _registry_key(model, disable, exclude, lemmatizer)
+
+    spacy_nlp = _spacy_registry.get(key)
+    if spacy_nlp is None:
+        with _spacy_registry_lock:
+            # Another thread may have loaded it while we waited on the lock
+            spacy_nlp = _spacy_registry.get(key)
+            if spacy_nlp is None:
+                spacy_nlp = _load_spacy_nlp(*key)
+                _spacy_registry[key] = spacy_nlp
 
     return spacy_nlp
+
+
+def get_spacy_tokenizer_nlp(model: str = DEFAULT_MODEL):
+    """
+    Returns a pipeline of the model with only its tokenizer, for tokenizing
+    and stemming.
+
+    :param model: Name of (or path to) the spaCy model to load.
+
+    :return: spaCy Language object.
+    """
+    return get_spacy_nlp(model, disable=(), exclude=PIPELINE_COMPONENTS)
+
+
+def get_spacy_lemma_nlp(model: str = DEFAULT_MODEL,
+                        lemma_mode: str = 'rule'):
+    """
+    Returns a pipeline of the model with only the components needed to
+    lemmatize.
+
+    :param model: Name of (or path to) the spaCy model to load.
+    :param lemma_mode: 'rule' (default) uses the model's tagger and
+        rule-based lemmatizer, 'lookup' uses the tokenizer and a lookup table
+        only (requires spacy-lookups-data).
+
+    :return: spaCy Language object.
+    """
+    assert lemma_mode in ['rule', 'lookup']
+
+    if lemma_mode == 'lookup':
+        return get_spacy_nlp(model, disable=(), exclude=PIPELINE_COMPONENTS,
+                             lemmatizer='lookup')
+
+    return get_spacy_nlp(model, disable=(),
+                         exclude=('parser', 'senter', 'ner', 'textcat'))
+
+
+def warm_up_spacy_nlp(model: str = DEFAULT_MODEL,
+                      disable: tuple = DEFAULT_DISABLE,
+                      exclude: tuple = (),
+                      lemmatizer: str = None):
+    """
+    Eagerly loads a spaCy pipeline into the registry so the first call to
+    preprocess_text does not pay the model load.
+
+    :param model: Name of (or path to) the spaCy model to load.
+    :param disable: Names of pipeline components to disable.
+    :param exclude: Names of pipeline components not to load at all.
+    :param lemmatizer: None or 'lookup', see get_spacy_nlp.
+
+    :return: spaCy Language object.
+    """
+    return get_spacy_nlp(model, disable, exclude, lemmatizer)
+
+
+def evict_spacy_nlp(model: str = None,
+                    disable: tuple = None,
+                    exclude: tuple = (),
+                    lemmatizer: str = None):
+    """
+    Removes loaded spaCy pipelines from the registry. With no arguments every
+    pipeline is evicted; otherwise only the entries matching the given model
+    and (if provided) components.
+
+    :param model: Name of the model to evict, or None for all models.
+    :param disable: Disabled components of the entry to evict, or None for
+        every entry of the model.
+    :param exclude: Excluded components of the entry to evict.
+    :param lemmatizer: Lemmatizer mode of the entry to evict.
+
+    :return: Number of evicted pipelines.
+    """
+    with _spacy_registry_lock:
+        if model is None:
+            keys = list(_spacy_registry)
+        elif disable is None:
+            keys = [key for key in _spacy_registry if key[0] == model]
+        else:
+            keys = [key for key in [_registry_key(model, disable, exclude,
+                                                  lemmatizer)]
+                    if key in _spacy_registry]
+
+        for key in keys:
+            del _spacy_registry[key]
+
+    return len(keys)
+
+
+def reload_spacy_nlp(model: str = DEFAULT_MODEL,
+                     disable: tuple = DEFAULT_DISABLE,
+                     exclude: tuple = (),
+                     lemmatizer: str = None):
+    """
+    Evicts and loads a spaCy pipeline again, e.g. after the model package
+    was upgraded on disk.
+
+    :param model: Name of (or path to) the spaCy model to load.
+    :param disable: Names of pipeline components to disable.
+    :param exclude: Names of pipeline components not to load at all.
+    :param lemmatizer: None or 'lookup', see get_spacy_nlp.
+
+    :return: spaCy Language object.
+    """
+    with _spacy_registry_lock:
+        evict_spacy_nlp(model, disable, exclude, lemmatizer)
+        return get_spacy_nlp(model, disable, exclude, lemmatizer)
+
+
+def loaded_spacy_pipelines():
+    """
+    Lists the pipelines currently held in the registry.
+
+    :return: List of (model, disabled components, excluded components,
+        lemmatizer) tuples.
+    """
+    with _spacy_registry_lock:
+        return list(_spacy_registry)
@@ -0,0 +1,491 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import abc
+import time
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+
+from nlprov.similarity_calc import batch_similarity, _binarize
+
+_MASK64 = np.uint64(0xFFFFFFFFFFFFFFFF)
+_INT32_MAX = np.iinfo(np.int32).max
+
+
+def _mix64(values):
+    """
+    splitmix64 finalizer, a fast, well distributed hash of uint64 arrays.
+    """
+    with np.errstate(over='ignore'):
+        z = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return (z ^ (z >> np.uint64(31))) & _MASK64
+
+
+def _salts(n: int, seed: int):
+    return _mix64(np.arange(n, dtype=np.uint64) +
+                  np.uint64(seed) * np.uint64(n + 1))
+
+
+def _ranges(starts, ends):
+    """
+    Concatenation of the integer ranges [starts[i], ends[i]).
+    """
+    lengths = ends - starts
+    offsets = starts - np.cumsum(lengths) + lengths
+    return np.repeat(offsets, lengths) + np.arange(lengths.sum())
+
+
+class _Segment:
+    """
+    Documents of an LSH index stored together: their matrix, its scoring
+    form and, for every hash table, the bucket keys in sorted order with the
+    matching rows of the segment.
+
+    :param matrix: scipy csr object of dimensions d x f.
+    :param scoring_matrix: scipy csr object, the scoring form of matrix.
+    :param keys: ndarray of dimensions n_tables x d of bucket keys.
+    :param rows: Optional ndarray of the same dimensions, the row of every
+        key. Defaults to the column of the key.
+    """
+
+    def __init__(self,
+                 matrix,
+                 scoring_matrix,
+                 keys,
+                 rows=None):
+        self.matrix = matrix
+        self.scoring_matrix = scoring_matrix
+
+        n_rows = matrix.shape[0]
+        if rows is None:
+            rows = np.broadcast_to(np.arange(n_rows), keys.shape)
+        order = np.argsort(keys, axis=1, kind='stable')
+        self.keys = np.take_along_axis(keys, order, axis=1)
+        self.rows = np.take_along_axis(rows, order, axis=1).astype(
+            np.int32 if n_rows <= _INT32_MAX else np.int64, copy=False)
+
+    @property
+    def n_rows(self):
+        return self.matrix.shape[0]
+
+    def merge(self, other):
+        """
+        :param other: _Segment object of the documents following this one.
+
+        :return: _Segment object holding the documents of both segments.
+        """
+        # Both key arrays are sorted, so the stable sort merges two runs
+        return _Segment(
+            sp.vstack([self.matrix, other.matrix], format='csr'),
+            sp.vstack([self.scoring_matrix, other.scoring_matrix],
+                      format='csr'),
+            np.concatenate([self.keys, other.keys], axis=1),
+            np.concatenate([self.rows, other.rows.astype(np.int64) +
+                            self.n_rows], axis=1))
+
+    def lookup(self, keys):
+        """
+        :param keys: ndarray of dimensions n_tables x n of bucket keys of new
+            documents.
+
+        :return: A tuple of ndarrays, the new document and segment row of
+            every pair sharing a bucket, once per table they share.
+        """
+        queries, rows = [], []
+        for table_keys, table_rows, new_keys in zip(self.keys, self.rows,
+                                                    keys):
+            starts = np.searchsorted(table_keys, new_keys, side='left')
+            ends = np.searchsorted(table_keys, new_keys, side='right')
+            queries.append(np.repeat(np.arange(len(new_keys)), ends - starts))
+            rows.append(table_rows[_ranges(starts, ends)])
+
+        return np.concatenate(queries), np.concatenate(rows)
+
+
+class _LSHIndex(abc.ABC):
+    """
+    Shared bookkeeping of the LSH indexes and the query logic. Documents are
+    stored in segments holding their matrix, its scoring form (normalized or
+    binarized once) used to re-rank candidates exactly, and sorted arrays of
+    bucket keys searched with searchsorted. Every insert adds a segment and
+    is merged with the previous ones while they are not larger, so there are
+    O(log n) segments and each document is copied O(log n) times however
+    small the inserts are.
+    """
+
+    metric = None
+
+    # Bytes of temporary hashes per block of rows. Blocks are sized by the
+    # number of non-zeros, so long documents do not grow the hash arrays.
+    hash_budget = 16 * 2 ** 20
+
+    # Candidate pairs scored at once
+    max_pairs = 100000
+
+    def __init__(self,
+                 n_tables: int,
+                 n_hashes: int):
+        self.n_tables = n_tables
+        self.n_hashes = n_hashes
+        self._segments = []
+
+    @abc.abstractmethod
+    def _bucket_keys(self, mat):
+        """
+        :return: ndarray of uint64 of dimensions n_tables x d, the bucket of
+            every row of mat in every table.
+        """
+
+    @abc.abstractmethod
+    def _scoring_form(self, mat):
+        """
+        :return: scipy csr object, the form of mat candidates are scored
+            with.
+        """
+
+    @abc.abstractmethod
+    def _pair_scores(self, new_rows, old_rows, products):
+        """
+        :return: ndarray of the similarities of the pairs of rows of new_rows
+            and old_rows, given the sums of their products.
+        """
+
+    @property
+    def n_docs(self):
+        return sum(segment.n_rows for segment in self._segments)
+
+    @property
+    def matrix(self):
+        """
+        scipy csr object of the indexed documents, None before the first
+        insert.
+        """
+        if not self._segments:
+            return None
+        if len(self._segments) == 1:
+            return self._segments[0].matrix
+
+        return sp.vstack([segment.matrix for segment in self._segments],
+                         format='csr')
+
+    def _row_blocks(self, mat):
+        """
+        Yields the (start, end) rows of blocks holding at most hash_budget
+        bytes of hashes, a single row at least.
+        """
+        max_nnz = max(1, self.hash_budget // (8 * self.n_hashes))
+        start = 0
+        while start < mat.shape[0]:
+            end = np.searchsorted(mat.indptr, mat.indptr[start] + max_nnz,
+                                  side='right') - 1
+            end = max(int(end), start + 1)
+            yield start, end
+            start = end
+
+    def _blocked_bucket_keys(self, mat):
+        keys = [self._bucket_keys(mat[start:end])
+                for start, end in self._row_blocks(mat)]
+        if not keys:
+            return np.zeros((self.n_tables, 0), dtype=np.uint64)
+
+        return np.concatenate(keys, axis=1)
+
+    def add(self, mat):
+        """
+        Inserts documents into the index. They get the next row numbers after
+        the documents already indexed.
+
+        :param mat: scipy csr object of dimensions d x f.
+
+        :return: self
+        """
+        mat = sp.csr_matrix(mat)
+        if mat.shape[0] == 0 and self._segments:
+            return self
+
+        self._segments.append(_Segment(mat, self._scoring_form(mat),
+                                       self._blocked_bucket_keys(mat)))
+        while len(self._segments) > 1 and \
+                self._segments[-2].n_rows <= self._segments[-1].n_rows:
+            last = self._segments.pop()
+            self._segments[-1] = self._segments[-1].merge(last)
+
+        return self
+
+    def _candidate_pairs(self, new_mat):
+        """
+        :return: A tuple of ndarrays, the new document and indexed row of
+            every candidate pair, sorted by new document then row.
+        """
+        keys = self._blocked_bucket_keys(new_mat)
+        n_docs = max(self.n_docs, 1)
+        codes = [np.zeros(0, dtype=np.int64)]
+        start = 0
+        for segment in self._segments:
+            queries, rows = segment.lookup(keys)
+            codes.append(queries * n_docs + rows.astype(np.int64) + start)
+            start += segment.n_rows
+        codes = np.unique(np.concatenate(codes))
+
+        return codes // n_docs, codes % n_docs
+
+    def _scoring_rows(self, rows):
+        """
+        Gathers rows of the scoring matrices of the segments, in the order
+        given.
+        """
+        if len(self._segments) == 1:
+            return self._segments[0].scoring_matrix[rows]
+
+        starts = np.cumsum([0] + [segment.n_rows
+                                  for segment in self._segments])
+        segment_ids = np.searchsorted(starts, rows, side='right') - 1
+        order = np.argsort(segment_ids, kind='stable')
+        bounds = np.searchsorted(segment_ids[order],
+                                 np.arange(len(self._segments) + 1))
+        gathered = sp.vstack([segment.scoring_matrix[rows[order[lo:hi]] -
+                                                     start]
+                              for segment, start, lo, hi in
+                              zip(self._segments, starts, bounds[:-1],
+                                  bounds[1:])], format='csr')
+
+        return gathered[np.argsort(order)]
+
+    def candidates(self, new_mat):
+        """
+        :param new_mat: scipy csr object of dimensions n x f.
+
+        :return: List of ndarrays, the candidate rows of every new document.
+        """
+        new_mat = sp.csr_matrix(new_mat)
+        queries, rows = self._candidate_pairs(new_mat)
+        bounds = np.searchsorted(queries, np.arange(new_mat.shape[0] + 1))
+
+        return np.split(rows, bounds[1:-1])
+
+    def query(self,
+              new_mat,
+              top_k: int = 10):
+        """
+        Finds approximately the most similar indexed documents: candidates
+        sharing a bucket with the new document are scored exactly.
+
+        :param new_mat: scipy csr object of dimensions n x f representing the
+            new document-feature matrix.
+        :param top_k: Number of most similar documents to return per new
+            document.
+
+        :return: A tuple containing indices and scores (ndarrays of dimensions
+            n x top_k) sorted by decreasing similarity per row. Rows with
+            fewer than top_k candidates are padded with -1 and nan.
+        """
+        new_mat = sp.csr_matrix(new_mat)
+        indices = np.full((new_mat.shape[0], top_k), -1, dtype=np.int64)
+        scores = np.full((new_mat.shape[0], top_k), np.nan)
+
+        # Score every (new document, candidate) pair in one vectorized pass
+        queries, rows = self._candidate_pairs(new_mat)
+        if top_k == 0 or len(rows) == 0:
+            return indices, scores
+
+        new_scoring = self._scoring_form(new_mat)
+        pair_scores = np.empty(len(rows))
+        for start in range(0, len(rows), self.max_pairs):
+            pairs = slice(start, start + self.max_pairs)
+            new_rows = new_scoring[queries[pairs]]
+            old_rows = self._scoring_rows(rows[pairs])
+            products = np.asarray(new_rows.multiply(old_rows).sum(axis=1))
+            pair_scores[pairs] = self._pair_scores(new_rows, old_rows,
+                                                   products.ravel())
+
+        # Highest score first, ties in row order, within every new document
+        order = np.lexsort((rows, -pair_scores, queries))
+        queries, rows, pair_scores = \
+            queries[order], rows[order], pair_scores[order]
+        firsts = np.searchsorted(queries, queries)
+        ranks = np.arange(len(queries)) - firsts
+        keep = ranks < top_k
+        indices[queries[keep], ranks[keep]] = rows[keep]
+        scores[queries[keep], ranks[keep]] = pair_scores[keep]
+
+        return indices, scores
+
+
+class MinHashLSH(_LSHIndex):
+    """
+    Approximate jaccard search with MinHash signatures of the documents'
+    term sets and banded locality sensitive hashing. More bands find more
+    true neighbours (higher recall) at the cost of more candidates to score.
+
+    :param n_perm: Number of hash functions in a signature.
+    :param bands: Number of bands the signature is split in, each one a hash
+        table. Must divide n_perm.
+    :param seed: Seed of the hash functions.
+    """
+
+    metric = 'jaccard'
+
+    def __init__(self,
+                 n_perm: int = 128,
+                 bands: int = 32,
+                 seed: int = 0):
+        assert n_perm % bands == 0
+        super().__init__(bands, n_perm)
+        self.n_perm = n_perm
+        self.bands = bands
+        self.seed = seed
+        self._perm_salts = _salts(n_perm, seed)
+
+    def signatures(self, mat):
+        """
+        :param mat: scipy csr object of dimensions d x f.
+
+        :return: ndarray of dimensions d x n_perm, the MinHash signatures.
+            Empty documents get the maximum value in every position.
+        """
+        mat = sp.csr_matrix(mat, copy=True)
+        mat.eliminate_zeros()
+
+        signatures = np.full((mat.shape[0], self.n_perm),
+                             np.iinfo(np.uint64).max, dtype=np.uint64)
+        for start, end in self._row_blocks(mat):
+            block = mat[start:end]
+            non_empty = np.diff(block.indptr) > 0
+            if block.nnz == 0:
+                continue
+            hashes = _mix64(block.indices.astype(np.uint64)[:, None] ^
+                            self._perm_salts[None, :])
+            starts = block.indptr[:-1][non_empty]
+            signatures[start:end][non_empty] = np.minimum.reduceat(
+                hashes, starts, axis=0)
+
+        return signatures
+
+    def _scoring_form(self, mat):
+        binary = _binarize(mat)
+        binary.eliminate_zeros()
+        return binary
+
+    def _pair_scores(self, new_rows, old_rows, products):
+        # Term counts of the binarized rows
+        union = np.diff(new_rows.indptr) + np.diff(old_rows.indptr) - \
+            products
+        # Two empty documents have distance 0, as in scipy
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(union == 0, 1.0, products / union)
+
+    def _bucket_keys(self, mat):
+        # Hash the rows of every band into a single key
+        rows = self.n_perm // self.bands
+        bands = self.signatures(mat).reshape(mat.shape[0], self.bands, rows)
+        keys = np.zeros((mat.shape[0], self.bands), dtype=np.uint64)
+        for row in range(rows):
+            keys = _mix64(keys ^ bands[:, :, row])
+
+        return keys.T
+
+
+class RandomProjectionLSH(_LSHIndex):
+    """
+    Approximate cosine search with signed random projections (SimHash). The
+    random +1/-1 projection of every feature is derived from a hash, so no
+    projection matrix proportional to the vocabulary size is stored. More
+    tables and fewer bits per table increase recall and the number of
+    candidates to score.
+
+    :param n_bits: Number of projections (bits) per hash table.
+    :param n_tables: Number of hash tables.
+    :param seed: Seed of the projections.
+    """
+
+    metric = 'cosine'
+
+    def __init__(self,
+                 n_bits: int = 16,
+                 n_tables: int = 32,
+                 seed: int = 0):
+        assert 0 < n_bits <= 64
+        super().__init__(n_tables, n_bits * n_tables)
+        self.n_bits = n_bits
+        self.seed = seed
+        self._bit_salts = _salts(n_bits * n_tables, seed)
+
+    def _projections(self, features):
+        # +1/-1 per (feature, bit) from the top bit of a hash
+        hashes = _mix64(features.astype(np.uint64)[:, None] ^
+                        self._bit_salts[None, :])
+        return np.where(hashes >> np.uint64(63), 1.0, -1.0)
+
+    def _bucket_keys(self, mat):
+        # Only the features present in mat need a projection
+        features, columns = np.unique(mat.indices, return_inverse=True)
+        compact = sp.csr_matrix((mat.data, columns.ravel(), mat.indptr),
+                                shape=(mat.shape[0], len(features)))
+        bits = np.asarray(compact @ self._projections(features)) > 0
+        bits = bits.reshape(mat.shape[0], self.n_tables, self.n_bits)
+
+        weights = np.left_shift(np.uint64(1),
+                                np.arange(self.n_bits, dtype=np.uint64))
+        return (bits.astype(np.uint64) @ weights).T
+
+    def _scoring_form(self, mat):
+        return normalize(mat)
+
+    def _pair_scores(self, new_rows, old_rows, products):
+        return np.clip(products, -1, 1)
+
+
+def recall_at_k(approx_scores,
+                exact_scores):
+    """
+    Fraction of the exact top k neighbours that were found by an approximate
+    search. Neighbours are compared by score, so that any of several
+    documents tied with the k-th exact neighbour counts as found.
+
+    :param approx_scores: ndarray of dimensions n x k from an approximate
+        query.
+    :param exact_scores: ndarray of dimensions n x k from an exact query.
+
+    :return: float, recall between 0 and 1.
+    """
+    kth = exact_scores[:, -1:] - 1e-9
+    with np.errstate(invalid='ignore'):
+        found = np.sum(approx_scores >= kth)
+
+    return found / max(exact_scores.size, 1)
+
+
+def benchmark_recall(index,
+                     new_mat,
+                     top_k: int = 10):
+    """
+    Compares an approximate index against exact brute force search over the
+    same documents.
+
+    :param index: MinHashLSH or RandomProjectionLSH object with documents.
+    :param new_mat: scipy csr object of dimensions n x f of queries.
+    :param top_k: Number of neighbours per query.
+
+    :return: dict with the recall at top_k, the mean number of candidates
+        scored per query and the approximate and exact query times in
+        seconds.
+    """
+    start = time.perf_counter()
+    _, approx_scores = index.query(new_mat, top_k)
+    approx_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, exact_scores = batch_similarity(new_mat, index.matrix, index.metric,
+                                       top_k=top_k)
+    exact_time = time.perf_counter() - start
+
+    candidates = index.candidates(new_mat)
+    return {'recall': recall_at_k(approx_scores, exact_scores),
+            'mean_candidates': float(np.mean([len(rows)
+                                              for rows in candidates])),
+            'approx_seconds': approx_time,
+            'exact_seconds': exact_time}
@@ -0,0 +1,206 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import pandas as pd
+import spacy
+import langid
+import nltk
+
+from nlprov import DEFAULT_MODEL
+
+
+def _library_versions():
+    try:
+        model_version = spacy.util.get_package_version(DEFAULT_MODEL)
+    except Exception:
+        model_version = None
+
+    return {'spacy': spacy.__version__,
+            'model': model_version,
+            'langid': getattr(langid, '__version__', None),
+            'nltk': nltk.__version__}
+
+
+def options_fingerprint(options: dict):
+    """
+    Hashes a set of preprocessing options together with the versions of the
+    libraries that produce the results, so that upgrading spaCy, its model,
+    langid or nltk invalidates previously cached results.
+
+    :param options: dict of JSON serializable preprocessing options.
+
+    :return: String, hex digest identifying the options.
+    """
+    payload = json.dumps({'options': options,
+                          'versions': _library_versions()},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class PreprocessCache:
+    """
+    Persistent, content-addressed cache of preprocessed documents stored in
+    SQLite. Entries are keyed by the hash of the raw text and an options
+    fingerprint, so only texts that were never processed with the same
+    options (and library versions) need to go through the pipeline. Texts
+    that were filtered out (e.g. non-english) are cached as dropped.
+
+    :param path: Path of the SQLite database, ':memory:' for a cache that only
+        lives as long as the object.
+    :param max_bytes: Optional maximum size of the cached values in bytes.
+        The least recently used entries are evicted once it is exceeded.
+    """
+
+    _batch = 500
+
+    def __init__(self,
+                 path: str,
+                 max_bytes: int = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS docs ('
+                               'key TEXT PRIMARY KEY, value TEXT, '
+                               'size INTEGER, accessed REAL)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS docs_accessed '
+                               'ON docs (accessed)')
+
+    @staticmethod
+    def _key(doc: str, fingerprint: str):
+        return hashlib.sha256((fingerprint + doc).encode('utf-8')).hexdigest()
+
+    def _get_many(self, keys: list):
+        found = {}
+        now = time.time()
+        with self._lock, self._conn:
+            for start in range(0, len(keys), self._batch):
+                batch = keys[start:start + self._batch]
+                marks = ','.join('?' * len(batch))
+                rows = self._conn.execute('SELECT key, value FROM docs '
+                                          'WHERE key IN ({})'.format(marks),
+                                          batch).fetchall()
+                found.update(rows)
+                self._conn.execute('UPDATE docs SET accessed = ? '
+                                   'WHERE key IN ({})'.format(marks),
+                                   [now] + batch)
+
+        return found
+
+    def _put_many(self, entries: dict):
+        now = time.time()
+        rows = [(key, value, 0 if value is None else len(value), now)
+                for key, value in entries.items()]
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO docs '
+                                   'VALUES (?, ?, ?, ?)', rows)
+            if self.max_bytes is not None:
+                self._evict()
+
+    def _evict(self):
+        size = self._conn.execute('SELECT COALESCE(SUM(size), 0) '
+                                  'FROM docs').fetchone()[0]
+        while size > self.max_bytes:
+            rows = self._conn.execute('SELECT key, size FROM docs '
+                                      'ORDER BY accessed LIMIT ?',
+                                      (self._batch,)).fetchall()
+            if not rows:
+                break
+
+            evicted = []
+            for key, entry_size in rows:
+                if size <= self.max_bytes:
+                    break
+                evicted.append((key,))
+                size -= entry_size
+
+            self._conn.executemany('DELETE FROM docs WHERE key = ?', evicted)
+            self.evictions += len(evicted)
+
+    def apply(self,
+              text: pd.Series,
+              func,
+              options: dict):
+        """
+        Returns the preprocessed text, taking cached results for hits and
+        running func on the misses only.
+
+        :param text: Pandas Series of raw strings.
+        :param func: Function preprocessing a Pandas Series of strings. It may
+            drop rows but must keep the index of the rows it returns.
+        :param options: dict of JSON serializable options func depends on.
+
+        :return: Pandas Series, preprocessed text with the original index.
+        """
+        fingerprint = options_fingerprint(options)
+        keys = [self._key(doc, fingerprint) for doc in text]
+        found = self._get_many(list(dict.fromkeys(keys)))
+
+        missing = [i for i, key in enumerate(keys) if key not in found]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            # Process every distinct missing text once, by position
+            todo = {}
+            for i in missing:
+                todo.setdefault(keys[i], i)
+            positions = list(todo.values())
+            processed = func(pd.Series(text.iloc[positions].tolist(),
+                                       index=positions, dtype=object))
+
+            new = {key: None for key in todo}
+            for i, value in processed.items():
+                new[keys[i]] = json.dumps(value)
+            self._put_many(new)
+            found.update(new)
+
+        index, values = [], []
+        for ind, key in zip(text.index, keys):
+            value = found[key]
+            if value is not None:
+                index.append(ind)
+                values.append(json.loads(value))
+
+        token_list = any(isinstance(value, list) for value in values)
+        return pd.Series(values, index=pd.Index(index, dtype=text.index.dtype),
+                         name=text.name,
+                         dtype=object if token_list else None)
+
+    def stats(self):
+        """
+        :return: dict with the hits, misses and evictions since the cache was
+            opened and the number of entries and bytes stored.
+        """
+        with self._lock:
+            entries, size = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM docs'
+            ).fetchone()
+
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': entries,
+                'bytes': size}
+
+    def clear(self):
+        """
+        Removes every cached entry.
+        """
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM docs')
+
+    def close(self):
+        """
+        Closes the underlying database connection.
+        """
+        self._conn.close()
@@ -0,0 +1,178 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import threading
+import time
+import tracemalloc
+import pandas as pd
+
+# Active profilers, every instrumented stage reports to all of them
+_profilers = []
+_profilers_lock = threading.Lock()
+
+# Stages currently running in this thread, to carry memory peaks of nested
+# stages over to their parents
+_local = threading.local()
+
+
+class _NullStage:
+    """
+    Stage returned while no profiler is active, it does nothing.
+    """
+
+    rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_stage = _NullStage()
+
+
+class _Stage:
+    """
+    Times a block of code and reports it to the active profilers on exit.
+    """
+
+    def __init__(self, name: str, rows_in: int, profilers: list):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self._profilers = profilers
+        self._memory = tracemalloc.is_tracing() and \
+            any(profiler.track_memory for profiler in profilers)
+
+    def __enter__(self):
+        if self._memory:
+            stack = _local.__dict__.setdefault('stack', [])
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]._peak = max(stack[-1]._peak, peak)
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self._start_bytes = self._peak = current
+            stack.append(self)
+
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self._start
+
+        peak_bytes = None
+        if self._memory:
+            self._peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+            peak_bytes = self._peak - self._start_bytes
+            stack = _local.stack
+            stack.pop()
+            if stack:
+                stack[-1]._peak = max(stack[-1]._peak, self._peak)
+
+        record = {'stage': self.name, 'seconds': seconds,
+                  'rows_in': self.rows_in, 'rows_out': self.rows_out,
+                  'peak_bytes': peak_bytes, 'error': exc_type is not None}
+        for profiler in self._profilers:
+            profiler._record(record)
+
+        return False
+
+
+def stage(name: str,
+          rows_in: int = None):
+    """
+    Context manager instrumenting a stage of the pipeline. Set its rows_out
+    attribute before the block ends. While no profiler is active a shared
+    no-op object is returned, so instrumentation costs next to nothing.
+
+    :param name: Name of the stage, e.g. 'preprocess_text.langid'.
+    :param rows_in: Number of rows going into the stage.
+
+    :return: Stage object.
+    """
+    if not _profilers:
+        return _null_stage
+
+    return _Stage(name, rows_in, list(_profilers))
+
+
+class Profiler:
+    """
+    Records the wall time, rows in and out and optionally the peak memory of
+    every instrumented stage (preprocess_text and its steps, vectorization
+    and similarity calculation) run while it is active, in any thread.
+
+        with Profiler() as profiler:
+            preprocess_text(text, lemma=True)
+        profiler.summary()
+
+    :param callbacks: Callables receiving the dict of every finished stage,
+        e.g. to forward it to a metrics system.
+    :param track_memory: Whether or not to record the peak memory allocated
+        during every stage with tracemalloc, which slows down allocations.
+        Memory allocated by numpy, scipy and Python objects is traced, memory
+        allocated internally by spaCy models is not. Default False.
+    """
+
+    def __init__(self,
+                 callbacks=(),
+                 track_memory: bool = False):
+        self.callbacks = list(callbacks)
+        self.track_memory = track_memory
+        self.records = []
+        self._lock = threading.Lock()
+        self._started_tracing = False
+
+    def __enter__(self):
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+        with _profilers_lock:
+            _profilers.append(self)
+
+        return self
+
+    def __exit__(self, *exc_info):
+        with _profilers_lock:
+            _profilers.remove(self)
+
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+        return False
+
+    def _record(self, record: dict):
+        with self._lock:
+            self.records.append(record)
+
+        for callback in self.callbacks:
+            callback(record)
+
+    def report(self):
+        """
+        :return: Pandas DataFrame with a row per finished stage, in the order
+            they finished: stage, seconds, rows_in, rows_out, peak_bytes and
+            error.
+        """
+        with self._lock:
+            records = list(self.records)
+
+        return pd.DataFrame(records, columns=['stage', 'seconds', 'rows_in',
+                                              'rows_out', 'peak_bytes',
+                                              'error'])
+
+    def summary(self):
+        """
+        :return: Pandas DataFrame indexed by stage with the number of calls,
+            the total seconds, rows in and rows out and the maximum peak
+            memory.
+        """
+        return self.report().groupby('stage', sort=False).agg(
+            calls=('seconds', 'size'), seconds=('seconds', 'sum'),
+            rows_in=('rows_in', 'sum'), rows_out=('rows_out', 'sum'),
+            peak_bytes=('peak_bytes', 'max'))
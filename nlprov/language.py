@@ -0,0 +1,241 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import pandas as pd
+from langid.langid import LanguageIdentifier, model
+
+# Identifier used inside process pool workers, created once per worker
+_worker_identifier = None
+
+
+@lru_cache(maxsize=1)
+def _base_identifier():
+    # Decoding the model string is the slow part, so it is done once per
+    # process and shared by every identifier
+    return LanguageIdentifier.from_modelstring(model, norm_probs=False)
+
+
+def _make_identifier(languages):
+    base = _base_identifier()
+    identifier = LanguageIdentifier(base.nb_ptc, base.nb_pc, base.nb_numfeats,
+                                    base.nb_classes, base.tk_nextmove,
+                                    base.tk_output, norm_probs=False)
+    if languages:
+        identifier.set_languages(list(languages))
+
+    return identifier
+
+
+def _init_worker(languages):
+    global _worker_identifier
+    _worker_identifier = _make_identifier(languages)
+
+
+def _classify_worker(doc: str):
+    return _worker_identifier.classify(doc)[0]
+
+
+class LanguageDetector:
+    """
+    Language identification backed by langid with deduplication of identical
+    texts, a bounded LRU cache of results, optional restriction of the
+    candidate languages, an optional process pool and a shortcut for very
+    short strings.
+
+    :param languages: Optional list of ISO 639-1 codes to restrict the
+        candidate languages to, as in langid.set_languages.
+    :param cache_size: Maximum number of texts whose language is memoized.
+        0 disables the cache.
+    :param min_length: Texts with fewer characters than this are not
+        classified but assigned short_text_lang. Default 0 classifies all.
+    :param short_text_lang: Language assigned to texts shorter than
+        min_length.
+    :param n_process: Number of worker processes used to classify the unique
+        uncached texts of a batch. The pool is started on first use and kept
+        for later batches until close is called. Default 1 classifies
+        in-process.
+    """
+
+    def __init__(self,
+                 languages: list = None,
+                 cache_size: int = 100000,
+                 min_length: int = 0,
+                 short_text_lang: str = 'en',
+                 n_process: int = 1):
+        self.languages = tuple(languages) if languages else None
+        self.cache_size = cache_size
+        self.min_length = min_length
+        self.short_text_lang = short_text_lang
+        self.n_process = n_process
+
+        self._identifier = None
+        self._executor = None
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def identifier(self):
+        # Loading the langid model is not free, so only do it when needed
+        if self._identifier is None:
+            with self._lock:
+                if self._identifier is None:
+                    self._identifier = _make_identifier(self.languages)
+
+        return self._identifier
+
+    def _lookup(self, doc: str):
+        with self._lock:
+            lang = self._cache.get(doc)
+            if lang is not None:
+                self._cache.move_to_end(doc)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return lang
+
+    def _store(self, results: dict):
+        if self.cache_size <= 0:
+            return
+
+        with self._lock:
+            self._cache.update(results)
+            for doc in results:
+                self._cache.move_to_end(doc)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    @property
+    def executor(self):
+        # Workers decode the langid model when they start, so the pool is
+        # reused across batches rather than started for every one
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        self.n_process, initializer=_init_worker,
+                        initargs=(self.languages,))
+
+        return self._executor
+
+    def _classify_many(self, docs: list):
+        if self.n_process > 1 and len(docs) > 1:
+            chunksize = max(1, len(docs) // (self.n_process * 4))
+            return list(self.executor.map(_classify_worker, docs,
+                                          chunksize=chunksize))
+
+        return [self.identifier.classify(doc)[0] for doc in docs]
+
+    def classify(self, doc: str):
+        """
+        Identifies the language of a single text.
+
+        :param doc: String to classify.
+
+        :return: String, ISO 639-1 language code.
+        """
+        return self.classify_many([doc])[0]
+
+    def classify_many(self, docs):
+        """
+        Identifies the language of many texts, classifying every distinct
+        uncached text only once.
+
+        :param docs: Iterable of strings.
+
+        :return: List of ISO 639-1 language codes in input order.
+        """
+        docs = list(docs)
+        results = {}
+        todo = []
+        for doc in dict.fromkeys(docs):
+            if len(doc) < self.min_length:
+                results[doc] = self.short_text_lang
+                continue
+
+            lang = self._lookup(doc)
+            if lang is None:
+                todo.append(doc)
+            else:
+                results[doc] = lang
+
+        if todo:
+            classified = dict(zip(todo, self._classify_many(todo)))
+            self._store(classified)
+            results.update(classified)
+
+        return [results[doc] for doc in docs]
+
+    def detect_series(self, text: pd.Series):
+        """
+        Identifies the language of every document of a Series.
+
+        :param text: Pandas Series of strings.
+
+        :return: Pandas Series of ISO 639-1 language codes with the original
+            index.
+        """
+        return pd.Series(self.classify_many(text), index=text.index,
+                         dtype=object)
+
+    def cache_info(self):
+        """
+        :return: dict with the cache hits, misses and current size.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._cache)}
+
+    def clear_cache(self):
+        """
+        Empties the cache and resets its statistics.
+        """
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def close(self):
+        """
+        Shuts down the worker processes, if any were started. The detector
+        can still be used afterwards and starts a new pool when needed.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+_default_detector = None
+_default_detector_lock = threading.Lock()
+
+
+def get_language_detector():
+    """
+    Returns the process-wide LanguageDetector used by preprocess_text when no
+    detector is given.
+
+    :return: LanguageDetector object.
+    """
+    global _default_detector
+    if _default_detector is None:
+        with _default_detector_lock:
+            if _default_detector is None:
+                _default_detector = LanguageDetector()
+
+    return _default_detector
@@ -0,0 +1,200 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import re
+from functools import lru_cache
+import pandas as pd
+
+DEFAULT_REPLACE = {'\xa0': ' '}
+
+# Escapes of a replacement template: octal escapes, numbered group
+# references and any other escaped character
+_TEMPLATE_ESCAPE = re.compile(r'\\(?:([1-7][0-7]{2}|0[0-7]{0,2})|'
+                              r'([1-9][0-9]?)|g<([0-9]+)>|.)', re.DOTALL)
+
+
+def _shift_template(repl: str, offset: int):
+    """
+    Shifts the numbered group references of a replacement template by offset,
+    so a key's template can be expanded from a match of the alternation the
+    key is part of. Named groups keep their names.
+    """
+    def shift(match):
+        group = match.group(2) or match.group(3)
+        if group is None:
+            return match.group(0)
+        return '\\g<{}>'.format(int(group) + offset)
+
+    return _TEMPLATE_ESCAPE.sub(shift, repl)
+
+
+# Tokens of a pattern: escapes (octal, numbered backreference or other),
+# character classes, conditionals on a numbered group and any other character
+_PATTERN_TOKEN = re.compile(r'\\(?:[0-7]{3}|0[0-7]{0,2}|([1-9][0-9]?)|.)|'
+                            r'\[\^?\]?(?:\\.|[^\]\\])*\]|'
+                            r'\(\?\(([0-9]+)\)|.', re.DOTALL)
+
+
+def _shift_pattern(pattern: str, offset: int):
+    """
+    Shifts the numbered backreferences and conditionals of a pattern by
+    offset, so the key still refers to its own groups once it is part of the
+    alternation. Raises re.error if a backreference can't be numbered past 99.
+    """
+    def shift(match):
+        if match.group(1) is not None:
+            group = int(match.group(1)) + offset
+            if group > 99:
+                raise re.error('cannot refer to group {}'.format(group))
+            return '(?:\\{})'.format(group)
+        if match.group(2) is not None:
+            return '(?({})'.format(int(match.group(2)) + offset)
+        return match.group(0)
+
+    return _PATTERN_TOKEN.sub(shift, pattern)
+
+
+class TextNormalizer:
+    """
+    Precompiled text normalization: lowercasing, substituting characters
+    outside of a regex with spaces, collapsing whitespace and dictionary
+    replacement. Every document is normalized in a single Python pass and the
+    replace_dict keys are compiled into one alternation, so the object is
+    cheap to reuse across calls.
+
+    :param lowercase: Whether or not to lowercase text.
+    :param regex: Regular expression of characters to keep.
+    :param replace_dict: An optional dictionary of regular expressions and
+        their replacements. Keys are matched simultaneously, left to right,
+        so the output of one replacement is not matched again by later keys.
+    """
+
+    def __init__(self,
+                 lowercase: bool = True,
+                 regex: str = '(?![A-Za-z0-9]).',
+                 replace_dict: dict = None):
+        self.lowercase = lowercase
+        self.regex = re.compile(regex)
+
+        self.replace_dict = dict(DEFAULT_REPLACE)
+        self.replace_dict.update(replace_dict or {})
+        self._compile_replace()
+
+    def _compile_replace(self):
+        # Wrap every key in its own group and remember which group maps to
+        # which key, taking the key's own groups into account.
+        parts = []
+        self._replacements = {}
+        group = 1
+        for pattern, repl in self.replace_dict.items():
+            compiled = re.compile(pattern)
+            parts.append((pattern, group))
+            template = None
+            if '\\' in repl:
+                template = _shift_template(repl, group)
+            self._replacements[group] = (compiled, repl, template)
+            group += compiled.groups + 1
+
+        try:
+            self._replace_regex = re.compile('|'.join(
+                '({})'.format(_shift_pattern(pattern, offset))
+                for pattern, offset in parts))
+        except re.error:
+            # e.g. duplicated group names or backreferences past group 99,
+            # fall back to one pass per key
+            self._replace_regex = None
+
+    def _replace_match(self, match):
+        # The outer group of a key closes last, so it is the last index.
+        # Templates are expanded from the whole match, which keeps the
+        # lookaround and word boundary context of the key.
+        _, repl, template = self._replacements[match.lastindex]
+        if template is None:
+            return repl
+
+        return match.expand(template)
+
+    def normalize(self, doc: str):
+        """
+        Lowercases, applies the regex and collapses whitespace of a document.
+
+        :param doc: String to normalize.
+
+        :return: String, normalized document.
+        """
+        if self.lowercase:
+            doc = doc.lower()
+
+        return ' '.join(self.regex.sub(' ', doc).split())
+
+    def replace(self, doc: str):
+        """
+        Applies the dictionary replacement to a document.
+
+        :param doc: String to apply the replacement to.
+
+        :return: String with all replace_dict keys replaced.
+        """
+        if self._replace_regex is None:
+            for compiled, repl, _ in self._replacements.values():
+                doc = compiled.sub(repl, doc)
+            return doc
+
+        return self._replace_regex.sub(self._replace_match, doc)
+
+    def __call__(self, doc: str):
+        return self.replace(self.normalize(doc))
+
+    def normalize_series(self,
+                         text: pd.Series,
+                         replace: bool = False):
+        """
+        Normalizes every document of a Series in a single pass.
+
+        :param text: Pandas Series of strings.
+        :param replace: Whether or not to also apply the dictionary
+            replacement in the same pass.
+
+        :return: Pandas Series, normalized text with the original index.
+        """
+        func = self if replace else self.normalize
+        return pd.Series([func(doc) for doc in text], index=text.index,
+                         name=text.name)
+
+    def replace_series(self, text: pd.Series):
+        """
+        Applies the dictionary replacement to every string of a Series. Token
+        lists are left untouched.
+
+        :param text: Pandas Series of strings or token lists.
+
+        :return: Pandas Series with the original index.
+        """
+        return pd.Series([self.replace(doc) if isinstance(doc, str) else doc
+                          for doc in text], index=text.index, name=text.name)
+
+
+@lru_cache(maxsize=32)
+def _cached_normalizer(lowercase: bool,
+                       regex: str,
+                       replace_items: tuple):
+    return TextNormalizer(lowercase, regex, dict(replace_items))
+
+
+def get_normalizer(lowercase: bool = True,
+                   regex: str = '(?![A-Za-z0-9]).',
+                   replace_dict: dict = None):
+    """
+    Returns a shared TextNormalizer for the given options, compiling it only
+    the first time the options are seen.
+
+    :param lowercase: Whether or not to lowercase text.
+    :param regex: Regular expression of characters to keep.
+    :param replace_dict: An optional dictionary of symbols and terms to
+        replace.
+
+    :return: TextNormalizer object.
+    """
+    return _cached_normalizer(lowercase, regex,
+                              tuple((replace_dict or {}).items()))
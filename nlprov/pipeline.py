@@ -0,0 +1,281 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import inspect
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from nlprov import get_spacy_lemma_nlp, get_spacy_tokenizer_nlp
+from nlprov.preprocessing import preprocess_text
+from nlprov.normalization import get_normalizer
+from nlprov.language import get_language_detector
+from nlprov.stemming import get_stemmer
+from nlprov.vectorize import vectorize_text, vectorize_new_text
+from nlprov.similarity_calc import supported_metrics, SimilarityEngine
+from nlprov.storage import save_vectorized, load_vectorized, \
+    _params_to_json, _params_from_json
+
+PIPELINE_FORMAT_VERSION = 1
+
+# Options of preprocess_text that are objects rather than configuration;
+# the pipeline resolves them once instead
+_runtime_options = ['text', 'lang_detector', 'stemmer', 'cache']
+
+
+class Pipeline:
+    """
+    End-to-end preprocessing, vectorization and similarity search with the
+    options compiled once. Options are validated when the pipeline is
+    created, the normalizer, language detector, stemmer and spaCy pipeline
+    the options need are resolved up front and the fitted corpus is
+    normalized for the metric once, so repeated transform and query calls
+    only do per-document work. The configuration is plain JSON and the
+    fitted pipeline saves to a single directory that can be deployed to and
+    memory mapped by every scoring worker, which share the corpus pages
+    rather than copying them.
+
+    :param preprocess_kwargs: dict of keyworded arguments for preprocess_text,
+        except text, lang_detector, stemmer and cache.
+    :param vec_type: string indicating what type of vectorization, see
+        vectorize_text.
+    :param vectorizer_kwargs: dict of keyworded arguments for the vectorizer,
+        see vectorize_text.
+    :param metric: string indicating the similarity/distance metric to be used,
+        cosine is the default.
+    :param compact: If True, vectorize and score in float32, see
+        vectorize_text. Default False.
+    :param memory_budget: Bytes of working memory for scoring queries, see
+        SimilarityEngine.
+    :param n_jobs: Number of threads scoring queries. -1 uses all cores.
+        Default 1.
+    """
+
+    def __init__(self,
+                 preprocess_kwargs: dict = None,
+                 vec_type: str = 'count',
+                 vectorizer_kwargs: dict = None,
+                 metric: str = 'cosine',
+                 compact: bool = False,
+                 memory_budget: int = 256 * 2 ** 20,
+                 n_jobs: int = 1):
+        assert vec_type in ['count', 'tfidf', 'hashing', 'hashing_tfidf']
+        assert metric in supported_metrics
+
+        self.preprocess_kwargs = dict(preprocess_kwargs or {})
+        self.vec_type = vec_type
+        self.vectorizer_kwargs = dict(vectorizer_kwargs or {})
+        self.metric = metric
+        self.compact = compact
+        self.memory_budget = memory_budget
+        self.n_jobs = n_jobs
+
+        self.vectorized = None
+        self.vectorizer_obj = None
+        self.engine = None
+
+        self._compile()
+
+    def _compile(self):
+        unknown = set(self.preprocess_kwargs).difference(
+            inspect.signature(preprocess_text).parameters)
+        unknown.update(set(self.preprocess_kwargs).intersection(
+            _runtime_options))
+        if unknown:
+            raise Exception('Unsupported preprocessing options: {}'.format(
+                ', '.join(sorted(unknown))))
+
+        # Fail on invalid options now rather than on the first documents
+        options = inspect.signature(preprocess_text).bind(
+            None, **self.preprocess_kwargs)
+        options.apply_defaults()
+        options = options.arguments
+        if options['stem'] and options['lemma']:
+            raise Exception('stem and lemma cannot both be true')
+        assert options['dedup'] in [False, None, True, 'raw', 'normalized']
+        assert options['tokenizer'] in ['spacy', 'whitespace']
+        assert options['lemma_mode'] in ['rule', 'lookup']
+
+        get_normalizer(options['lowercase'], options['regex'],
+                       options['replace_dict'])
+        self._runtime = {}
+        if options['eng_lang']:
+            self._runtime['lang_detector'] = get_language_detector()
+        if options['stem']:
+            self._runtime['stemmer'] = get_stemmer()
+        if options['lemma']:
+            get_spacy_lemma_nlp(lemma_mode=options['lemma_mode'])
+        elif (options['stem'] or options['token_list']) and \
+                options['tokenizer'] == 'spacy':
+            get_spacy_tokenizer_nlp()
+
+    def _build_engine(self):
+        self.engine = SimilarityEngine(self.vectorized, self.metric,
+                                       memory_budget=self.memory_budget,
+                                       n_jobs=self.n_jobs,
+                                       compact=self.compact)
+
+    def preprocess(self, text: pd.Series):
+        """
+        :param text: Pandas Series of strings.
+
+        :return: Pandas Series, preprocessed text. Rows removed by the
+            preprocessing (e.g. non-english text) are dropped.
+        """
+        return preprocess_text(text, **self.preprocess_kwargs,
+                               **self._runtime)
+
+    def fit(self, text: pd.Series):
+        """
+        Preprocesses and vectorizes the reference corpus.
+
+        :param text: Pandas Series of strings.
+
+        :return: self
+        """
+        self.vectorized, self.vectorizer_obj = vectorize_text(
+            self.preprocess(text), self.vec_type, compact=self.compact,
+            **self.vectorizer_kwargs)
+        self._build_engine()
+
+        return self
+
+    def _transform(self, text: pd.Series):
+        if self.vectorizer_obj is None:
+            raise Exception('The pipeline must be fitted or loaded first')
+
+        # Preprocess by position, so results map back to text whatever its
+        # index
+        processed = self.preprocess(text.reset_index(drop=True))
+        new_mat = vectorize_new_text(processed, self.vectorizer_obj,
+                                     self.compact)
+
+        return new_mat, processed.index.to_numpy()
+
+    def transform(self, text: pd.Series):
+        """
+        Preprocesses and vectorizes new documents with the fitted vectorizer.
+
+        :param text: Pandas Series of strings.
+
+        :return: A tuple containing the doc-feature matrix, with a row per
+            document kept by the preprocessing in order, and the pandas Index
+            of those documents in text. Rows removed by the preprocessing
+            (e.g. non-english text) are missing from both.
+        """
+        new_mat, kept = self._transform(text)
+        return new_mat, text.index[kept]
+
+    def query(self,
+              text: pd.Series,
+              top_k: int = None):
+        """
+        Scores new documents against the fitted corpus.
+
+        :param text: Pandas Series of strings.
+        :param top_k: Optional number of most similar corpus documents to
+            return per new document. If None, all similarities are returned.
+
+        :return: ndarray of dimensions n x d with all similarities if top_k is
+            None, otherwise a tuple containing indices and scores (ndarrays of
+            dimensions n x top_k) sorted by decreasing similarity per row.
+            There is a row per document of text, in order. Rows of documents
+            removed by the preprocessing (e.g. non-english text) are nan,
+            with indices -1.
+        """
+        if self.vectorizer_obj is None:
+            raise Exception('The pipeline must be fitted or loaded first')
+
+        n_old = self.vectorized.shape[0]
+        if len(text) == 0:
+            new_mat, kept = None, np.zeros(0, dtype=np.int64)
+        else:
+            new_mat, kept = self._transform(text)
+            if len(kept) == len(text):
+                return self.engine.similarities(new_mat, top_k)
+
+        scored = None
+        if len(kept):
+            scored = self.engine.similarities(new_mat, top_k)
+
+        dtype = self.engine.dtype
+        if top_k is None:
+            similarities = np.full((len(text), n_old), np.nan, dtype=dtype)
+            if scored is not None:
+                similarities[kept] = scored
+            return similarities
+
+        top_k = min(top_k, n_old)
+        indices = np.full((len(text), top_k), -1, dtype=np.int64)
+        scores = np.full((len(text), top_k), np.nan, dtype=dtype)
+        if scored is not None:
+            indices[kept], scores[kept] = scored
+
+        return indices, scores
+
+    def get_config(self):
+        """
+        :return: dict of the pipeline options, JSON serializable.
+        """
+        return {'preprocess_kwargs': self.preprocess_kwargs,
+                'vec_type': self.vec_type,
+                'vectorizer_kwargs': _params_to_json(self.vectorizer_kwargs),
+                'metric': self.metric,
+                'compact': self.compact,
+                'memory_budget': self.memory_budget,
+                'n_jobs': self.n_jobs}
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """
+        :param config: dict returned by get_config.
+
+        :return: Unfitted Pipeline object.
+        """
+        config = dict(config)
+        config['vectorizer_kwargs'] = _params_from_json(
+            config['vectorizer_kwargs'])
+        return cls(**config)
+
+    def save(self, path: str):
+        """
+        Saves the configuration, fitted vectorizer and corpus matrix as one
+        directory, see save_vectorized.
+
+        :param path: Directory to write, created if needed.
+        """
+        if self.vectorizer_obj is None:
+            raise Exception('The pipeline must be fitted before saving')
+
+        save_vectorized(path, self.vectorized, self.vectorizer_obj)
+        with open(os.path.join(path, 'pipeline.json'), 'w') as f:
+            json.dump({'version': PIPELINE_FORMAT_VERSION,
+                       'config': self.get_config()}, f)
+
+    @classmethod
+    def load(cls,
+             path: str,
+             mmap_mode: str = 'r'):
+        """
+        Loads a pipeline written by save, memory mapping the corpus.
+
+        :param path: Directory written by save.
+        :param mmap_mode: numpy memory map mode, None reads the arrays into
+            memory.
+
+        :return: Fitted Pipeline object.
+        """
+        with open(os.path.join(path, 'pipeline.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != PIPELINE_FORMAT_VERSION:
+            raise Exception('Unsupported pipeline format version {}'.format(
+                meta['version']))
+
+        pipeline = cls.from_config(meta['config'])
+        pipeline.vectorized, pipeline.vectorizer_obj = load_vectorized(
+            path, mmap_mode)
+        pipeline._build_engine()
+
+        return pipeline
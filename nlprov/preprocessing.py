@@ -2,16 +2,19 @@
 Copyright © 2020 Johnson & Johnson
 """
 
+import os
 import pandas as pd
-import re
 from spacy.lang.en.stop_words import STOP_WORDS as stop_set
 from spacy.tokens import Token
-from nltk.stem import PorterStemmer
-import langid
 
-from nlprov import get_spacy_nlp
+from nlprov import get_spacy_lemma_nlp, get_spacy_tokenizer_nlp
+from nlprov.normalization import TextNormalizer, get_normalizer
+from nlprov.language import LanguageDetector, get_language_detector
+from nlprov.stemming import CachedStemmer, get_stemmer
+from nlprov.cache import PreprocessCache
+from nlprov.instrumentation import stage
 
-ps = PorterStemmer()
+ps = get_stemmer()
 
 
 def ps_stem(token):
@@ -30,7 +33,15 @@ def preprocess_text(text: pd.Series,
                     stem: bool = False,
                     token_list: bool = False,
                     eng_lang: bool = True,
-                    stop_words: bool = False):
+                    stop_words: bool = False,
+                    n_process: int = 1,
+                    batch_size: int = None,
+                    lang_detector: LanguageDetector = None,
+                    dedup: str = None,
+                    tokenizer: str = 'spacy',
+                    stemmer: CachedStemmer = None,
+                    lemma_mode: str = 'rule',
+                    cache: PreprocessCache = None):
     """
     Preprocessing text by optionally lowercasing, applying a regex of
     characters to keep, removing extra whitespace, lemmatizing, stemming,
@@ -41,7 +52,7 @@ def preprocess_text(text: pd.Series,
     :param lowercase: Whether or not to lowercase text.
     :param regex: Regular expression of characters to keep.
     :param replace_dict: An optional dictionary of symbols and terms to
-        replace.
+        replace. Keys are regular expressions matched in a single pass.
     :param nan_handling: A string indicating removal of NAs/NaNs ('remove') or
         what should replace them in the text.
     :param lemma: Whether or not to lemmatize. Default False.
@@ -51,57 +62,331 @@ def preprocess_text(text: pd.Series,
     :param eng_lang: Remove non-english responses. Default True.
     :param stop_words: False (default) will not drop stop words. If True, spaCy
         stopwords will be removed.
+    :param n_process: Number of processes spaCy uses when lemmatizing or
+        stemming. Each worker loads the model once; -1 uses all cores.
+        Default 1.
+    :param batch_size: Number of documents spaCy buffers per batch, None uses
+        the pipeline default.
+    :param lang_detector: Optional LanguageDetector used for eng_lang, e.g. to
+        restrict candidate languages or classify in parallel. The shared
+        default detector is used if None.
+    :param dedup: Process every distinct text only once and broadcast the
+        results back to the original index. 'raw' (or True) deduplicates the
+        input text, 'normalized' deduplicates after lowercasing, regex and
+        whitespace handling. The number of rows per distinct text is stored
+        in the result's attrs['dedup_ratio']. Default None.
+    :param tokenizer: 'spacy' (default) tokenizes with spaCy, 'whitespace'
+        splits on whitespace without loading spaCy. Only applies to stemming
+        and token lists, lemmatizing always uses spaCy.
+    :param stemmer: Optional CachedStemmer used when stemming, e.g. one
+        preloaded from disk. The shared default stemmer is used if None.
+    :param lemma_mode: 'rule' (default) lemmatizes with the model's tagger and
+        rule-based lemmatizer, 'lookup' uses a lookup table without the
+        tagger, which is faster but ignores part of speech (requires
+        spacy-lookups-data).
+    :param cache: Optional PreprocessCache. Results of texts processed before
+        with the same options are taken from the cache and only the other
+        texts go through the pipeline.
 
     :return: Pandas Series, preprocessed text.
     """
-    nlp = get_spacy_nlp()
-
     if stem and lemma:
         raise Exception('stem and lemma cannot both be true')
 
+    if dedup is True:
+        dedup = 'raw'
+    assert dedup in [False, None, 'raw', 'normalized']
+    assert tokenizer in ['spacy', 'whitespace']
+    assert lemma_mode in ['rule', 'lookup']
+
+    with stage('preprocess_text', len(text)) as record:
+        text = _preprocess_text(text, lowercase, regex, replace_dict,
+                                nan_handling, lemma, stem, token_list,
+                                eng_lang, stop_words, n_process, batch_size,
+                                lang_detector, dedup, tokenizer, stemmer,
+                                lemma_mode, cache)
+        record.rows_out = len(text)
+
+    return text
+
+
+def _preprocess_text(text: pd.Series,
+                     lowercase: bool,
+                     regex: str,
+                     replace_dict: dict,
+                     nan_handling: str,
+                     lemma: bool,
+                     stem: bool,
+                     token_list: bool,
+                     eng_lang: bool,
+                     stop_words: bool,
+                     n_process: int,
+                     batch_size: int,
+                     lang_detector: LanguageDetector,
+                     dedup: str,
+                     tokenizer: str,
+                     stemmer: CachedStemmer,
+                     lemma_mode: str,
+                     cache: PreprocessCache):
+    """
+    Body of preprocess_text, once the options are validated.
+    """
     if nan_handling == 'remove':
         text = text.dropna()
     else:
         text = text.fillna(nan_handling)
 
-    if lowercase:
-        text = text.str.lower()
+    normalizer = get_normalizer(lowercase, regex, replace_dict)
+
+    # With nothing in between, the dictionary replacement can be applied in
+    # the same pass as the normalization
+    fused = not (eng_lang or stop_words or lemma or stem or token_list)
+
+    def normalize(series):
+        with stage('preprocess_text.normalize', len(series)) as record:
+            series = normalizer.normalize_series(series, replace=fused)
+            record.rows_out = len(series)
+
+        return series
+
+    def process(series):
+        return _process_normalized(series, normalizer, fused, lemma, stem,
+                                   token_list, eng_lang, stop_words,
+                                   n_process, batch_size, lang_detector,
+                                   tokenizer, stemmer, lemma_mode)
 
-    text = text.apply(lambda s: re.sub(regex, ' ', s))
+    def run(series):
+        if dedup == 'raw':
+            return _dedup_apply(series,
+                                lambda uniques: process(normalize(uniques)),
+                                token_list)
 
-    text = text.str.strip()
-    text = text.str.replace(r'\s+', ' ', regex=True)
+        series = normalize(series)
 
+        if dedup == 'normalized':
+            return _dedup_apply(series, process, token_list)
+
+        return process(series)
+
+    if cache is not None:
+        options = {'lowercase': lowercase, 'regex': regex,
+                   'replace_dict': list(normalizer.replace_dict.items()),
+                   'lemma': lemma, 'stem': stem, 'token_list': token_list,
+                   'eng_lang': eng_lang, 'stop_words': stop_words,
+                   'tokenizer': tokenizer, 'lemma_mode': lemma_mode}
+        if eng_lang:
+            detector = lang_detector or get_language_detector()
+            options['languages'] = detector.languages
+            options['min_length'] = detector.min_length
+            options['short_text_lang'] = detector.short_text_lang
+        return cache.apply(text, run, options)
+
+    return run(text)
+
+
+def _process_normalized(text: pd.Series,
+                        normalizer: TextNormalizer,
+                        fused: bool,
+                        lemma: bool,
+                        stem: bool,
+                        token_list: bool,
+                        eng_lang: bool,
+                        stop_words: bool,
+                        n_process: int,
+                        batch_size: int,
+                        lang_detector: LanguageDetector,
+                        tokenizer: str,
+                        stemmer: CachedStemmer,
+                        lemma_mode: str):
+    """
+    Runs the steps of preprocess_text that follow normalization.
+    """
     if eng_lang:
-        text = text[text.apply(lambda t: langid.classify(t)[0]) == 'en']
+        if lang_detector is None:
+            lang_detector = get_language_detector()
+        with stage('preprocess_text.langid', len(text)) as record:
+            text = text[lang_detector.detect_series(text) == 'en']
+            record.rows_out = len(text)
 
     if stop_words:
-        text = text.apply(lambda doc: ' '.join(
-            [item for item in doc.split(' ') if item not in stop_set]))
+        with stage('preprocess_text.stop_words', len(text)) as record:
+            text = text.apply(lambda doc: ' '.join(
+                [item for item in doc.split(' ') if item not in stop_set]))
+            record.rows_out = len(text)
+
+    if stem and stemmer is None:
+        stemmer = get_stemmer()
 
     # Full pipeline
-    if lemma or stem:
-        text = pd.Series(nlp.pipe(text), index=text.index)
-        for ind, val in text.iteritems():
-            end_str = []
-            for item in val:
-                if lemma:
-                    end_str.append(item.lemma_)
-                elif stem:
-                    end_str.append(item._.stem)
-
-            text[ind] = end_str
-
-        if not token_list:
-            text = text.apply(lambda desc: ' '.join([item for item in desc]))
+    if not lemma and (stem or token_list) and tokenizer == 'whitespace':
+        with stage('preprocess_text.tokenize', len(text)) as record:
+            if stem:
+                tokens = [stemmer.stem_tokens(doc.split()) for doc in text]
+            else:
+                tokens = [doc.split() for doc in text]
+            text = pd.Series(tokens, index=text.index, dtype=object)
+
+            if not token_list:
+                text = text.apply(lambda desc: ' '.join([item
+                                                         for item in desc]))
+            record.rows_out = len(text)
+    elif lemma or stem:
+        # Only run the components the requested output needs
+        if lemma:
+            nlp = get_spacy_lemma_nlp(lemma_mode=lemma_mode)
+        else:
+            nlp = get_spacy_tokenizer_nlp()
+        with stage('preprocess_text.spacy', len(text)) as record:
+            docs = nlp.pipe(text, n_process=n_process, batch_size=batch_size)
+            if lemma:
+                tokens = [[item.lemma_ for item in doc] for doc in docs]
+            else:
+                tokens = [stemmer.stem_tokens([item.text for item in doc])
+                          for doc in docs]
+
+            # Documents come back in input order, so the index can be
+            # reattached
+            text = pd.Series(tokens, index=text.index, dtype=object)
+
+            if not token_list:
+                text = text.apply(lambda desc: ' '.join([item
+                                                         for item in desc]))
+            record.rows_out = len(text)
     else:
         if token_list:
             # Only tokenization?
-            text = pd.Series([nlp.make_doc(t) for t in text], index=text.index)
-            text = text.apply(lambda doc: [tok.text for tok in doc])
+            nlp = get_spacy_tokenizer_nlp()
+            with stage('preprocess_text.spacy', len(text)) as record:
+                docs = nlp.pipe(text, n_process=n_process,
+                                batch_size=batch_size)
+                text = pd.Series([[tok.text for tok in doc] for doc in docs],
+                                 index=text.index, dtype=object)
+                record.rows_out = len(text)
 
-    dict_replace = {'\xa0': ' '}
-    dict_replace.update(replace_dict)
-    text = text.replace(dict_replace, regex=True)
+    if not fused:
+        with stage('preprocess_text.replace', len(text)) as record:
+            text = normalizer.replace_series(text)
+            record.rows_out = len(text)
 
     return text
+
+
+def _dedup_apply(text: pd.Series,
+                 func,
+                 token_list: bool):
+    """
+    Applies func to the unique values of text only and broadcasts the results
+    back to every row. Rows whose unique value was dropped by func are
+    dropped as well. The number of rows per unique value is stored in the
+    'dedup_ratio' entry of the result's attrs.
+    """
+    codes, uniques = pd.factorize(text)
+    processed = func(pd.Series(uniques, dtype=object))
+
+    positions = processed.index.get_indexer(codes)
+    keep = positions >= 0
+    values = processed.to_numpy(dtype=object)[positions[keep]]
+    if token_list:
+        # Don't let duplicated rows share (and mutate) the same list
+        values = [list(tokens) for tokens in values]
+
+    result = pd.Series(values, index=text.index[keep], name=text.name,
+                       dtype=object if token_list else None)
+    result.attrs['dedup_ratio'] = len(text) / max(len(uniques), 1)
+
+    return result
+
+
+def _iter_text_chunks(source,
+                      chunksize: int,
+                      column: str = None):
+    """
+    Splits a text source into Pandas Series chunks of at most chunksize rows,
+    each carrying the original (or running) row index.
+    """
+    if isinstance(source, pd.Series):
+        for start in range(0, len(source), chunksize):
+            yield source.iloc[start:start + chunksize]
+        return
+
+    if isinstance(source, pd.DataFrame):
+        source = [source]
+    elif isinstance(source, (str, os.PathLike)):
+        path = os.fspath(source)
+        if path.endswith(('.parquet', '.pq')):
+            source = _iter_parquet_frames(path, chunksize, column)
+        else:
+            # Read as text, or chunks of numbers would be parsed as ints
+            source = pd.read_csv(path, chunksize=chunksize, dtype=str,
+                                 usecols=None if column is None else [column])
+
+    offset = 0
+    batch = []
+    for item in source:
+        if isinstance(item, pd.DataFrame):
+            if column is None and item.shape[1] != 1:
+                raise Exception('column must be given for multi-column input')
+            item = item[column] if column is not None else item.iloc[:, 0]
+
+        if isinstance(item, pd.Series):
+            for start in range(0, len(item), chunksize):
+                chunk = item.iloc[start:start + chunksize]
+                offset += len(chunk)
+                yield chunk
+        else:
+            batch.append(item)
+            if len(batch) == chunksize:
+                yield pd.Series(batch, index=range(offset, offset + chunksize),
+                                dtype=object)
+                offset += chunksize
+                batch = []
+
+    if batch:
+        yield pd.Series(batch, index=range(offset, offset + len(batch)),
+                        dtype=object)
+
+
+def _iter_parquet_frames(path: str,
+                         chunksize: int,
+                         column: str = None):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise Exception("Please run `pip install pyarrow` to stream parquet "
+                        "files.")
+
+    offset = 0
+    parquet_file = pq.ParquetFile(path)
+    columns = None if column is None else [column]
+    for record_batch in parquet_file.iter_batches(batch_size=chunksize,
+                                                  columns=columns):
+        frame = record_batch.to_pandas()
+        frame.index = range(offset, offset + len(frame))
+        offset += len(frame)
+        yield frame
+
+
+def preprocess_stream(source,
+                      chunksize: int = 10000,
+                      column: str = None,
+                      **kwargs):
+    """
+    Preprocesses text chunk by chunk so that peak memory is bounded by the
+    chunk size rather than the corpus size. Every chunk is passed through
+    preprocess_text with the same options.
+
+    :param source: Pandas Series, DataFrame, iterable of strings, Series or
+        DataFrames (e.g. a pd.read_csv reader), or a path to a CSV or parquet
+        file.
+    :param chunksize: Maximum number of rows per chunk.
+    :param column: Name of the text column for DataFrame and file input. May
+        be omitted when the input has a single column.
+    :param **kwargs: dict of keyworded arguments for preprocess_text.
+
+    :return: Generator of Pandas Series, preprocessed text chunks carrying the
+        original index (or the running row number for iterables and files).
+    """
+    assert chunksize > 0
+
+    for chunk in _iter_text_chunks(source, chunksize, column):
+        yield preprocess_text(chunk, **kwargs)
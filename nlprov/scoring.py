@@ -0,0 +1,239 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+from nlprov.preprocessing import preprocess_text
+from nlprov.vectorize import vectorize_new_text
+from nlprov.similarity_calc import SimilarityEngine
+from nlprov.storage import load_vectorized
+
+
+class AsyncScorer:
+    """
+    asyncio front end for scoring single documents against a reference
+    corpus: preprocess_text, vectorize_new_text and the similarity
+    calculation. The fitted vectorizer and the reference matrix are held for
+    the life of the object. Requests that arrive within max_wait seconds of
+    each other are micro-batched into one preprocess, vectorize and score
+    call, which runs in an executor so the event loop stays responsive.
+    Batches are scored one at a time; requests arriving meanwhile form the
+    next batch, so batches grow with the load instead of the latency.
+
+    :param vectorizer_obj: Trained vectorizer object from vectorizing old text.
+    :param old_mat: scipy csr object of dimensions d x f for d documents and
+        f features representing the old document-feature matrix.
+    :param metric: string indicating the similarity/distance metric to be used,
+        cosine is the default.
+    :param top_k: Optional number of most similar old documents to return per
+        request. If None, all similarities are returned.
+    :param preprocess_kwargs: dict of keyworded arguments for preprocess_text.
+    :param max_batch_size: Maximum number of requests scored at once.
+    :param max_wait: Seconds to wait for more requests after the first one of
+        a batch arrived.
+    :param executor: Optional concurrent.futures executor for the scoring.
+        By default a single thread owned by the scorer.
+    :param compact: If True, vectorize and score in float32, see
+        similarity_calculation. Default False.
+    :param history: Number of most recent requests and batches the metrics
+        are computed over.
+    """
+
+    def __init__(self,
+                 vectorizer_obj,
+                 old_mat,
+                 metric: str = 'cosine',
+                 top_k: int = None,
+                 preprocess_kwargs: dict = None,
+                 max_batch_size: int = 64,
+                 max_wait: float = 0.005,
+                 executor=None,
+                 compact: bool = False,
+                 history: int = 10000):
+        assert max_batch_size > 0 and max_wait >= 0
+
+        self.vectorizer_obj = vectorizer_obj
+        self.engine = SimilarityEngine(old_mat, metric, compact=compact)
+        self.top_k = top_k
+        self.preprocess_kwargs = dict(preprocess_kwargs or {})
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.compact = compact
+
+        self._own_executor = executor is None
+        self.executor = ThreadPoolExecutor(1) if executor is None else executor
+
+        self.requests = 0
+        self.batches = 0
+        self._latencies = deque(maxlen=history)
+        self._batch_sizes = deque(maxlen=history)
+        self._loop = None
+        self._queue = None
+        self._worker = None
+
+    @classmethod
+    def load(cls,
+             path: str,
+             mmap_mode: str = 'r',
+             **kwargs):
+        """
+        Creates a scorer from a corpus and vectorizer written by
+        save_vectorized, memory mapping the reference matrix.
+
+        :param path: Directory written by save_vectorized.
+        :param mmap_mode: numpy memory map mode, None reads the arrays into
+            memory.
+        :param **kwargs: Keyworded arguments of AsyncScorer.
+
+        :return: AsyncScorer object.
+        """
+        vectorized, vectorizer_obj = load_vectorized(path, mmap_mode)
+        return cls(vectorizer_obj, vectorized, **kwargs)
+
+    def score_batch(self, texts: list):
+        """
+        Scores a batch of raw documents synchronously.
+
+        :param texts: List of raw strings.
+
+        :return: List with, per document, an ndarray of its similarity to every
+            old document, or a tuple of the indices and scores of the top_k
+            most similar ones. Documents removed by preprocessing (e.g.
+            non-english text) get None.
+        """
+        results = [None] * len(texts)
+        processed = preprocess_text(pd.Series(texts, dtype=object),
+                                    **self.preprocess_kwargs)
+        if len(processed) == 0:
+            return results
+
+        new_mat = vectorize_new_text(processed, self.vectorizer_obj,
+                                     self.compact)
+        scored = self.engine.similarities(new_mat, self.top_k)
+        for row, i in enumerate(processed.index):
+            if self.top_k is None:
+                results[i] = scored[row]
+            else:
+                results[i] = scored[0][row], scored[1][row]
+
+        return results
+
+    async def score(self, text: str):
+        """
+        Scores one raw document, batched with concurrent requests.
+
+        :param text: Raw string.
+
+        :return: Same as an entry of score_batch.
+        """
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._loop is not loop:
+            # First request, or the scorer is used from a new event loop
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._batch_loop())
+
+        future = loop.create_future()
+        self._queue.put_nowait((text, future, time.perf_counter()))
+        return await future
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(),
+                                                    timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            texts = [text for text, _, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor,
+                                                     self.score_batch, texts)
+            except asyncio.CancelledError:
+                for _, future, _ in batch:
+                    future.cancel()
+                raise
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            now = time.perf_counter()
+            self.requests += len(batch)
+            self.batches += 1
+            self._batch_sizes.append(len(batch))
+            for (_, future, start), result in zip(batch, results):
+                self._latencies.append(now - start)
+                # The caller may have given up on the request
+                if not future.done():
+                    future.set_result(result)
+
+    def metrics(self):
+        """
+        :return: dict with the number of requests and batches scored, and the
+            mean and maximum batch size and the mean, median and 99th
+            percentile latency in seconds over the recent history.
+        """
+        metrics = {'requests': self.requests, 'batches': self.batches,
+                   'mean_batch_size': None, 'max_batch_size': None,
+                   'latency_mean': None, 'latency_p50': None,
+                   'latency_p99': None}
+        if self._batch_sizes:
+            batch_sizes = np.asarray(self._batch_sizes)
+            latencies = np.asarray(self._latencies)
+            metrics.update({'mean_batch_size': float(batch_sizes.mean()),
+                            'max_batch_size': int(batch_sizes.max()),
+                            'latency_mean': float(latencies.mean()),
+                            'latency_p50': float(np.percentile(latencies, 50)),
+                            'latency_p99': float(np.percentile(latencies,
+                                                               99))})
+
+        return metrics
+
+    async def aclose(self):
+        """
+        Stops batching and shuts down the executor if the scorer created it.
+        Pending requests are cancelled.
+        """
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            while not self._queue.empty():
+                _, future, _ = self._queue.get_nowait()
+                future.cancel()
+            self._worker = None
+
+        if self._own_executor:
+            self.executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
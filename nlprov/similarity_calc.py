@@ -2,8 +2,25 @@
 Copyright © 2020 Johnson & Johnson
 """
 
+import os
+import threading
+import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
 from sklearn.metrics import pairwise_distances
+from sklearn.utils.extmath import row_norms
+
+from nlprov.vectorize import compact_matrix
+from nlprov.instrumentation import stage
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
 
 supported_metrics = ['cosine', 'jaccard', 'manhattan', 'dice', 'hamming']
 
@@ -13,25 +30,33 @@ dense_metrics = ['braycurtis', 'canberra', 'chebyshev', 'correlation',
                  'minkowski', 'rogerstanimoto', 'russellrao', 'seuclidean',
                  'sokalmichener', 'sokalsneath', 'sqeuclidean', 'yule']
 
+# Dense metrics that are computed directly on sparse input
+sparse_native_metrics = ['jaccard', 'dice', 'hamming']
+
 
 def similarity_calculation(new_mat,
                            old_mat,
-                           metric: str = 'cosine'):
+                           metric: str = 'cosine',
+                           compact: bool = False):
     """
     Calculate similarity between two sparse document-feature matrices
-    representing the new document-feature matrix (1 x f)
+    representing the new document-feature matrix (n x f)
     and the old document-feature matrix(d x f)
 
-    :param new_mat: scipy csr object of dimensions d x f for d documents and
-        f features representing the new document-feature matrix, it should
-        always be 1 x f.
+    :param new_mat: scipy csr object of dimensions n x f for n documents and
+        f features representing the new document-feature matrix.
     :param old_mat: scipy csr object of dimensions d x f for d documents and
         f features representing the old document-feature matrix, it should
         always be d x f.
     :param metric: string indicating the similarity/distance metric to be used,
         cosine is the default.
+    :param compact: If True, the matrices are converted to float32 with int32
+        indices (see vectorize.compact_matrix) and float32 similarities are
+        returned, which take half the memory. Scores differ from the float64
+        ones by about 1e-6. Default False.
 
-    :return: ndarray, similarity for each old document.
+    :return: ndarray of dimensions n x d, similarity for each new and old
+        document.
     """
 
     # Check that metric is supported
@@ -40,14 +65,133 @@ def similarity_calculation(new_mat,
     # Check dimensionality of new and old are compatible
     assert new_mat.shape[1] == old_mat.shape[1]
 
-    # Check that new only contains a single nc
-    assert new_mat.shape[0] == 1
+    if _densifies(new_mat, old_mat, metric):
+        _warn_dense()
+
+    with stage('similarity_calculation', new_mat.shape[0]) as record:
+        if compact:
+            new_mat, old_mat = _compact(new_mat), _compact(old_mat)
+
+        similarities = _similarities(new_mat, old_mat, metric)
+        if compact:
+            similarities = similarities.astype(np.float32, copy=False)
+        record.rows_out = similarities.shape[0]
+
+    return similarities
+
+
+def _compact(mat):
+    if sp.issparse(mat):
+        return compact_matrix(mat)
+
+    return np.asarray(mat, dtype=np.float32)
+
+
+def _score_dtype(new_mat, old_mat):
+    # float32 inputs keep float32 scores, anything else is scored in float64
+    return np.result_type(new_mat.dtype, old_mat.dtype, np.float32)
+
+
+def _warn_dense():
+    warnings.warn("Your choice of distance does not support sparse " + \
+                  "input and will now be converted to dense " + \
+                  "representation. This will take up significantly " + \
+                  "more memory.")
+
+
+def _densifies(new_mat,
+               old_mat,
+               metric: str):
+    if metric not in dense_metrics:
+        return False
+
+    return not (metric in sparse_native_metrics and sp.issparse(new_mat)
+                and sp.issparse(old_mat))
+
+
+def _binarize(mat, dtype=np.float64):
+    binary = sp.csr_matrix(mat, dtype=dtype, copy=True)
+    binary.data = (binary.data != 0).astype(dtype)
+    return binary
+
+
+def _equal_values(new_mat,
+                  old_mat,
+                  dtype):
+    """
+    Counts the features where a new and an old document hold the same
+    non-zero value. Every distinct (feature, value) pair becomes a column of
+    a binary matrix, so a single sparse product gives the counts whatever
+    the number of distinct values.
+    """
+    new_mat = sp.csr_matrix(new_mat)
+    old_mat = sp.csr_matrix(old_mat)
+    columns = np.concatenate([new_mat.indices, old_mat.indices])
+    values = np.concatenate([new_mat.data, old_mat.data]).astype(np.float64)
+
+    order = np.lexsort((values, columns))
+    changed = np.ones(len(order), dtype=bool)
+    changed[1:] = (np.diff(columns[order]) != 0) | \
+        (np.diff(values[order]) != 0)
+    pairs = np.empty(len(order), dtype=np.int64)
+    pairs[order] = np.cumsum(changed) - 1
+    n_pairs = int(changed.sum())
+
+    # Explicitly stored zeros are not present in either document
+    new_pairs = sp.csr_matrix(((new_mat.data != 0).astype(dtype),
+                               pairs[:new_mat.nnz], new_mat.indptr),
+                              shape=(new_mat.shape[0], n_pairs))
+    old_pairs = sp.csr_matrix(((old_mat.data != 0).astype(dtype),
+                               pairs[new_mat.nnz:], old_mat.indptr),
+                              shape=(old_mat.shape[0], n_pairs))
+
+    return (new_pairs @ old_pairs.T).toarray()
+
+
+def _sparse_similarities(new_mat,
+                         old_mat,
+                         metric: str):
+    """
+    Computes jaccard, dice or hamming similarities of sparse matrices without
+    densifying them. Intersections of term presence come from a sparse
+    product of the binarized matrices and unions from the row counts.
+    """
+    dtype = _score_dtype(new_mat, old_mat)
+    new_bin = _binarize(new_mat, dtype)
+    old_bin = _binarize(old_mat, dtype)
+
+    new_counts = np.asarray(new_bin.sum(axis=1))
+    old_counts = np.asarray(old_bin.sum(axis=1)).T
+    both = (new_bin @ old_bin.T).toarray()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if metric == 'jaccard':
+            union = new_counts + old_counts - both
+            # Two empty documents have distance 0, as in scipy
+            return np.where(union == 0, 1.0, both / union)
+
+        if metric == 'dice':
+            # Two empty documents are undefined (nan), as in scipy
+            return 2 * both / (new_counts + old_counts)
+
+    # Hamming compares the values themselves: features present in only one
+    # document and shared features holding different values are mismatches
+    equal = _equal_values(new_mat, old_mat, dtype)
+    mismatches = new_counts + old_counts - both - equal
+    return 1 - mismatches / new_mat.shape[1]
+
+
+def _similarities(new_mat,
+                  old_mat,
+                  metric: str):
+    """
+    Computes 1 - distances between the rows of new_mat and old_mat, reusing
+    the distance array for the result.
+    """
+    if not _densifies(new_mat, old_mat, metric) and metric in dense_metrics:
+        return _sparse_similarities(new_mat, old_mat, metric)
 
     if metric in dense_metrics:
-        warnings.warn("Your choice of distance does not support sparse " + \
-                      "input and will now be converted to dense " + \
-                      "representation. This will take up significantly " + \
-                      "more memory.")
         old_mat = old_mat.toarray()
         new_mat = new_mat.toarray()
 
@@ -56,6 +200,432 @@ def similarity_calculation(new_mat,
             new_mat = new_mat.astype(bool)
 
     # Calculate distance using sklearn and do 1 - distances
-    similarities = 1 - pairwise_distances(new_mat, old_mat, metric=metric)
+    similarities = pairwise_distances(new_mat, old_mat, metric=metric)
+    np.subtract(1, similarities, out=similarities)
 
     return similarities
+
+
+def similarity_search(new_mat,
+                      old_mat,
+                      metric: str = 'cosine',
+                      top_k: int = 10,
+                      threshold: float = None,
+                      block_size: int = 10000):
+    """
+    Finds the old documents most similar to a new document. old_mat is
+    scanned in blocks of rows and only the best candidates of every block
+    are kept, so memory is bounded by the block size instead of the number
+    of old documents.
+
+    :param new_mat: scipy csr object of dimensions 1 x f representing the new
+        document-feature matrix.
+    :param old_mat: scipy csr object of dimensions d x f for d documents and
+        f features representing the old document-feature matrix.
+    :param metric: string indicating the similarity/distance metric to be used,
+        cosine is the default.
+    :param top_k: Number of most similar documents to return, None for all
+        documents above the threshold.
+    :param threshold: Optional minimum similarity of the returned documents.
+    :param block_size: Number of old documents scored at once.
+
+    :return: A tuple containing indices (ndarray of row numbers in old_mat)
+        and scores (ndarray of their similarities), sorted by decreasing
+        similarity.
+    """
+
+    # Check that metric is supported
+    assert metric in supported_metrics
+
+    # Check dimensionality of new and old are compatible
+    assert new_mat.shape[1] == old_mat.shape[1]
+
+    # Check that new only contains a single nc
+    assert new_mat.shape[0] == 1
+
+    assert top_k is not None or threshold is not None
+    assert block_size > 0
+
+    if _densifies(new_mat, old_mat, metric):
+        _warn_dense()
+
+    best_indices = np.empty(0, dtype=np.int64)
+    best_scores = np.empty(0, dtype=np.float64)
+    for start in range(0, old_mat.shape[0], block_size):
+        scores = _similarities(new_mat, old_mat[start:start + block_size],
+                               metric)[0]
+        indices = np.arange(start, start + len(scores))
+
+        if threshold is not None:
+            keep = scores >= threshold
+            scores, indices = scores[keep], indices[keep]
+
+        best_indices = np.concatenate([best_indices, indices])
+        best_scores = np.concatenate([best_scores, scores])
+        if top_k is not None and len(best_scores) > top_k:
+            # Partial selection, no need to sort all candidates
+            keep = np.argpartition(-best_scores, top_k - 1)[:top_k]
+            best_indices, best_scores = best_indices[keep], best_scores[keep]
+
+    # Highest score first, ties in row order
+    order = np.lexsort((best_indices, -best_scores))
+
+    return best_indices[order], best_scores[order]
+
+
+def _to_dense(mat):
+    return mat.toarray() if sp.issparse(mat) else np.asarray(mat)
+
+
+def _top_k_columns(indices, scores, top_k: int):
+    # Partial selection per row, no need to sort all candidates
+    keep = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    return (np.take_along_axis(indices, keep, axis=1),
+            np.take_along_axis(scores, keep, axis=1))
+
+
+def _sort_rows(indices, scores):
+    # Highest score first, ties in row order
+    order = np.lexsort((indices, -scores), axis=1)
+    return (np.take_along_axis(indices, order, axis=1),
+            np.take_along_axis(scores, order, axis=1))
+
+
+def _inverse_row_norms(mat, block_size: int = 100000):
+    """
+    1 / L2 norm of every row, 0 for empty rows. Sparse matrices are read
+    straight from their data array in blocks of rows, so no copy of mat is
+    made.
+    """
+    inverse_norms = np.zeros(mat.shape[0])
+    for start in range(0, mat.shape[0], block_size):
+        if sp.issparse(mat):
+            bounds = np.asarray(mat.indptr[start:start + block_size + 1])
+            squares = np.square(mat.data[bounds[0]:bounds[-1]],
+                                dtype=np.float64)
+            # reduceat needs non-empty segments, empty rows keep 0
+            non_empty = bounds[1:] > bounds[:-1]
+            norms = np.zeros(len(bounds) - 1)
+            if squares.size:
+                norms[non_empty] = np.sqrt(np.add.reduceat(
+                    squares, bounds[:-1][non_empty] - bounds[0]))
+        else:
+            norms = row_norms(np.asarray(mat[start:start + block_size]))
+        np.divide(1, norms, out=inverse_norms[start:start + len(norms)],
+                  where=norms > 0)
+
+    return inverse_norms
+
+
+def _max_rss_bytes():
+    if resource is None:
+        return None
+
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _TileMemory:
+    """
+    Bytes of tiles held at once by the threads of a single similarities call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.live = 0
+        self.peak = 0
+
+    def add(self, nbytes: int):
+        with self._lock:
+            self.live += nbytes
+            self.peak = max(self.peak, self.live)
+
+
+class SimilarityEngine:
+    """
+    Scores new documents against a fixed old document-feature matrix in
+    tiles of new rows by old rows. Tile sizes are derived from a memory
+    budget, so the working memory does not depend on the corpus size, and the
+    tiles are scored by a pool of threads that share the old matrix without
+    copying it (the sparse products and distance kernels release the GIL).
+    The old matrix can be memory mapped (see storage.load_vectorized): for
+    cosine only a vector of its inverse row norms is computed up front.
+    When there are fewer tiles of new rows than threads, the old rows are
+    split between the threads too, so a single query also uses every core.
+
+    Results are either written into a preallocated n x d array (which can be
+    a numpy memmap for outputs larger than memory) or reduced to the top k
+    old documents per new document. Every call leaves a report of the tiling,
+    time and peak memory in the report attribute, to size workers. Reports
+    are kept per thread, so threads sharing an engine each see their own.
+
+    :param old_mat: scipy csr object of dimensions d x f for d documents and
+        f features representing the old document-feature matrix.
+    :param metric: string indicating the similarity/distance metric to be used,
+        cosine is the default.
+    :param memory_budget: Bytes of working memory for the tiles, shared by all
+        threads. The output array is not included. Default 256MB.
+    :param n_jobs: Number of threads scoring tiles in parallel. -1 uses all
+        cores. Default 1.
+    :param compact: If True, tiles are scored in float32 and float32 scores
+        are returned, see similarity_calculation. Default False.
+    """
+
+    # Most new documents per tile, wider tiles of old documents are preferred
+    max_query_block_size = 1024
+    min_block_size = 256
+
+    def __init__(self,
+                 old_mat,
+                 metric: str = 'cosine',
+                 memory_budget: int = 256 * 2 ** 20,
+                 n_jobs: int = 1,
+                 compact: bool = False):
+        # Check that metric is supported
+        assert metric in supported_metrics
+        assert memory_budget > 0
+
+        self.old_mat = old_mat
+        self.metric = metric
+        self.memory_budget = memory_budget
+        self.n_jobs = os.cpu_count() if n_jobs < 0 else max(1, n_jobs)
+        self.compact = compact
+        self.dtype = np.float32 if compact else np.float64
+        self._local = threading.local()
+
+        # old_mat may be memory mapped and shared between processes, so it is
+        # never copied: cosine tiles are scaled by the inverse row norms and
+        # compact tiles are converted one at a time
+        self.inverse_norms = None
+        if metric == 'cosine':
+            self.inverse_norms = _inverse_row_norms(old_mat).astype(
+                self.dtype, copy=False)
+
+    @property
+    def report(self):
+        """
+        dict reporting the last similarities call of the current thread.
+        """
+        return getattr(self._local, 'report', {})
+
+    def block_sizes(self,
+                    n_new: int,
+                    top_k: int = None,
+                    dense: bool = False):
+        """
+        Sizes the tiles so that the tiles of all threads fit in the memory
+        budget.
+
+        :param n_new: Number of new documents.
+        :param top_k: Number of most similar documents kept, or None.
+        :param dense: Whether the tiles are converted to dense arrays.
+
+        :return: A tuple containing the number of new and old documents per
+            tile.
+        """
+        n_old, n_features = self.old_mat.shape
+        itemsize = np.dtype(self.dtype).itemsize
+        budget = self.memory_budget // self.n_jobs
+
+        # A tile of scores, plus the candidates and their indices for top k
+        cell_bytes = itemsize if top_k is None else 2 * itemsize + 16
+        row_bytes = n_features * itemsize if dense else 0
+
+        query_block_size = max(1, min(n_new, self.max_query_block_size))
+        while True:
+            block_size = ((budget - query_block_size * row_bytes) //
+                          (query_block_size * cell_bytes + row_bytes))
+            if block_size >= min(n_old, self.min_block_size) or \
+                    query_block_size == 1:
+                break
+            query_block_size = max(1, query_block_size // 2)
+
+        return query_block_size, int(max(1, min(block_size, n_old)))
+
+    def _score(self, new_tile, start: int, end: int):
+        old_tile = self.old_mat[start:end]
+        if self.compact:
+            old_tile = _compact(old_tile)
+
+        if self.metric == 'cosine':
+            similarities = _to_dense(new_tile @ old_tile.T)
+            similarities *= self.inverse_norms[None, start:end]
+            return np.clip(similarities, -1, 1, out=similarities)
+
+        return _similarities(new_tile, old_tile, self.metric)
+
+    def similarities(self,
+                     new_mat,
+                     top_k: int = None,
+                     out=None,
+                     query_block_size: int = None,
+                     block_size: int = None):
+        """
+        Calculate similarity between new documents and the old documents.
+
+        :param new_mat: scipy csr object of dimensions n x f for n documents
+            and f features representing the new document-feature matrix.
+        :param top_k: Optional number of most similar old documents to keep per
+            new document. If None, all similarities are returned.
+        :param out: Optional preallocated array of dimensions n x d to write
+            all similarities into, e.g. a numpy memmap.
+        :param query_block_size: Number of new documents per tile, derived
+            from the memory budget if None.
+        :param block_size: Number of old documents per tile, derived from the
+            memory budget if None.
+
+        :return: ndarray of dimensions n x d with all similarities if top_k is
+            None, otherwise a tuple containing indices and scores (ndarrays of
+            dimensions n x top_k) sorted by decreasing similarity per row.
+        """
+
+        # Check dimensionality of new and old are compatible
+        assert new_mat.shape[1] == self.old_mat.shape[1]
+
+        dense = _densifies(new_mat, self.old_mat, self.metric)
+        if dense:
+            _warn_dense()
+
+        if self.compact:
+            new_mat = _compact(new_mat)
+        if self.metric == 'cosine' and new_mat.shape[0] > 0:
+            new_mat = normalize(new_mat)
+
+        n_new, n_old = new_mat.shape[0], self.old_mat.shape[0]
+        sizes = self.block_sizes(n_new, top_k, dense)
+        query_block_size = query_block_size or sizes[0]
+        block_size = block_size or sizes[1]
+        assert query_block_size > 0 and block_size > 0
+
+        if top_k is None:
+            if out is None:
+                out = np.empty((n_new, n_old), dtype=self.dtype)
+            assert out.shape == (n_new, n_old)
+        else:
+            top_k = min(top_k, n_old)
+
+        query_starts = range(0, n_new, query_block_size)
+        old_starts = np.arange(0, n_old, block_size)
+        n_shards = 1
+        if len(query_starts) < self.n_jobs:
+            n_shards = max(1, min(self.n_jobs, len(old_starts)))
+        shards = np.array_split(old_starts, n_shards)
+        tasks = [(q_start, shard) for q_start in query_starts
+                 for shard in range(n_shards)]
+
+        memory = _TileMemory()
+        start_time = time.perf_counter()
+
+        def score_tiles(task):
+            q_start, shard = task
+            q_end = min(q_start + query_block_size, n_new)
+            new_tile = new_mat[q_start:q_end]
+            best_indices = np.empty((q_end - q_start, 0), dtype=np.int64)
+            best_scores = np.empty((q_end - q_start, 0), dtype=self.dtype)
+
+            for start in shards[shard]:
+                scores = self._score(new_tile, start, start + block_size)
+                tile_bytes = scores.nbytes
+                memory.add(tile_bytes)
+                if top_k is None:
+                    out[q_start:q_end, start:start + scores.shape[1]] = scores
+                else:
+                    indices = np.broadcast_to(
+                        np.arange(start, start + scores.shape[1]),
+                        scores.shape)
+                    best_indices = np.hstack([best_indices, indices])
+                    best_scores = np.hstack([best_scores, scores])
+                    tile_bytes += best_indices.nbytes + best_scores.nbytes
+                    memory.add(best_indices.nbytes + best_scores.nbytes)
+                    if best_scores.shape[1] > top_k:
+                        best_indices, best_scores = _top_k_columns(
+                            best_indices, best_scores, top_k)
+                memory.add(-tile_bytes)
+
+            return best_indices, best_scores
+
+        with stage('SimilarityEngine.similarities', n_new) as record:
+            with ThreadPoolExecutor(self.n_jobs) as executor:
+                results = list(executor.map(score_tiles, tasks))
+            record.rows_out = n_new
+
+        if top_k is None:
+            result = out
+            output_bytes = out.nbytes
+        else:
+            out_indices = np.empty((n_new, top_k), dtype=np.int64)
+            out_scores = np.empty((n_new, top_k), dtype=self.dtype)
+            for i, q_start in enumerate(query_starts):
+                parts = results[i * n_shards:(i + 1) * n_shards]
+                best_indices = np.hstack([indices for indices, _ in parts])
+                best_scores = np.hstack([scores for _, scores in parts])
+                if best_scores.shape[1] > top_k:
+                    best_indices, best_scores = _top_k_columns(
+                        best_indices, best_scores, top_k)
+                q_end = q_start + best_scores.shape[0]
+                out_indices[q_start:q_end], out_scores[q_start:q_end] = \
+                    _sort_rows(best_indices, best_scores)
+            result = out_indices, out_scores
+            output_bytes = out_indices.nbytes + out_scores.nbytes
+
+        self._local.report = {'query_block_size': query_block_size,
+                              'block_size': block_size,
+                              'tiles': len(query_starts) * len(old_starts),
+                              'n_jobs': self.n_jobs,
+                              'seconds': time.perf_counter() - start_time,
+                              'output_bytes': output_bytes,
+                              'peak_tile_bytes': memory.peak,
+                              'peak_bytes': output_bytes + memory.peak,
+                              'max_rss_bytes': _max_rss_bytes()}
+
+        return result
+
+
+def batch_similarity(new_mat,
+                     old_mat,
+                     metric: str = 'cosine',
+                     top_k: int = None,
+                     query_block_size: int = 1000,
+                     block_size: int = 10000,
+                     n_jobs: int = 1,
+                     compact: bool = False):
+    """
+    Calculate similarity between many new documents and the old documents at
+    once. Both matrices are processed in tiles of query_block_size new rows
+    by block_size old rows, so only one tile per worker is held in memory
+    besides the output. For cosine the row norms are computed once and every
+    tile is a sparse matrix product. See SimilarityEngine to size the tiles
+    from a memory budget instead.
+
+    :param new_mat: scipy csr object of dimensions n x f for n documents and
+        f features representing the new document-feature matrix.
+    :param old_mat: scipy csr object of dimensions d x f for d documents and
+        f features representing the old document-feature matrix.
+    :param metric: string indicating the similarity/distance metric to be used,
+        cosine is the default.
+    :param top_k: Optional number of most similar old documents to keep per
+        new document. If None, all similarities are returned.
+    :param query_block_size: Number of new documents per tile.
+    :param block_size: Number of old documents per tile.
+    :param n_jobs: Number of threads scoring tiles in parallel. -1 uses all
+        cores. Default 1.
+    :param compact: If True, tiles are scored in float32 and float32 scores
+        are returned, see similarity_calculation. Default False.
+
+    :return: ndarray of dimensions n x d with all similarities if top_k is
+        None, otherwise a tuple containing indices and scores (ndarrays of
+        dimensions n x top_k) sorted by decreasing similarity per row.
+    """
+
+    # Check that metric is supported
+    assert metric in supported_metrics
+
+    # Check dimensionality of new and old are compatible
+    assert new_mat.shape[1] == old_mat.shape[1]
+
+    assert query_block_size > 0 and block_size > 0
+
+    engine = SimilarityEngine(old_mat, metric, n_jobs=n_jobs, compact=compact)
+    return engine.similarities(new_mat, top_k,
+                               query_block_size=query_block_size,
+                               block_size=block_size)
@@ -0,0 +1,277 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import json
+import os
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+
+from nlprov.similarity_calc import supported_metrics, batch_similarity
+from nlprov.storage import save_matrix, load_matrix, save_arrays, \
+    load_array
+
+INDEX_FORMAT_VERSION = 2
+
+# Metrics answered from the postings of the query terms only
+postings_metrics = ['cosine', 'jaccard', 'dice']
+
+
+class SimilarityIndex:
+    """
+    Prebuilt index over an old document-feature matrix (e.g. from
+    vectorize_text). It stores the L2 normalized rows and the binarized rows
+    as an inverted index (term -> postings of documents and weights)
+    together with the number of terms per document, so cosine, jaccard and
+    dice queries only scan the postings of the terms in the query. Scores
+    stay sparse, documents sharing no term with a query score 0, and queries
+    are processed in blocks of query_block_size rows. Other supported
+    metrics fall back to batch_similarity over the stored matrix.
+
+    The index can be saved to a directory of .npy files and loaded with
+    memory mapping, so loading does not depend on the corpus size.
+
+    :param old_mat: scipy csr object of dimensions d x f for d documents and
+        f features representing the old document-feature matrix.
+    """
+
+    # Number of new documents scored at once
+    query_block_size = 256
+
+    def __init__(self, old_mat=None):
+        if old_mat is not None:
+            self._build(old_mat)
+
+    def _build(self, old_mat):
+        old_mat = sp.csr_matrix(old_mat, copy=True)
+        old_mat.eliminate_zeros()
+        old_mat.sort_indices()
+
+        self.matrix = old_mat
+        self.shape = old_mat.shape
+        # Postings: columns of the normalized matrix
+        self.postings = normalize(old_mat).tocsc()
+        self.postings.sort_indices()
+        self.binary_postings = self._binarized(
+            np.ones(self.postings.nnz, dtype=np.float32))
+        self.term_counts = np.diff(old_mat.indptr)
+
+    def _binarized(self, data):
+        # Shares the structure of the postings, only the weights differ
+        return sp.csc_matrix((data, self.postings.indices,
+                              self.postings.indptr), shape=self.shape)
+
+    def _scores(self,
+                new_mat,
+                metric: str):
+        """
+        Sparse similarities between new documents and the indexed documents
+        that share at least one term with them, from the query terms'
+        postings.
+        """
+        terms = np.unique(new_mat.indices)
+        query = new_mat[:, terms]
+
+        if metric == 'cosine':
+            scores = normalize(query) @ self.postings[:, terms].T
+            np.clip(scores.data, -1, 1, out=scores.data)
+            return scores
+
+        query.data = np.ones_like(query.data)
+        shared = sp.csr_matrix(query @ self.binary_postings[:, terms].T)
+
+        new_counts = np.repeat(np.diff(new_mat.indptr), np.diff(shared.indptr))
+        counts = new_counts + self.term_counts[shared.indices]
+        if metric == 'jaccard':
+            values = shared.data / (counts - shared.data)
+        else:
+            values = 2 * shared.data / counts
+
+        return sp.csr_matrix((values, shared.indices, shared.indptr),
+                             shape=shared.shape)
+
+    def _empty_query_scores(self, metric: str):
+        """
+        Similarities of an empty new document, which shares no term.
+        """
+        empty = np.asarray(self.term_counts) == 0
+        if metric == 'jaccard':
+            # Two empty documents have distance 0, as in scipy
+            return empty.astype(np.float64)
+        if metric == 'dice':
+            # Two empty documents are undefined (nan), as in scipy
+            return np.where(empty, np.nan, 0.0)
+
+        return np.zeros(self.shape[0])
+
+    def _query_blocks(self, new_mat, metric: str):
+        new_mat = sp.csr_matrix(new_mat, copy=True)
+        new_mat.eliminate_zeros()
+
+        for start in range(0, new_mat.shape[0], self.query_block_size):
+            new_tile = new_mat[start:start + self.query_block_size]
+            yield start, new_tile, self._scores(new_tile, metric)
+
+    def similarities(self,
+                     new_mat,
+                     metric: str = 'cosine'):
+        """
+        Calculate similarity between new documents and the indexed documents.
+
+        :param new_mat: scipy csr object of dimensions n x f representing the
+            new document-feature matrix.
+        :param metric: string indicating the similarity/distance metric to be
+            used, cosine is the default.
+
+        :return: ndarray of dimensions n x d, similarity for each new and
+            indexed document.
+        """
+
+        # Check that metric is supported
+        assert metric in supported_metrics
+
+        # Check dimensionality of new and old are compatible
+        assert new_mat.shape[1] == self.shape[1]
+
+        if metric not in postings_metrics:
+            return batch_similarity(new_mat, self.matrix, metric)
+
+        similarities = np.zeros((new_mat.shape[0], self.shape[0]))
+        for start, new_tile, scores in self._query_blocks(new_mat, metric):
+            block = similarities[start:start + new_tile.shape[0]]
+            if metric != 'cosine':
+                empty = np.diff(new_tile.indptr) == 0
+                if empty.any():
+                    block[empty] = self._empty_query_scores(metric)
+
+            scores = scores.tocoo()
+            block[scores.row, scores.col] = scores.data
+
+        return similarities
+
+    def _row_top_k(self,
+                   indices,
+                   scores,
+                   top_k: int):
+        """
+        Top k of a new document whose scores are 0 outside of indices.
+        """
+        keep = scores != 0
+        indices, scores = indices[keep], scores[keep]
+        order = np.lexsort((indices, -scores))
+        indices, scores = indices[order], scores[order]
+
+        n_positive = int(np.count_nonzero(scores > 0))
+        if n_positive >= top_k:
+            return indices[:top_k], scores[:top_k]
+
+        # Documents scoring 0 come next, in row order, then negative scores
+        n_zeros = min(top_k - n_positive, self.shape[0] - len(indices))
+        zeros = np.setdiff1d(np.arange(n_zeros + len(indices)), indices,
+                             assume_unique=True)[:n_zeros]
+        n_negative = top_k - n_positive - n_zeros
+        negative = slice(n_positive, n_positive + n_negative)
+
+        return (np.concatenate([indices[:n_positive], zeros,
+                                indices[negative]]),
+                np.concatenate([scores[:n_positive], np.zeros(n_zeros),
+                                scores[negative]]))
+
+    def query(self,
+              new_mat,
+              metric: str = 'cosine',
+              top_k: int = 10):
+        """
+        Finds the indexed documents most similar to every new document.
+
+        :param new_mat: scipy csr object of dimensions n x f representing the
+            new document-feature matrix.
+        :param metric: string indicating the similarity/distance metric to be
+            used, cosine is the default.
+        :param top_k: Number of most similar documents to return per new
+            document.
+
+        :return: A tuple containing indices and scores (ndarrays of dimensions
+            n x top_k) sorted by decreasing similarity per row.
+        """
+
+        # Check that metric is supported
+        assert metric in supported_metrics
+
+        # Check dimensionality of new and old are compatible
+        assert new_mat.shape[1] == self.shape[1]
+
+        top_k = min(top_k, self.shape[0])
+        if metric not in postings_metrics and top_k > 0:
+            return batch_similarity(new_mat, self.matrix, metric, top_k)
+
+        indices = np.empty((new_mat.shape[0], top_k), dtype=np.int64)
+        scores = np.empty((new_mat.shape[0], top_k))
+        if top_k == 0:
+            return indices, scores
+
+        for start, new_tile, tile_scores in self._query_blocks(new_mat,
+                                                               metric):
+            counts = np.diff(new_tile.indptr)
+            for i in range(new_tile.shape[0]):
+                if counts[i] == 0 and metric != 'cosine':
+                    # Highest score first, ties in row order
+                    row = self._empty_query_scores(metric)
+                    order = np.lexsort((np.arange(len(row)), -row))[:top_k]
+                    indices[start + i], scores[start + i] = order, row[order]
+                    continue
+
+                begin, end = tile_scores.indptr[i:i + 2]
+                indices[start + i], scores[start + i] = self._row_top_k(
+                    tile_scores.indices[begin:end],
+                    tile_scores.data[begin:end], top_k)
+
+        return indices, scores
+
+    def save(self, path: str):
+        """
+        Saves the index as a directory of .npy files.
+
+        :param path: Directory to write, created if needed.
+        """
+        save_matrix(path, self.matrix, 'matrix')
+        save_matrix(path, self.postings, 'postings')
+        save_arrays(path, {'binary_postings_data': self.binary_postings.data})
+        np.save(os.path.join(path, 'term_counts.npy'), self.term_counts)
+
+        with open(os.path.join(path, 'index.json'), 'w') as f:
+            json.dump({'version': INDEX_FORMAT_VERSION,
+                       'shape': list(self.shape)}, f)
+
+    @classmethod
+    def load(cls,
+             path: str,
+             mmap_mode: str = 'r'):
+        """
+        Loads an index written by save. With memory mapping the arrays are
+        paged in on demand and shared between processes on the same host.
+
+        :param path: Directory written by save.
+        :param mmap_mode: numpy memory map mode, None reads the arrays into
+            memory.
+
+        :return: SimilarityIndex object.
+        """
+        with open(os.path.join(path, 'index.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != INDEX_FORMAT_VERSION:
+            raise Exception('Unsupported index format version {}'.format(
+                meta['version']))
+
+        index = cls()
+        index.shape = tuple(meta['shape'])
+        index.matrix = load_matrix(path, index.shape, 'matrix', mmap_mode)
+        index.postings = load_matrix(path, index.shape, 'postings', mmap_mode,
+                                     fmt='csc')
+        index.binary_postings = index._binarized(
+            load_array(path, 'binary_postings_data', mmap_mode))
+        index.term_counts = np.load(os.path.join(path, 'term_counts.npy'),
+                                    mmap_mode=mmap_mode)
+
+        return index
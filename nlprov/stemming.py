@@ -0,0 +1,113 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from nltk.stem import PorterStemmer
+
+
+class CachedStemmer:
+    """
+    Porter stemmer with a bounded word to stem cache, so every distinct word
+    is only stemmed once and the cost scales with the vocabulary size rather
+    than the number of tokens. Once the cache is full the oldest entries are
+    evicted first.
+
+    :param max_size: Maximum number of cached words. 0 disables the cache.
+    :param path: Optional path to a JSON cache written by save to preload.
+    """
+
+    def __init__(self,
+                 max_size: int = 1000000,
+                 path: str = None):
+        self.max_size = max_size
+        self.stemmer = PorterStemmer()
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        if path is not None:
+            self.load(path)
+
+    def stem(self, word: str):
+        """
+        Stems a single word.
+
+        :param word: String to stem.
+
+        :return: String, stemmed word.
+        """
+        try:
+            return self._cache[word]
+        except KeyError:
+            pass
+
+        stemmed = self.stemmer.stem(word)
+        if self.max_size > 0:
+            with self._lock:
+                while len(self._cache) >= self.max_size:
+                    self._cache.popitem(last=False)
+                self._cache[word] = stemmed
+
+        return stemmed
+
+    def stem_tokens(self, tokens):
+        """
+        Stems a sequence of words.
+
+        :param tokens: Iterable of strings.
+
+        :return: List of stemmed strings.
+        """
+        return [self.stem(token) for token in tokens]
+
+    def __len__(self):
+        return len(self._cache)
+
+    def save(self, path: str):
+        """
+        Persists the cache as JSON so it can be preloaded by other processes.
+
+        :param path: Path of the file to write.
+        """
+        with self._lock:
+            cache = dict(self._cache)
+
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+
+    def load(self, path: str):
+        """
+        Preloads the cache from a JSON file written by save, keeping at most
+        max_size entries.
+
+        :param path: Path of the file to read.
+        """
+        with open(path, encoding='utf-8') as f:
+            cache = json.load(f)
+
+        with self._lock:
+            self._cache.update(cache)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def clear(self):
+        """
+        Empties the cache.
+        """
+        with self._lock:
+            self._cache.clear()
+
+
+_default_stemmer = CachedStemmer()
+
+
+def get_stemmer():
+    """
+    Returns the process-wide CachedStemmer used by preprocess_text when no
+    stemmer is given.
+
+    :return: CachedStemmer object.
+    """
+    return _default_stemmer
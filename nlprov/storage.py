@@ -0,0 +1,423 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import json
+import os
+from collections.abc import Mapping
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer, \
+    HashingVectorizer, TfidfTransformer
+
+from nlprov.vectorize import _analyze, IncrementalVectorizer, \
+    HashingTfidfVectorizer
+
+STORAGE_FORMAT_VERSION = 1
+
+# Stands for the analyzer of pre-processed text in saved vectorizer params
+_PREPROCESSED_ANALYZER = 'nlprov.preprocessed'
+
+_vectorizer_classes = {cls.__name__: cls for cls in
+                       [CountVectorizer, TfidfVectorizer, HashingVectorizer,
+                        HashingTfidfVectorizer, IncrementalVectorizer]}
+
+
+def _array_path(path: str, name: str):
+    return os.path.join(path, name + '.npy')
+
+
+def save_arrays(path: str, arrays: dict):
+    """
+    Saves numpy arrays as .npy files of a directory, which load_array can
+    memory map.
+
+    :param path: Directory to write, created if needed.
+    :param arrays: dict of file names (without extension) and numpy arrays.
+    """
+    os.makedirs(path, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(_array_path(path, name), array)
+
+
+def load_array(path: str, name: str, mmap_mode: str = 'r'):
+    """
+    Loads an array written by save_arrays.
+
+    :param path: Directory holding the .npy files.
+    :param name: File name of the array, without extension.
+    :param mmap_mode: numpy memory map mode, 'r' by default. None loads the
+        array in memory.
+
+    :return: numpy array or memmap.
+    """
+    return np.load(_array_path(path, name), mmap_mode=mmap_mode)
+
+
+def save_matrix(path: str,
+                mat,
+                name: str = 'matrix'):
+    """
+    Saves a sparse matrix as the .npy files of its data, indices and indptr
+    arrays, which load_matrix can memory map.
+
+    :param path: Directory to write, created if needed.
+    :param mat: scipy csr or csc object.
+    :param name: Prefix of the file names, to store several matrices in the
+        same directory.
+    """
+    save_arrays(path, {name + '_data': mat.data,
+                       name + '_indices': mat.indices,
+                       name + '_indptr': mat.indptr})
+
+
+def load_matrix(path: str,
+                shape: tuple,
+                name: str = 'matrix',
+                mmap_mode: str = 'r',
+                fmt: str = 'csr'):
+    """
+    Loads a sparse matrix written by save_matrix. With memory mapping the
+    arrays are paged in on demand and shared between processes on the same
+    host, so loading does not depend on the size of the matrix.
+
+    :param path: Directory written by save_matrix.
+    :param shape: Shape of the matrix.
+    :param name: Prefix of the file names.
+    :param mmap_mode: numpy memory map mode, None reads the arrays into
+        memory.
+    :param fmt: 'csr' or 'csc', the format the matrix was saved in.
+
+    :return: scipy csr or csc object.
+    """
+    assert fmt in ['csr', 'csc']
+
+    matrix = sp.csr_matrix if fmt == 'csr' else sp.csc_matrix
+    return matrix((load_array(path, name + '_data', mmap_mode),
+                   load_array(path, name + '_indices', mmap_mode),
+                   load_array(path, name + '_indptr', mmap_mode)),
+                  shape=tuple(shape), copy=False)
+
+
+def _prefix(key: bytes):
+    # First 8 bytes as a big endian integer, which sorts like the bytes
+    return int.from_bytes(key[:8].ljust(8, b'\0'), 'big')
+
+
+class Vocabulary(Mapping):
+    """
+    Read-only term to feature index mapping backed by flat arrays instead of a
+    dict: the UTF-8 encoded terms concatenated in feature order, their
+    offsets, the order that sorts them (unless they are sorted already) and
+    the sorted 8 byte prefixes of the terms. Lookups are a binary search of
+    the prefixes followed by comparing the few terms sharing the prefix. The
+    arrays can be memory mapped, so loading a large vocabulary costs next to
+    nothing.
+
+    :param blob: uint8 ndarray of the concatenated UTF-8 encoded terms.
+    :param offsets: int64 ndarray of the start of every term in blob, followed
+        by the length of blob.
+    :param prefixes: uint64 ndarray of the sorted term prefixes.
+    :param order: Optional ndarray of the feature indices in sorted term
+        order, None if the terms are sorted already.
+    :param cache_size: Maximum number of looked up terms remembered, so
+        frequent terms are found at dict speed.
+    """
+
+    def __init__(self, blob, offsets, prefixes, order=None,
+                 cache_size: int = 100000):
+        self.blob = blob
+        self.offsets = offsets
+        self.prefixes = prefixes
+        self.order = order
+        self.cache_size = cache_size
+        self._cache = {}
+
+    @classmethod
+    def from_terms(cls, terms):
+        """
+        :param terms: Sequence of strings in feature order.
+
+        :return: Vocabulary object.
+        """
+        encoded = [term.encode('utf-8') for term in terms]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(term) for term in encoded], out=offsets[1:])
+        blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+        order = None
+        ordered = encoded
+        if any(a >= b for a, b in zip(encoded, encoded[1:])):
+            order = np.array(sorted(range(len(encoded)),
+                                    key=encoded.__getitem__), dtype=np.int64)
+            ordered = [encoded[j] for j in order]
+        prefixes = np.fromiter((_prefix(term) for term in ordered),
+                               dtype=np.uint64, count=len(ordered))
+
+        return cls(blob, offsets, prefixes, order)
+
+    @classmethod
+    def from_dict(cls, vocabulary: dict):
+        """
+        :param vocabulary: dict of terms to feature indices 0 to n - 1, e.g.
+            the vocabulary_ of a fitted vectorizer.
+
+        :return: Vocabulary object.
+        """
+        terms = [None] * len(vocabulary)
+        for term, j in vocabulary.items():
+            terms[j] = term
+
+        return cls.from_terms(terms)
+
+    def _term_bytes(self, j):
+        return self.blob[self.offsets[j]:self.offsets[j + 1]].tobytes()
+
+    def _feature(self, i):
+        return int(i if self.order is None else self.order[i])
+
+    def _search(self, key: bytes):
+        prefix = np.uint64(_prefix(key))
+        lo = int(np.searchsorted(self.prefixes, prefix, 'left'))
+        hi = int(np.searchsorted(self.prefixes, prefix, 'right'))
+        # Terms longer than 8 bytes may share the prefix
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term_bytes(self._feature(mid)) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(self) or self._term_bytes(self._feature(lo)) != key:
+            return None
+
+        return self._feature(lo)
+
+    def __getitem__(self, term):
+        try:
+            j = self._cache[term]
+        except KeyError:
+            if not isinstance(term, str):
+                raise
+            j = self._search(term.encode('utf-8'))
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[term] = j
+
+        if j is None:
+            raise KeyError(term)
+
+        return j
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for j in range(len(self)):
+            yield self._term_bytes(j).decode('utf-8')
+
+    def arrays(self):
+        """
+        :return: dict of the arrays backing the vocabulary, by file name.
+        """
+        arrays = {'vocabulary_blob': self.blob,
+                  'vocabulary_offsets': self.offsets,
+                  'vocabulary_prefixes': self.prefixes}
+        if self.order is not None:
+            arrays['vocabulary_order'] = self.order
+
+        return arrays
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = 'r'):
+        """
+        :param path: Directory the arrays were saved to.
+        :param mmap_mode: numpy memory map mode.
+
+        :return: Vocabulary object.
+        """
+        order = None
+        if os.path.exists(_array_path(path, 'vocabulary_order')):
+            order = load_array(path, 'vocabulary_order', mmap_mode)
+
+        return cls(load_array(path, 'vocabulary_blob', mmap_mode),
+                   load_array(path, 'vocabulary_offsets', mmap_mode),
+                   load_array(path, 'vocabulary_prefixes', mmap_mode), order)
+
+
+def _params_to_json(params: dict):
+    saved = {}
+    for key, value in params.items():
+        if key == 'analyzer' and value is _analyze:
+            value = _PREPROCESSED_ANALYZER
+        elif key == 'dtype':
+            value = np.dtype(value).name
+        elif callable(value):
+            raise Exception('Vectorizers with a custom {} cannot be '
+                            'saved'.format(key))
+        elif isinstance(value, tuple):
+            value = list(value)
+        elif isinstance(value, (set, frozenset)):
+            value = sorted(value)
+        saved[key] = value
+
+    return saved
+
+
+def _params_from_json(params: dict):
+    params = dict(params)
+    if params.get('analyzer') == _PREPROCESSED_ANALYZER:
+        params['analyzer'] = _analyze
+    if 'dtype' in params:
+        params['dtype'] = np.dtype(params['dtype']).type
+    if 'ngram_range' in params:
+        params['ngram_range'] = tuple(params['ngram_range'])
+
+    return params
+
+
+def _vectorizer_state(vectorizer_obj):
+    """
+    Returns the JSON metadata and arrays describing a fitted vectorizer.
+    """
+    name = type(vectorizer_obj).__name__
+    if name not in _vectorizer_classes:
+        raise Exception('Unsupported vectorizer {}'.format(name))
+
+    meta, arrays = {'class': name}, {}
+    if isinstance(vectorizer_obj, (CountVectorizer, HashingVectorizer)):
+        params = vectorizer_obj.get_params()
+        # A fixed vocabulary is saved with the fitted one below
+        params.pop('vocabulary', None)
+        meta['params'] = _params_to_json(params)
+    else:
+        meta['params'] = _params_to_json(
+            {key: getattr(vectorizer_obj, key) for key in
+             ['vec_type', 'binary', 'norm', 'use_idf', 'smooth_idf',
+              'sublinear_tf', 'n_features', 'dtype']
+             if hasattr(vectorizer_obj, key)})
+
+    if isinstance(vectorizer_obj, (CountVectorizer, IncrementalVectorizer)):
+        arrays.update(Vocabulary.from_dict(vectorizer_obj.vocabulary_)
+                      .arrays())
+        meta['fixed_vocabulary'] = getattr(vectorizer_obj,
+                                           'fixed_vocabulary_', False)
+
+    if isinstance(vectorizer_obj, TfidfVectorizer) and vectorizer_obj.use_idf:
+        arrays['idf'] = vectorizer_obj.idf_
+
+    if isinstance(vectorizer_obj, (HashingTfidfVectorizer,
+                                   IncrementalVectorizer)):
+        arrays['document_frequency'] = vectorizer_obj.document_frequency_
+        meta['n_docs'] = vectorizer_obj.n_docs_
+
+    return meta, arrays
+
+
+def _restore_vectorizer(path: str, meta: dict, mmap_mode: str):
+    cls = _vectorizer_classes[meta['class']]
+    vectorizer_obj = cls(**_params_from_json(meta['params']))
+
+    if cls in [CountVectorizer, TfidfVectorizer]:
+        vectorizer_obj.vocabulary_ = Vocabulary.load(path, mmap_mode)
+        vectorizer_obj.fixed_vocabulary_ = meta['fixed_vocabulary']
+
+    if cls is TfidfVectorizer:
+        if vectorizer_obj.use_idf:
+            vectorizer_obj.idf_ = load_array(path, 'idf', mmap_mode)
+        else:
+            transformer = TfidfTransformer(
+                norm=vectorizer_obj.norm, use_idf=False,
+                smooth_idf=vectorizer_obj.smooth_idf,
+                sublinear_tf=vectorizer_obj.sublinear_tf)
+            n_features = len(vectorizer_obj.vocabulary_)
+            vectorizer_obj._tfidf = transformer.fit(
+                sp.csr_matrix((1, n_features)))
+
+    if cls in [HashingTfidfVectorizer, IncrementalVectorizer]:
+        # Small, fixed size state updated in place by partial_fit
+        vectorizer_obj.document_frequency_ = np.array(
+            load_array(path, 'document_frequency', None))
+        vectorizer_obj.n_docs_ = meta['n_docs']
+
+    if cls is IncrementalVectorizer:
+        # partial_fit appends new terms, so it needs a mutable dict
+        vectorizer_obj.vocabulary_ = dict(
+            (term, j) for j, term in
+            enumerate(Vocabulary.load(path, mmap_mode)))
+        vectorizer_obj._count_blocks = [
+            load_matrix(path, meta['counts_shape'], 'counts', mmap_mode)]
+
+    return vectorizer_obj
+
+
+def save_vectorized(path: str,
+                    vectorized=None,
+                    vectorizer_obj=None):
+    """
+    Saves a vectorized corpus and/or the fitted vectorizer, e.g. the output of
+    vectorize_text, as a directory of .npy files and a JSON description. The
+    matrix is stored as CSR arrays and the vocabulary as a flat array of
+    UTF-8 encoded terms (see Vocabulary), so load_vectorized can memory map
+    everything instead of unpickling and copying it.
+
+    :param path: Directory to write, created if needed.
+    :param vectorized: Optional scipy sparse doc-feature matrix.
+    :param vectorizer_obj: Optional fitted vectorizer object (count, tfidf,
+        hashing, HashingTfidfVectorizer or IncrementalVectorizer). Custom
+        callables other than the pre-processed text analyzer cannot be
+        saved.
+    """
+    meta = {'version': STORAGE_FORMAT_VERSION, 'shape': None,
+            'vectorizer': None}
+    os.makedirs(path, exist_ok=True)
+
+    if vectorized is not None:
+        vectorized = sp.csr_matrix(vectorized)
+        save_matrix(path, vectorized)
+        meta['shape'] = list(vectorized.shape)
+
+    if vectorizer_obj is not None:
+        vectorizer_meta, arrays = _vectorizer_state(vectorizer_obj)
+        save_arrays(path, arrays)
+        if isinstance(vectorizer_obj, IncrementalVectorizer):
+            counts = vectorizer_obj.counts_
+            save_matrix(path, counts, 'counts')
+            vectorizer_meta['counts_shape'] = list(counts.shape)
+        meta['vectorizer'] = vectorizer_meta
+
+    with open(os.path.join(path, 'vectorized.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+def load_vectorized(path: str,
+                    mmap_mode: str = 'r'):
+    """
+    Loads a corpus and vectorizer written by save_vectorized. With memory
+    mapping the arrays are paged in on demand and shared zero-copy between
+    processes on the same host, so loading takes about the same time for
+    any corpus size. Memory mapped matrices are read-only.
+
+    :param path: Directory written by save_vectorized.
+    :param mmap_mode: numpy memory map mode, None reads the arrays into
+        memory.
+
+    :return: A tuple containing vectorized (scipy csr object, or None if no
+        matrix was saved) and vectorizer_obj (or None if no vectorizer was
+        saved).
+    """
+    with open(os.path.join(path, 'vectorized.json')) as f:
+        meta = json.load(f)
+    if meta['version'] != STORAGE_FORMAT_VERSION:
+        raise Exception('Unsupported storage format version {}'.format(
+            meta['version']))
+
+    vectorized = None
+    if meta['shape'] is not None:
+        vectorized = load_matrix(path, meta['shape'], mmap_mode=mmap_mode)
+
+    vectorizer_obj = None
+    if meta['vectorizer'] is not None:
+        vectorizer_obj = _restore_vectorizer(path, meta['vectorizer'],
+                                             mmap_mode)
+
+    return vectorized, vectorizer_obj
@@ -0,0 +1,91 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import pytest
+import numpy as np
+from numpy import allclose
+from numpy.random import default_rng
+from scipy.sparse import csr_matrix, vstack, random as sparse_random
+from nlprov.approximate import MinHashLSH, RandomProjectionLSH, recall_at_k, \
+    benchmark_recall
+from nlprov.similarity_calc import similarity_calculation
+
+
+# Set up clustered random documents, so that neighbours exist
+@pytest.fixture
+def clustered_counts():
+    rng = default_rng(0)
+    centers = rng.random((20, 200)) < 0.1
+    old = [centers[i % 20] ^ (rng.random(200) < 0.01) for i in range(400)]
+    new = [centers[i] ^ (rng.random(200) < 0.01) for i in range(20)]
+    return (csr_matrix(np.array(new, dtype=np.float64)),
+            csr_matrix(np.array(old, dtype=np.float64)))
+
+
+# Testing the signatures estimate jaccard similarity
+def test_minhash_signatures(clustered_counts):
+    new, old = clustered_counts
+    lsh = MinHashLSH(n_perm=256, bands=64)
+    new_sig = lsh.signatures(new[:1])
+    old_sig = lsh.signatures(old[:20])
+    estimate = (new_sig == old_sig).mean(axis=1)
+    exact = similarity_calculation(new[:1], old[:20], 'jaccard')[0]
+    assert np.abs(estimate - exact).max() < 0.15
+
+
+# Testing approximate search finds most exact neighbours
+@pytest.mark.parametrize("index", [MinHashLSH(), RandomProjectionLSH()],
+                         ids=['minhash', 'random_projection'])
+def test_recall(clustered_counts, index):
+    new, old = clustered_counts
+    index.add(old)
+    result = benchmark_recall(index, new, top_k=5)
+    assert result['recall'] > 0.9
+    # Only the documents of the query's cluster (5%) should be candidates
+    assert result['mean_candidates'] < 0.1 * old.shape[0]
+
+    indices, scores = index.query(new, top_k=5)
+    exact = similarity_calculation(new, old, index.metric)
+    for i in range(new.shape[0]):
+        assert allclose(exact[i][indices[i]], scores[i])
+
+
+# Testing the default parameters prune unrelated documents
+@pytest.mark.parametrize("index", [MinHashLSH(), RandomProjectionLSH()],
+                         ids=['minhash', 'random_projection'])
+def test_candidates_pruned(index):
+    old = sparse_random(5000, 1000, density=0.02, format='csr',
+                        random_state=0)
+    new = sparse_random(20, 1000, density=0.02, format='csr',
+                        random_state=1)
+    candidates = index.add(old).candidates(new)
+    assert np.mean([len(rows) for rows in candidates]) < 0.01 * old.shape[0]
+
+
+# Testing documents can be inserted later
+def test_insert(clustered_counts):
+    new, old = clustered_counts
+    index = MinHashLSH().add(old[:200]).add(old[200:])
+    assert index.matrix.shape == old.shape
+
+    indices, _ = index.query(vstack([old[250], csr_matrix((1, 200))]),
+                             top_k=1)
+    assert indices[0, 0] == 250
+    assert indices[1, 0] == -1
+
+    # Single documents are inserted without rebuilding the index
+    index = MinHashLSH().add(old[:300])
+    for row in range(300, 400):
+        index.add(old[row])
+    assert len(index._segments) <= 8
+    assert allclose(index.matrix.toarray(), old.toarray())
+    indices, _ = index.query(old[[10, 350]], top_k=1)
+    assert list(indices[:, 0]) == [10, 350]
+
+
+# Testing the recall metric counts ties with the k-th neighbour as found
+def test_recall_at_k():
+    approx = np.array([[0.9, 0.5, np.nan], [0.8, 0.7, 0.7]])
+    exact = np.array([[0.9, 0.8, 0.7], [0.8, 0.7, 0.7]])
+    assert recall_at_k(approx, exact) == 4 / 6
@@ -0,0 +1,72 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import pytest
+import pandas as pd
+from nlprov.cache import PreprocessCache, options_fingerprint
+from nlprov.preprocessing import preprocess_text
+
+
+# Create data for caching
+@pytest.fixture
+def cache_actual():
+    return pd.Series(data=["This is English",
+                           "c'est français",
+                           "ducks and cats are not similar",
+                           "This is English"],
+                     index=[7, 5, 3, 1])
+
+
+# Testing cached results match uncached ones, including dropped rows
+@pytest.mark.parametrize("options", [{},
+                                     {'token_list': True},
+                                     {'stem': True},
+                                     {'eng_lang': False, 'lemma': True}])
+def test_cache_results(cache_actual, options):
+    cache = PreprocessCache(':memory:')
+    expected = preprocess_text(cache_actual, **options)
+
+    first = preprocess_text(cache_actual, cache=cache, **options)
+    pd.testing.assert_series_equal(expected, first)
+    assert cache.stats()['hits'] == 0
+    assert cache.stats()['entries'] == 3
+
+    second = preprocess_text(cache_actual, cache=cache, **options)
+    pd.testing.assert_series_equal(expected, second)
+    assert cache.stats()['hits'] == 4
+
+
+# Testing only new texts are processed
+def test_cache_delta(cache_actual):
+    cache = PreprocessCache(':memory:')
+    preprocess_text(cache_actual.iloc[:2], cache=cache)
+    preprocess_text(cache_actual, cache=cache)
+    assert cache.stats()['hits'] == 3
+    assert cache.stats()['misses'] == 3
+
+
+# Testing different options don't share entries
+def test_cache_options(cache_actual):
+    cache = PreprocessCache(':memory:')
+    preprocess_text(cache_actual, cache=cache)
+    preprocessed = preprocess_text(cache_actual, lowercase=False, cache=cache)
+    assert preprocessed[7] == "This is English"
+    assert options_fingerprint({'a': 1}) != options_fingerprint({'a': 2})
+
+
+# Testing the cache persists on disk and is evicted by size
+def test_cache_persist_evict(tmp_path, cache_actual):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = PreprocessCache(path)
+    preprocess_text(cache_actual, eng_lang=False, cache=cache)
+    cache.close()
+
+    reopened = PreprocessCache(path, max_bytes=40)
+    preprocess_text(cache_actual, eng_lang=False, cache=reopened)
+    assert reopened.stats()['hits'] == 4
+
+    preprocess_text(pd.Series(["a new text"]), eng_lang=False,
+                    cache=reopened)
+    assert reopened.stats()['bytes'] <= 40
+    assert reopened.stats()['evictions'] > 0
@@ -0,0 +1,81 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import pytest
+import numpy as np
+import pandas as pd
+from nlprov.preprocessing import preprocess_text
+from nlprov.vectorize import vectorize_text, vectorize_new_text
+from nlprov.similarity_calc import similarity_calculation
+from nlprov.instrumentation import Profiler, stage
+
+
+@pytest.fixture
+def instrumented_text():
+    return pd.Series(["ducks and cats and ponies are not similar",
+                      "the red dogs are running in the park",
+                      "das ist deutsch",
+                      None])
+
+
+# Testing every stage of the pipeline is recorded with its rows
+def test_profiler_stages(instrumented_text):
+    with Profiler() as profiler:
+        preprocessed = preprocess_text(instrumented_text, stem=True,
+                                       stop_words=True)
+        vec_text, vec_obj = vectorize_text(preprocessed)
+        new_vec_text = vectorize_new_text(preprocessed[:1], vec_obj)
+        similarity_calculation(new_vec_text, vec_text)
+
+    summary = profiler.summary()
+    assert list(summary.index) == ['preprocess_text.normalize',
+                                   'preprocess_text.langid',
+                                   'preprocess_text.stop_words',
+                                   'preprocess_text.spacy',
+                                   'preprocess_text.replace',
+                                   'preprocess_text', 'vectorize_text',
+                                   'vectorize_new_text',
+                                   'similarity_calculation']
+    assert (summary['calls'] == 1).all()
+    assert (summary['seconds'] >= 0).all()
+    assert summary.loc['preprocess_text', 'rows_in'] == 4
+    assert summary.loc['preprocess_text', 'rows_out'] == 2
+    assert summary.loc['preprocess_text.langid', 'rows_in'] == 3
+    assert summary.loc['vectorize_text', 'rows_out'] == 2
+    assert summary['peak_bytes'].isna().all()
+
+
+# Testing nested stages and callbacks with memory tracking
+def test_profiler_memory_callbacks():
+    finished = []
+    with Profiler(callbacks=[finished.append], track_memory=True) as profiler:
+        with stage('outer', 1) as outer:
+            with stage('inner', 1) as inner:
+                block = np.ones(10 ** 6)
+                inner.rows_out = 1
+            del block
+            outer.rows_out = 0
+
+    report = profiler.report()
+    assert list(report['stage']) == ['inner', 'outer']
+    assert [record['stage'] for record in finished] == ['inner', 'outer']
+    peaks = report.set_index('stage')['peak_bytes']
+    assert peaks['inner'] >= 8 * 10 ** 6
+    assert peaks['outer'] >= peaks['inner']
+
+
+# Testing nothing is recorded once the profiler is closed and errors are
+# flagged
+def test_profiler_inactive():
+    with Profiler() as profiler:
+        with pytest.raises(ValueError):
+            with stage('failing'):
+                raise ValueError
+
+    with stage('ignored') as record:
+        record.rows_out = 1
+
+    report = profiler.report()
+    assert list(report['stage']) == ['failing']
+    assert report['error'].all()
@@ -0,0 +1,79 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import pytest
+import pandas as pd
+from nlprov.language import LanguageDetector, get_language_detector
+from nlprov.preprocessing import preprocess_text
+
+
+# Create data for language detection
+@pytest.fixture
+def language_actual():
+    return pd.Series(data=["this is english",
+                           "c'est français",
+                           "this is english",
+                           "das ist deutsch",
+                           "this is english"],
+                     index=[4, 3, 2, 1, 0])
+
+
+@pytest.fixture
+def language_expected():
+    return pd.Series(data=["en", "fr", "en", "de", "en"],
+                     index=[4, 3, 2, 1, 0], dtype=object)
+
+
+# Testing detection keeps the index and classifies duplicates once
+def test_detect_series(language_actual, language_expected):
+    detector = LanguageDetector()
+    detected = detector.detect_series(language_actual)
+    pd.testing.assert_series_equal(language_expected, detected)
+    assert detector.cache_info() == {'hits': 0, 'misses': 3, 'size': 3}
+
+    detector.detect_series(language_actual)
+    assert detector.cache_info() == {'hits': 3, 'misses': 3, 'size': 3}
+
+
+# Testing the cache stays bounded
+def test_cache_size(language_actual):
+    detector = LanguageDetector(cache_size=2)
+    detector.detect_series(language_actual)
+    assert detector.cache_info()['size'] == 2
+
+
+# Testing restricting candidate languages
+def test_languages(language_actual):
+    detector = LanguageDetector(languages=['en', 'de'])
+    assert set(detector.detect_series(language_actual)) <= {'en', 'de'}
+
+
+# Testing short strings are not classified
+def test_min_length():
+    detector = LanguageDetector(min_length=5, short_text_lang='xx')
+    assert detector.classify_many(['ok', 'this is english']) == ['xx', 'en']
+    assert detector.cache_info()['misses'] == 1
+
+
+# Testing classification in a process pool reused across batches
+def test_n_process(language_actual, language_expected):
+    with LanguageDetector(n_process=2, cache_size=0) as detector:
+        detected = detector.detect_series(language_actual)
+        executor = detector.executor
+        detector.detect_series(language_actual)
+        assert detector.executor is executor
+    pd.testing.assert_series_equal(language_expected, detected)
+    assert detector._executor is None
+
+
+# Testing preprocess_text with a custom detector
+def test_preprocess_lang_detector(language_actual):
+    detector = LanguageDetector(languages=['en', 'fr', 'de'])
+    preprocessed = preprocess_text(language_actual, lang_detector=detector)
+    assert preprocessed.index.tolist() == [4, 2, 0]
+
+
+# Testing the shared detector
+def test_get_language_detector():
+    assert get_language_detector() is get_language_detector()
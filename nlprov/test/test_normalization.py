@@ -0,0 +1,78 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import pytest
+import pandas as pd
+from nlprov.normalization import TextNormalizer, get_normalizer
+
+
+# Creating data for the normalizer
+@pytest.fixture
+def normalize_actual():
+    return pd.Series(data=["  MixEd\xa0CASe!! ",
+                           "old   term",
+                           "(555) 123-4567"],
+                     index=[2, 0, 1])
+
+
+@pytest.fixture
+def normalize_expected():
+    return pd.Series(data=["mixed case",
+                           "new word",
+                           "555 123 4567"],
+                     index=[2, 0, 1])
+
+
+# Testing a single normalization and replacement pass
+def test_normalize_series(normalize_actual, normalize_expected):
+    normalizer = TextNormalizer(replace_dict={'old': 'new', 'term': 'word'})
+    normalized = normalizer.normalize_series(normalize_actual, replace=True)
+    pd.testing.assert_series_equal(normalize_expected, normalized)
+
+
+# Testing regex keys, including groups and backreferences
+def test_replace_regex_keys():
+    normalizer = TextNormalizer(replace_dict={r'(\d+) (\d+)': r'\2-\1',
+                                              'colou?r': 'color',
+                                              r'(a)(b)?': 'x'})
+    assert normalizer.replace('12 34 colour ab a') == '34-12 color x x'
+
+
+# Testing backreferences of keys with lookarounds keep their context
+def test_replace_lookaround_keys():
+    normalizer = TextNormalizer(replace_dict={r'(\d+)(?= mg)': r'\1mg',
+                                              r'(?<=a)(b)': r'[\g<1>\g<0>]',
+                                              r'\bcat\b': 'dog'})
+    assert normalizer.replace('take 5 mg ab cat cats') == \
+        'take 5mg mg a[bb] dog cats'
+
+
+# Testing backreferences and conditionals inside keys refer to their own groups
+def test_replace_key_backreferences():
+    normalizer = TextNormalizer(replace_dict={'x': 'y',
+                                              r'(a)\1': 'Z',
+                                              r'(b)?[\1]c(?(1)d|e)': 'W'})
+    assert normalizer.replace('aa x b\x01cd \x01ce \x01cd') == \
+        'Z y W W \x01cd'
+
+
+# Testing keys are replaced simultaneously and not chained
+def test_replace_single_pass():
+    normalizer = TextNormalizer(replace_dict={'a': 'b', 'b': 'c'})
+    assert normalizer.replace('ab') == 'bc'
+
+
+# Testing token lists are left alone by the replacement
+def test_replace_series_token_list():
+    normalizer = TextNormalizer(replace_dict={'old': 'new'})
+    text = pd.Series([['old', 'term'], 'old term'])
+    replaced = normalizer.replace_series(text)
+    assert replaced.tolist() == [['old', 'term'], 'new term']
+
+
+# Testing normalizers are compiled once per set of options
+def test_get_normalizer_cached():
+    normalizer = get_normalizer(True, '(?!).*', {'old': 'new'})
+    assert get_normalizer(True, '(?!).*', {'old': 'new'}) is normalizer
+    assert get_normalizer(False, '(?!).*', {'old': 'new'}) is not normalizer
@@ -0,0 +1,118 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import pytest
+import pandas as pd
+from numpy import allclose, isnan
+from nlprov.preprocessing import preprocess_text
+from nlprov.vectorize import vectorize_text, vectorize_new_text
+from nlprov.similarity_calc import similarity_calculation
+from nlprov.pipeline import Pipeline
+
+
+@pytest.fixture
+def pipeline_corpus():
+    return pd.Series(["ducks and cats and ponies are not similar",
+                      "the red dogs are running in the park",
+                      "c'est français",
+                      "blue birds are singing in the morning",
+                      "cats are sleeping on the warm sofa"])
+
+
+@pytest.fixture
+def pipeline_new():
+    return pd.Series(["ducks and cats are not similar",
+                      "the dogs are running"])
+
+
+# Testing the pipeline gives the same results as the free functions
+@pytest.mark.parametrize("preprocess_kwargs,vec_type,metric", [
+    ({}, 'count', 'cosine'),
+    ({'stem': True, 'stop_words': True}, 'tfidf', 'jaccard'),
+    ({'replace_dict': {'cats': 'felines'}}, 'hashing', 'manhattan')])
+def test_pipeline(pipeline_corpus, pipeline_new, preprocess_kwargs, vec_type,
+                  metric):
+    pipeline = Pipeline(preprocess_kwargs, vec_type, metric=metric)
+    pipeline.fit(pipeline_corpus)
+
+    vec_text, vec_obj = vectorize_text(
+        preprocess_text(pipeline_corpus, **preprocess_kwargs), vec_type)
+    new_vec_text = vectorize_new_text(
+        preprocess_text(pipeline_new, **preprocess_kwargs), vec_obj)
+    expected = similarity_calculation(new_vec_text, vec_text, metric)
+
+    transformed, kept = pipeline.transform(pipeline_new)
+    assert allclose(transformed.toarray(), new_vec_text.toarray())
+    assert kept.equals(pipeline_new.index)
+    assert allclose(pipeline.query(pipeline_new), expected)
+
+    indices, scores = pipeline.query(pipeline_new, top_k=2)
+    assert indices.shape == (2, 2)
+    assert allclose(scores[:, 0], expected.max(axis=1))
+
+
+# Testing a saved pipeline is restored with its config and fitted state
+def test_pipeline_save_load(tmp_path, pipeline_corpus, pipeline_new):
+    pipeline = Pipeline({'stem': True}, 'tfidf',
+                        vectorizer_kwargs={'sublinear_tf': True},
+                        compact=True).fit(pipeline_corpus)
+    pipeline.save(str(tmp_path))
+
+    loaded = Pipeline.load(str(tmp_path))
+    assert loaded.get_config() == pipeline.get_config()
+    assert loaded.vectorizer_obj.sublinear_tf
+    assert allclose(loaded.query(pipeline_new), pipeline.query(pipeline_new))
+
+
+# Testing results of documents removed by the preprocessing are aligned with
+# the input as placeholders
+def test_pipeline_dropped_rows(pipeline_corpus, pipeline_new):
+    pipeline = Pipeline().fit(pipeline_corpus)
+    text = pd.Series([pipeline_new[0], "c'est français", pipeline_new[1]],
+                     index=['a', 'b', 'c'])
+    expected = pipeline.query(pipeline_new)
+
+    transformed, kept = pipeline.transform(text)
+    assert transformed.shape[0] == 2
+    assert list(kept) == ['a', 'c']
+
+    similarities = pipeline.query(text)
+    assert allclose(similarities[[0, 2]], expected)
+    assert isnan(similarities[1]).all()
+
+    indices, scores = pipeline.query(text, top_k=2)
+    assert (indices[1] == -1).all() and isnan(scores[1]).all()
+    assert allclose(scores[[0, 2], 0], expected.max(axis=1))
+
+
+# Testing an empty input gives empty results
+def test_pipeline_empty_query(pipeline_corpus):
+    pipeline = Pipeline().fit(pipeline_corpus)
+    text = pd.Series([], dtype=object)
+    assert pipeline.query(text).shape == (0, pipeline.vectorized.shape[0])
+
+    indices, scores = pipeline.query(text, top_k=2)
+    assert indices.shape == scores.shape == (0, 2)
+
+
+# Testing invalid options are rejected when the pipeline is created
+@pytest.mark.parametrize("kwargs", [
+    {'preprocess_kwargs': {'unknown': True}},
+    {'preprocess_kwargs': {'cache': None}},
+    {'preprocess_kwargs': {'stem': True, 'lemma': True}},
+    {'preprocess_kwargs': {'tokenizer': 'unknown'}},
+    {'vec_type': 'unknown'},
+    {'metric': 'unknown'}])
+def test_pipeline_invalid(kwargs):
+    with pytest.raises(Exception):
+        Pipeline(**kwargs)
+
+
+# Testing an unfitted pipeline can't transform or be saved
+def test_pipeline_unfitted(tmp_path, pipeline_new):
+    pipeline = Pipeline()
+    with pytest.raises(Exception):
+        pipeline.transform(pipeline_new)
+    with pytest.raises(Exception):
+        pipeline.save(str(tmp_path))
@@ -5,7 +5,8 @@ Copyright © 2020 Johnson & Johnson
 import pytest
 import pandas as pd
 import numpy as np
-from nlprov.preprocessing import preprocess_text
+from nlprov.preprocessing import preprocess_text, preprocess_stream
+from nlprov.stemming import CachedStemmer
 from conftest import sents_chars_expected, sents_nums_expected, \
     sents_all_expected
 
@@ -343,3 +344,135 @@ def test_stopword_default(stopword_sents):
 def test_stopword_removal(stopword_sents, stopword_removal_expected):
     preprocessed = preprocess_text(stopword_sents, stop_words=True)
     pd.testing.assert_series_equal(stopword_removal_expected, preprocessed)
+
+
+# Testing multi-process lemmatizing keeps results and the original index
+def test_lemma_multiprocess(lemma_actual, lemma_expected):
+    lemma_actual.index = [10, 5, 7]
+    lemma_expected.index = [10, 5, 7]
+    preprocessed = preprocess_text(lemma_actual, lemma=True, eng_lang=False,
+                                   n_process=2, batch_size=1)
+    pd.testing.assert_series_equal(lemma_expected, preprocessed)
+
+
+# Testing multi-process stemming
+def test_stem_multiprocess(stem_actual, stem_expected):
+    preprocessed = preprocess_text(stem_actual, stem=True, eng_lang=False,
+                                   n_process=2)
+    pd.testing.assert_series_equal(stem_expected, preprocessed)
+
+
+# Creating data for streaming preprocessing
+@pytest.fixture
+def stream_actual():
+    return pd.Series(data=["  MixEd CASe  ",
+                           np.nan,
+                           "Combination  of spaces.",
+                           "old term",
+                           "normal string"],
+                     index=[3, 1, 4, 1, 5])
+
+
+# Testing chunked preprocessing matches a single call and keeps the index
+def test_preprocess_stream_series(stream_actual):
+    chunks = list(preprocess_stream(stream_actual, chunksize=2,
+                                    eng_lang=False))
+    assert len(chunks) == 3
+    pd.testing.assert_series_equal(preprocess_text(stream_actual,
+                                                   eng_lang=False),
+                                   pd.concat(chunks))
+
+
+# Testing chunked preprocessing of an iterable of strings
+def test_preprocess_stream_iterable():
+    chunks = list(preprocess_stream(iter(["A b", "C  d", "e"]), chunksize=2,
+                                    eng_lang=False))
+    pd.testing.assert_series_equal(pd.concat(chunks),
+                                   pd.Series(["a b", "c d", "e"]),
+                                   check_dtype=False)
+
+
+# Testing chunked preprocessing of a csv file
+def test_preprocess_stream_csv(tmp_path, stream_actual):
+    path = tmp_path / 'text.csv'
+    pd.DataFrame({'id': range(5), 'text': stream_actual.values}).to_csv(
+        path, index=False)
+    chunks = list(preprocess_stream(path, chunksize=2, column='text',
+                                    eng_lang=False))
+    expected = preprocess_text(stream_actual.reset_index(drop=True),
+                               eng_lang=False)
+    pd.testing.assert_series_equal(expected, pd.concat(chunks),
+                                   check_names=False, check_dtype=False)
+
+
+# Testing csv chunks of numbers are still read as text
+def test_preprocess_stream_csv_numeric(tmp_path):
+    path = tmp_path / 'text.csv'
+    pd.DataFrame({'text': ['12', '34', 'Word', '56', '78']}).to_csv(
+        path, index=False)
+    chunks = list(preprocess_stream(path, chunksize=2, column='text',
+                                    eng_lang=False))
+    assert pd.concat(chunks).tolist() == ['12', '34', 'word', '56', '78']
+
+
+# Creating data for deduplication
+@pytest.fixture
+def dedup_actual():
+    return pd.Series(data=["Ducks and cats",
+                           "c'est français",
+                           "ducks  and cats!",
+                           "Ducks and cats",
+                           "ducks and cats are not similar"],
+                     index=[9, 8, 7, 6, 5])
+
+
+# Testing deduplication gives the same results as processing every row
+@pytest.mark.parametrize("dedup, ratio", [('raw', 5 / 4),
+                                          ('normalized', 5 / 3)])
+@pytest.mark.parametrize("options", [{},
+                                     {'token_list': True},
+                                     {'lemma': True},
+                                     {'stem': True, 'token_list': True}])
+def test_dedup(dedup_actual, dedup, ratio, options):
+    expected = preprocess_text(dedup_actual, **options)
+    preprocessed = preprocess_text(dedup_actual, dedup=dedup, **options)
+    pd.testing.assert_series_equal(expected, preprocessed)
+    assert preprocessed.attrs['dedup_ratio'] == ratio
+
+
+# Testing duplicated rows don't share token lists
+def test_dedup_token_list_copies(dedup_actual):
+    preprocessed = preprocess_text(dedup_actual, dedup=True, token_list=True)
+    assert preprocessed[9] == preprocessed[6]
+    assert preprocessed[9] is not preprocessed[6]
+
+
+# Testing stemming on whitespace tokens without spaCy
+def test_stem_whitespace(stem_actual, stem_expected):
+    preprocessed = preprocess_text(stem_actual, stem=True, eng_lang=False,
+                                   tokenizer='whitespace')
+    pd.testing.assert_series_equal(stem_expected, preprocessed)
+
+
+# Testing token lists on whitespace tokens without spaCy
+def test_token_list_whitespace(token_list_actual2, token_list_expected2):
+    preprocessed = preprocess_text(token_list_actual2, token_list=True,
+                                   eng_lang=False, tokenizer='whitespace')
+    pd.testing.assert_series_equal(token_list_expected2, preprocessed)
+
+
+# Testing stemming with a custom stemmer fills its cache once per word
+def test_stem_custom_stemmer(stem_actual, stem_expected):
+    stemmer = CachedStemmer()
+    preprocessed = preprocess_text(stem_actual, stem=True, eng_lang=False,
+                                   stemmer=stemmer)
+    pd.testing.assert_series_equal(stem_expected, preprocessed)
+    assert len(stemmer) == 11
+
+
+# Testing lookup lemmatization without the tagger
+def test_lemma_lookup():
+    text = pd.Series(data=["ducks and cats and ponies"])
+    preprocessed = preprocess_text(text, lemma=True, lemma_mode='lookup',
+                                   eng_lang=False)
+    assert preprocessed.tolist() == ["duck and cat and pony"]
@@ -0,0 +1,97 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import asyncio
+import pytest
+import pandas as pd
+from numpy import allclose
+from nlprov.preprocessing import preprocess_text
+from nlprov.vectorize import vectorize_text, vectorize_new_text
+from nlprov.similarity_calc import similarity_calculation
+from nlprov.storage import save_vectorized
+from nlprov.scoring import AsyncScorer
+
+
+@pytest.fixture
+def scoring_corpus():
+    text = pd.Series(["ducks and cats and ponies are not similar",
+                      "the red dogs are running in the park",
+                      "blue birds are singing in the morning",
+                      "cats are sleeping on the warm sofa"])
+    return vectorize_text(preprocess_text(text))
+
+
+@pytest.fixture
+def scoring_requests():
+    return ["ducks and cats are not similar",
+            "the dogs are running",
+            "das ist deutsch",
+            "birds singing in the park"]
+
+
+def expected_similarity(text, vec_text, vec_obj):
+    new_vec_text = vectorize_new_text(preprocess_text(pd.Series([text])),
+                                      vec_obj)
+    return similarity_calculation(new_vec_text, vec_text)[0]
+
+
+# Testing concurrent requests are batched and scored like single calls
+def test_async_scorer(scoring_corpus, scoring_requests):
+    vec_text, vec_obj = scoring_corpus
+
+    async def run():
+        async with AsyncScorer(vec_obj, vec_text, max_wait=0.05) as scorer:
+            results = await asyncio.gather(*[scorer.score(text)
+                                             for text in scoring_requests])
+            return results, scorer.metrics()
+
+    results, metrics = asyncio.run(run())
+    for text, result in zip(scoring_requests, results):
+        if text == "das ist deutsch":
+            # Removed as non-english
+            assert result is None
+        else:
+            assert allclose(result,
+                            expected_similarity(text, vec_text, vec_obj))
+
+    assert metrics['requests'] == len(scoring_requests)
+    assert metrics['batches'] == 1
+    assert metrics['max_batch_size'] == len(scoring_requests)
+    assert metrics['latency_p99'] >= metrics['latency_p50'] > 0
+
+
+# Testing top k scoring of a scorer loaded from disk
+def test_async_scorer_load(tmp_path, scoring_corpus):
+    vec_text, vec_obj = scoring_corpus
+    save_vectorized(str(tmp_path), vec_text, vec_obj)
+    expected = expected_similarity("the dogs are running", vec_text, vec_obj)
+
+    async def run():
+        async with AsyncScorer.load(str(tmp_path), top_k=2,
+                                    max_batch_size=1) as scorer:
+            first = await scorer.score("the dogs are running")
+            second = await scorer.score("the dogs are running")
+            return first, second, scorer.metrics()
+
+    (indices, scores), _, metrics = asyncio.run(run())
+    assert allclose(scores, sorted(expected, reverse=True)[:2])
+    assert allclose(expected[indices], scores)
+    assert metrics['batches'] == 2
+    assert metrics['max_batch_size'] == 1
+
+
+# Testing errors are raised to every request of the batch
+def test_async_scorer_error(scoring_corpus):
+    vec_text, vec_obj = scoring_corpus
+    scorer = AsyncScorer(vec_obj, vec_text,
+                         preprocess_kwargs={'tokenizer': 'unsupported'})
+
+    async def run():
+        async with scorer:
+            return await asyncio.gather(scorer.score("the dogs"),
+                                        scorer.score("the cats"),
+                                        return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, Exception) for result in results)
@@ -2,10 +2,16 @@
 Copyright © 2020 Johnson & Johnson
 """
 
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 import pytest
 from scipy.sparse import csr_matrix
-from numpy import array, allclose
-from nlprov.similarity_calc import similarity_calculation
+from numpy import array, allclose, sort, float32, memmap
+from numpy.random import default_rng
+from sklearn.metrics import pairwise_distances
+from nlprov.similarity_calc import similarity_calculation, similarity_search, \
+    batch_similarity, supported_metrics, SimilarityEngine
+from nlprov.storage import save_matrix, load_matrix
 
 # Set up data for testing similarity calculation
 x = csr_matrix([0, 1, 1])
@@ -37,3 +43,213 @@ def test_unsupported_metrics():
         similarity_calculation(csr_matrix([0, 1, 1]),
                                csr_matrix([1, 1, 1]),
                                metric='yule')
+
+
+# Set up data for testing similarity search
+search_old = csr_matrix([[1, 0, 0],
+                         [0, 1, 1],
+                         [1, 1, 1],
+                         [0, 0, 0],
+                         [0, 2, 1],
+                         [0, 1, 1]])
+search_new = csr_matrix([0, 1, 1])
+
+
+# Testing the search matches sorting the full similarity row
+@pytest.mark.parametrize("metric", supported_metrics)
+@pytest.mark.parametrize("block_size", [1, 4, 100])
+def test_similarity_search(metric, block_size):
+    similarities = similarity_calculation(search_new, search_old, metric)[0]
+    indices, scores = similarity_search(search_new, search_old, metric,
+                                        top_k=3, block_size=block_size)
+
+    assert len(indices) == 3
+    assert allclose(scores, sorted(similarities, reverse=True)[:3])
+    assert allclose(similarities[indices], scores)
+
+
+# Testing the threshold
+def test_similarity_search_threshold():
+    indices, scores = similarity_search(search_new, search_old, top_k=None,
+                                        threshold=0.9, block_size=2)
+    assert list(indices) == [1, 5, 4]
+    assert allclose(scores, [1, 1, 0.9486833])
+
+    indices, _ = similarity_search(search_new, search_old, top_k=1,
+                                   threshold=0.9)
+    assert list(indices) == [1]
+
+
+# Set up data for testing batched queries
+batch_new = csr_matrix([[0, 1, 1],
+                        [1, 0, 0],
+                        [0, 0, 0],
+                        [1, 2, 0]])
+
+
+# Testing several new documents at once
+def test_similarity_calc_batch():
+    similarities = similarity_calculation(batch_new, search_old)
+    assert similarities.shape == (4, 6)
+    for i in range(4):
+        assert allclose(similarities[i],
+                        similarity_calculation(batch_new[i], search_old)[0])
+
+
+# Testing tiled batches match similarity_calculation
+@pytest.mark.parametrize("metric", supported_metrics)
+@pytest.mark.parametrize("query_block_size, block_size, n_jobs",
+                         [(1, 1, 1), (3, 4, 2), (100, 100, 1)])
+def test_batch_similarity(metric, query_block_size, block_size, n_jobs):
+    similarities = similarity_calculation(batch_new, search_old, metric)
+    batched = batch_similarity(batch_new, search_old, metric,
+                               query_block_size=query_block_size,
+                               block_size=block_size, n_jobs=n_jobs)
+    assert allclose(batched, similarities, equal_nan=True)
+
+    indices, scores = batch_similarity(batch_new, search_old, metric,
+                                       top_k=2,
+                                       query_block_size=query_block_size,
+                                       block_size=block_size, n_jobs=n_jobs)
+    assert indices.shape == scores.shape == (4, 2)
+    for i in range(4):
+        # Undefined (nan) similarities sort last
+        assert allclose(scores[i], -sort(-similarities[i])[:2],
+                        equal_nan=True)
+        assert allclose(similarities[i][indices[i]], scores[i],
+                        equal_nan=True)
+
+
+# Set up random count matrices for the sparse jaccard, dice and hamming
+@pytest.fixture
+def random_counts():
+    rng = default_rng(0)
+    new = rng.integers(0, 3, size=(5, 30)) * (rng.random((5, 30)) < 0.3)
+    old = rng.integers(0, 3, size=(40, 30)) * (rng.random((40, 30)) < 0.3)
+    new[0] = 0
+    old[0] = 0
+    return csr_matrix(new), csr_matrix(old)
+
+
+# Testing sparse metrics match the dense scipy values without densifying
+@pytest.mark.parametrize("metric", ['jaccard', 'dice', 'hamming'])
+def test_sparse_native_metrics(random_counts, metric):
+    new, old = random_counts
+    dense_new, dense_old = new.toarray(), old.toarray()
+    if metric != 'hamming':
+        dense_new, dense_old = dense_new.astype(bool), dense_old.astype(bool)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        expected = 1 - pairwise_distances(dense_new, dense_old, metric=metric)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        similarities = similarity_calculation(new, old, metric)
+
+    assert allclose(similarities, expected, equal_nan=True)
+
+
+# Testing hamming stays sparse for continuous (e.g. tfidf) values
+def test_hamming_many_values():
+    rng = default_rng(0)
+    old = rng.random((30, 100)) * (rng.random((30, 100)) < 0.2)
+    new = old[:5].copy()
+    new[:, ::3] = rng.random((5, 34)) * (rng.random((5, 34)) < 0.5)
+    new[:, 1] = 0.5
+    old[2, 1] = 0.5
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        similarities = similarity_calculation(csr_matrix(new),
+                                              csr_matrix(old), 'hamming')
+    assert allclose(similarities, 1 - pairwise_distances(
+        new, old, metric='hamming'))
+
+
+# Testing compact similarities are float32 and close to float64 ones
+@pytest.mark.parametrize("metric", supported_metrics)
+def test_similarity_compact(random_counts, metric):
+    new, old = random_counts
+    expected = similarity_calculation(new, old, metric)
+    similarities = similarity_calculation(new, old, metric, compact=True)
+    assert similarities.dtype == float32
+    assert allclose(similarities, expected, atol=1e-6, equal_nan=True)
+
+    batch = batch_similarity(new, old, metric, block_size=7, compact=True)
+    assert batch.dtype == float32
+    assert allclose(batch, expected, atol=1e-6, equal_nan=True)
+
+
+# Testing the engine sizes tiles from the memory budget
+@pytest.mark.parametrize("metric", supported_metrics)
+def test_engine_budget(random_counts, metric):
+    new, old = random_counts
+    expected = similarity_calculation(new, old, metric)
+
+    engine = SimilarityEngine(old, metric, memory_budget=600, n_jobs=3)
+    assert allclose(engine.similarities(new), expected, equal_nan=True)
+    assert engine.report['block_size'] < old.shape[0]
+    assert engine.report['tiles'] > 1
+    assert 0 < engine.report['peak_tile_bytes'] <= 600
+
+
+# Testing top k over old rows split between threads
+def test_engine_top_k(random_counts):
+    new, old = random_counts
+    expected = similarity_calculation(new[1:2], old)[0]
+
+    engine = SimilarityEngine(old, memory_budget=1000, n_jobs=4)
+    indices, scores = engine.similarities(new[1:2], top_k=5)
+    assert allclose(scores[0], sort(expected)[::-1][:5])
+    assert allclose(expected[indices[0]], scores[0])
+
+
+# Testing results are written into a preallocated memmap
+def test_engine_out(tmp_path, random_counts):
+    new, old = random_counts
+    out = memmap(str(tmp_path / 'out.dat'), dtype='float64', mode='w+',
+                 shape=(new.shape[0], old.shape[0]))
+
+    engine = SimilarityEngine(old, 'jaccard', memory_budget=1000)
+    assert engine.similarities(new, out=out) is out
+    assert allclose(out, similarity_calculation(new, old, 'jaccard'),
+                    equal_nan=True)
+    assert engine.report['output_bytes'] == out.nbytes
+
+
+# Testing a memory mapped corpus is shared as is, not copied
+@pytest.mark.parametrize("compact", [False, True])
+def test_engine_memory_mapped(tmp_path, random_counts, compact):
+    new, old = random_counts
+    save_matrix(str(tmp_path), old)
+    mapped = load_matrix(str(tmp_path), old.shape)
+
+    engine = SimilarityEngine(mapped, compact=compact)
+    assert engine.old_mat is mapped
+    assert allclose(engine.similarities(new),
+                    similarity_calculation(new, old), atol=1e-6)
+
+
+# Testing no new documents give empty results
+@pytest.mark.parametrize("metric", supported_metrics)
+@pytest.mark.parametrize("compact", [False, True])
+def test_engine_empty(random_counts, metric, compact):
+    _, old = random_counts
+    engine = SimilarityEngine(old, metric, compact=compact)
+    empty = csr_matrix((0, old.shape[1]))
+    assert engine.similarities(empty).shape == (0, old.shape[0])
+    indices, scores = engine.similarities(empty, top_k=3)
+    assert indices.shape == scores.shape == (0, 3)
+
+
+# Testing threads sharing an engine each get the report of their own call
+def test_engine_report_per_thread(random_counts):
+    new, old = random_counts
+    engine = SimilarityEngine(old, memory_budget=1000)
+
+    def query(block_size):
+        engine.similarities(new, block_size=block_size)
+        return engine.report['block_size']
+
+    with ThreadPoolExecutor(4) as executor:
+        assert list(executor.map(query, [1, 2, 3, 4] * 5)) == [1, 2, 3, 4] * 5
+    assert engine.report == {}
@@ -0,0 +1,72 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import warnings
+import pytest
+import numpy as np
+from numpy import allclose
+from numpy.random import default_rng
+from scipy.sparse import csr_matrix
+from nlprov.similarity_calc import similarity_calculation, supported_metrics
+from nlprov.similarity_index import SimilarityIndex
+
+
+# Set up random count matrices for the index
+@pytest.fixture
+def random_counts():
+    rng = default_rng(0)
+    new = rng.integers(0, 3, size=(5, 30)) * (rng.random((5, 30)) < 0.3)
+    old = rng.integers(0, 3, size=(40, 30)) * (rng.random((40, 30)) < 0.3)
+    new[0] = 0
+    old[0] = 0
+    return csr_matrix(new), csr_matrix(old)
+
+
+# Testing the index gives the same similarities as similarity_calculation
+@pytest.mark.parametrize("metric", supported_metrics)
+def test_index_similarities(random_counts, metric):
+    new, old = random_counts
+    index = SimilarityIndex(old)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        expected = similarity_calculation(new, old, metric)
+    assert allclose(index.similarities(new, metric), expected,
+                    equal_nan=True)
+
+
+# Testing top k queries, in blocks of new documents and with more
+# documents than share a term with the query
+@pytest.mark.parametrize("metric", supported_metrics)
+@pytest.mark.parametrize("top_k", [3, 30])
+def test_index_query(random_counts, metric, top_k):
+    new, old = random_counts
+    index = SimilarityIndex(old)
+    index.query_block_size = 2
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        expected = similarity_calculation(new, old, metric)
+
+    indices, scores = index.query(new, metric, top_k=top_k)
+    assert indices.shape == (5, top_k)
+    for i in range(5):
+        # Highest score first, ties in row order
+        order = np.lexsort((np.arange(40), -expected[i]))[:top_k]
+        assert allclose(scores[i], expected[i][order], equal_nan=True)
+        if metric in ['cosine', 'jaccard', 'dice']:
+            assert (indices[i] == order).all()
+
+
+# Testing the index can be saved and memory mapped
+def test_index_save_load(tmp_path, random_counts):
+    new, old = random_counts
+    index = SimilarityIndex(old)
+    index.save(str(tmp_path / 'index'))
+
+    loaded = SimilarityIndex.load(str(tmp_path / 'index'))
+    # Read-only memory maps, not copies
+    assert not loaded.postings.data.flags.writeable
+    assert not loaded.binary_postings.data.flags.writeable
+    for metric in ['cosine', 'jaccard', 'manhattan']:
+        assert allclose(loaded.similarities(new, metric),
+                        index.similarities(new, metric), equal_nan=True)
@@ -0,0 +1,67 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import pytest
+from nlprov import get_spacy_nlp, warm_up_spacy_nlp, evict_spacy_nlp, \
+    reload_spacy_nlp, loaded_spacy_pipelines, get_spacy_tokenizer_nlp, \
+    get_spacy_lemma_nlp, DEFAULT_MODEL
+
+
+@pytest.fixture
+def empty_registry():
+    evict_spacy_nlp()
+    yield
+    evict_spacy_nlp()
+
+
+# Testing the pipeline is only loaded once
+def test_get_spacy_nlp_cached(empty_registry):
+    nlp = get_spacy_nlp()
+    assert get_spacy_nlp() is nlp
+    assert len(loaded_spacy_pipelines()) == 1
+
+
+# Testing the order of disabled components does not matter
+def test_get_spacy_nlp_disable_key(empty_registry):
+    nlp = get_spacy_nlp(disable=('ner', 'parser'))
+    assert get_spacy_nlp(disable=('parser', 'ner')) is nlp
+    assert get_spacy_nlp() is not nlp
+
+
+# Testing warm up, eviction and reload
+def test_warm_up_evict_reload(empty_registry):
+    nlp = warm_up_spacy_nlp()
+    assert loaded_spacy_pipelines() == [(DEFAULT_MODEL,
+                                         ('ner', 'parser', 'textcat'),
+                                         (), None)]
+
+    reloaded = reload_spacy_nlp()
+    assert reloaded is not nlp
+    assert get_spacy_nlp() is reloaded
+
+    assert evict_spacy_nlp(DEFAULT_MODEL) == 1
+    assert loaded_spacy_pipelines() == []
+
+
+# Testing a helpful error for models that are not installed
+def test_missing_model(empty_registry):
+    with pytest.raises(Exception):
+        get_spacy_nlp(model='not_a_spacy_model')
+
+
+# Testing the tokenizer-only pipeline has no components
+def test_get_spacy_tokenizer_nlp(empty_registry):
+    nlp = get_spacy_tokenizer_nlp()
+    assert nlp.pipe_names == []
+    assert get_spacy_tokenizer_nlp() is nlp
+
+
+# Testing the lemma pipelines only keep what lemmatizing needs
+def test_get_spacy_lemma_nlp(empty_registry):
+    nlp = get_spacy_lemma_nlp()
+    assert 'parser' not in nlp.pipe_names
+    assert 'ner' not in nlp.pipe_names
+
+    lookup_nlp = get_spacy_lemma_nlp(lemma_mode='lookup')
+    assert lookup_nlp.pipe_names == ['lookup_lemmatizer']
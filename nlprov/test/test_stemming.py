@@ -0,0 +1,39 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+from nlprov.stemming import CachedStemmer, get_stemmer
+
+
+# Testing stems match the Porter stemmer and are cached
+def test_stem_tokens():
+    stemmer = CachedStemmer()
+    assert stemmer.stem_tokens(['ponies', 'stemming', 'ponies']) == \
+        ['poni', 'stem', 'poni']
+    assert len(stemmer) == 2
+
+
+# Testing the cache stays bounded
+def test_max_size():
+    stemmer = CachedStemmer(max_size=2)
+    stemmer.stem_tokens(['ducks', 'cats', 'ponies'])
+    assert len(stemmer) == 2
+
+    assert len(CachedStemmer(max_size=0).stem_tokens(['ducks'])) == 1
+
+
+# Testing the cache can be persisted and preloaded
+def test_save_load(tmp_path):
+    path = str(tmp_path / 'stems.json')
+    stemmer = CachedStemmer()
+    stemmer.stem_tokens(['ducks', 'cats'])
+    stemmer.save(path)
+
+    preloaded = CachedStemmer(path=path)
+    assert len(preloaded) == 2
+    assert preloaded.stem('ducks') == 'duck'
+
+
+# Testing the shared stemmer
+def test_get_stemmer():
+    assert get_stemmer() is get_stemmer()
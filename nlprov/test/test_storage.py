@@ -0,0 +1,99 @@
+"""
+Copyright © 2020 Johnson & Johnson
+"""
+
+import json
+import pytest
+import pandas as pd
+from numpy import allclose
+from nlprov.vectorize import vectorize_text, vectorize_new_text, \
+    IncrementalVectorizer
+from nlprov.storage import Vocabulary, save_vectorized, load_vectorized
+
+
+@pytest.fixture
+def storage_actual():
+    return pd.Series(['red dogs', 'red cats', 'blue birds', 'green dogs'])
+
+
+@pytest.fixture
+def storage_new():
+    return pd.Series(['red birds', 'purple cats'])
+
+
+# Testing the flat vocabulary behaves like the dict it was built from
+@pytest.mark.parametrize("terms", [['apple', 'bee', 'cat'],
+                                   ['zebra', 'émigré', 'apple', 'b']])
+def test_vocabulary(terms):
+    vocabulary = Vocabulary.from_terms(terms)
+    assert len(vocabulary) == len(terms)
+    assert list(vocabulary) == terms
+    assert dict(vocabulary) == {term: j for j, term in enumerate(terms)}
+    assert 'missing' not in vocabulary
+    assert vocabulary.get('missing') is None
+
+
+# Testing every vectorizer type round trips with the matrix
+@pytest.mark.parametrize("vec_type", ['count', 'tfidf', 'hashing',
+                                      'hashing_tfidf'])
+def test_save_load_vectorized(tmp_path, storage_actual, storage_new,
+                              vec_type):
+    dfm, vec_obj = vectorize_text(storage_actual, vec_type=vec_type)
+    save_vectorized(str(tmp_path), dfm, vec_obj)
+
+    loaded_dfm, loaded_vec_obj = load_vectorized(str(tmp_path))
+    # Read-only memory maps, not copies
+    assert not loaded_dfm.data.flags.writeable
+    assert allclose(loaded_dfm.toarray(), dfm.toarray())
+    assert allclose(vectorize_new_text(storage_new, loaded_vec_obj).toarray(),
+                    vectorize_new_text(storage_new, vec_obj).toarray())
+
+
+# Testing tfidf options and compact matrices are kept
+@pytest.mark.parametrize("vec_type, kwargs",
+                         [('tfidf', {'use_idf': False}),
+                          ('hashing_tfidf', {'n_features': 2 ** 10})])
+def test_save_load_options(tmp_path, storage_actual, storage_new, vec_type,
+                           kwargs):
+    dfm, vec_obj = vectorize_text(storage_actual, vec_type=vec_type,
+                                  compact=True, sublinear_tf=True, **kwargs)
+    save_vectorized(str(tmp_path), dfm, vec_obj)
+
+    loaded_dfm, loaded_vec_obj = load_vectorized(str(tmp_path), mmap_mode=None)
+    assert loaded_dfm.dtype == dfm.dtype
+    assert loaded_dfm.indices.dtype == dfm.indices.dtype
+    assert loaded_vec_obj.sublinear_tf
+    new_dfm = vectorize_new_text(storage_new, loaded_vec_obj)
+    assert new_dfm.dtype == dfm.dtype
+    assert allclose(new_dfm.toarray(),
+                    vectorize_new_text(storage_new, vec_obj).toarray())
+
+
+# Testing an incremental vectorizer can keep learning after loading
+def test_save_load_incremental(tmp_path, storage_actual, storage_new):
+    vec_obj = IncrementalVectorizer(vec_type='tfidf')
+    vec_obj.partial_fit(storage_actual)
+    save_vectorized(str(tmp_path), vectorizer_obj=vec_obj)
+
+    loaded_dfm, loaded_vec_obj = load_vectorized(str(tmp_path))
+    assert loaded_dfm is None
+    assert allclose(loaded_vec_obj.partial_fit(storage_new).toarray(),
+                    vec_obj.partial_fit(storage_new).toarray())
+    assert allclose(loaded_vec_obj.transform_seen().toarray(),
+                    vec_obj.transform_seen().toarray())
+
+
+# Testing unknown format versions and custom callables are rejected
+def test_save_load_errors(tmp_path, storage_actual):
+    dfm, vec_obj = vectorize_text(storage_actual)
+    save_vectorized(str(tmp_path), dfm, vec_obj)
+    meta_path = tmp_path / 'vectorized.json'
+    meta = json.loads(meta_path.read_text())
+    meta['version'] = 0
+    meta_path.write_text(json.dumps(meta))
+    with pytest.raises(Exception):
+        load_vectorized(str(tmp_path))
+
+    vec_obj.set_params(tokenizer=str.split)
+    with pytest.raises(Exception):
+        save_vectorized(str(tmp_path / 'custom'), vectorizer_obj=vec_obj)
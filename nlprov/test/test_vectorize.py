@@ -5,9 +5,12 @@ Copyright © 2020 Johnson & Johnson
 import pytest
 import pandas as pd
 from scipy.sparse import csr_matrix
-from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
-from nlprov.vectorize import vectorize_text, vectorize_new_text
-from numpy import allclose
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer, \
+    HashingVectorizer
+from nlprov.vectorize import vectorize_text, vectorize_new_text, \
+    vectorize_stream, IncrementalVectorizer, HashingTfidfVectorizer, \
+    compact_matrix
+from numpy import allclose, float32, int32, int64
 
 
 @pytest.fixture
@@ -97,3 +100,208 @@ def test_vectorize_new(new_text_actual, vectorizer_actual,
     new_dfm = vectorize_new_text(new_text_actual, vectorizer_actual)
 
     assert allclose(new_dfm.toarray(), new_dfm_expected.toarray())
+
+
+# Test vectorization of a stream of text chunks
+def test_vectorize_stream(vectorizer_actual, new_dfm_expected):
+    chunks = [pd.Series(['blue cats']), pd.Series(['red dogs', 'cats'])]
+    dfms = list(vectorize_stream(chunks, vectorizer_actual))
+
+    assert [dfm.shape[0] for dfm in dfms] == [1, 2]
+    assert allclose(dfms[0].toarray(), new_dfm_expected.toarray())
+
+
+# Creating data for incremental vectorization
+@pytest.fixture
+def incremental_batches():
+    return [pd.Series(['red dogs', 'red cats']),
+            pd.Series(['blue cats', 'blue blue birds', 'red'])]
+
+
+# Testing incremental updates give the same weights as a full refit
+@pytest.mark.parametrize("vec_type, kwargs",
+                         [('count', {}),
+                          ('count', {'binary': True}),
+                          ('tfidf', {}),
+                          ('tfidf', {'sublinear_tf': True,
+                                     'smooth_idf': False})])
+def test_incremental_vectorizer(incremental_batches, vec_type, kwargs):
+    inc_vec = IncrementalVectorizer(vec_type, **kwargs)
+    for batch in incremental_batches:
+        inc_dfm = inc_vec.partial_fit(batch)
+
+    full_dfm, full_vec = vectorize_text(pd.concat(incremental_batches),
+                                        vec_type=vec_type, **kwargs)
+
+    # Reorder the full fit's features to the incremental feature order
+    order = [full_vec.vocabulary_[term]
+             for term in inc_vec.get_feature_names_out()]
+    assert allclose(inc_vec.transform_seen().toarray(),
+                    full_dfm.toarray()[:, order])
+    n_new = len(incremental_batches[-1])
+    assert allclose(inc_dfm.toarray(), full_dfm.toarray()[-n_new:, order])
+
+    new_text = pd.Series(['blue cats and frogs'])
+    assert allclose(vectorize_new_text(new_text, inc_vec).toarray(),
+                    vectorize_new_text(new_text,
+                                       full_vec).toarray()[:, order])
+
+
+# Testing new terms are appended to the vocabulary
+def test_incremental_vocabulary(incremental_batches):
+    inc_vec = IncrementalVectorizer()
+    inc_vec.partial_fit(incremental_batches[0])
+    assert list(inc_vec.get_feature_names_out()) == ['red', 'dogs', 'cats']
+
+    inc_dfm = inc_vec.partial_fit(incremental_batches[1])
+    assert inc_dfm.shape == (3, 5)
+    assert inc_vec.transform_seen().shape == (5, 5)
+    assert inc_vec.counts_.shape == (5, 5)
+    assert list(inc_vec.document_frequency_) == [3, 1, 2, 2, 1]
+
+
+# Testing hashed counts match the count vectorizer up to feature order
+def test_hashing_vectorizer(vectorize_actual, count_dfm_expected):
+    dfm, vec_obj = vectorize_text(vectorize_actual, vec_type='hashing',
+                                  n_features=2 ** 10)
+    assert type(vec_obj) is HashingVectorizer
+    assert dfm.shape == (2, 2 ** 10)
+    assert dfm.nnz == 4
+    assert sorted(dfm.data) == [1, 1, 1, 1]
+
+    # Stateless, a new vectorizer gives the same features
+    new_dfm = vectorize_new_text(pd.Series(['red cats']),
+                                 HashingVectorizer(analyzer=str.split,
+                                                   n_features=2 ** 10,
+                                                   norm=None,
+                                                   alternate_sign=False))
+    assert allclose(new_dfm.toarray(), dfm[1].toarray())
+
+
+# Testing hashed tfidf matches the tfidf vectorizer up to feature order
+def test_hashing_tfidf_vectorizer(vectorize_actual, tfidf_dfm_expected):
+    dfm, vec_obj = vectorize_text(vectorize_actual, vec_type='hashing_tfidf')
+    assert type(vec_obj) is HashingTfidfVectorizer
+    assert allclose(sorted(dfm.data), sorted(tfidf_dfm_expected.data))
+
+
+# Testing document frequencies can be streamed and merged
+def test_hashing_tfidf_merge(vectorize_actual):
+    _, full_vec = vectorize_text(vectorize_actual, vec_type='hashing_tfidf')
+
+    first = HashingTfidfVectorizer().partial_fit(vectorize_actual[:1])
+    second = HashingTfidfVectorizer().partial_fit(vectorize_actual[1:])
+    merged = first.merge(second)
+
+    new_text = pd.Series(['blue cats'])
+    assert allclose(vectorize_new_text(new_text, merged).toarray(),
+                    vectorize_new_text(new_text, full_vec).toarray())
+
+
+# Creating data for the partitioned fit
+@pytest.fixture
+def partitioned_actual():
+    return pd.Series(['red dogs', 'red cats', 'blue cats', 'blue blue birds',
+                      'green frogs', 'red', 'cats and dogs'])
+
+
+# Testing a partitioned fit matches a single process fit
+@pytest.mark.parametrize("vec_type, kwargs",
+                         [('count', {}),
+                          ('count', {'binary': True}),
+                          ('tfidf', {}),
+                          ('tfidf', {'use_idf': False}),
+                          ('tfidf', {'sublinear_tf': True}),
+                          ('count', {'min_df': 2}),
+                          ('count', {'max_df': 0.3, 'binary': True}),
+                          ('count', {'max_features': 4}),
+                          ('tfidf', {'min_df': 2, 'max_df': 2,
+                                     'max_features': 2})])
+def test_partitioned_fit(partitioned_actual, vec_type, kwargs):
+    dfm, vec_obj = vectorize_text(partitioned_actual, vec_type=vec_type,
+                                  **kwargs)
+    par_dfm, par_vec_obj = vectorize_text(partitioned_actual,
+                                          vec_type=vec_type, n_jobs=3,
+                                          **kwargs)
+
+    assert type(par_vec_obj) is type(vec_obj)
+    assert par_vec_obj.vocabulary_ == vec_obj.vocabulary_
+    assert par_dfm.dtype == dfm.dtype
+    assert allclose(par_dfm.toarray(), dfm.toarray())
+
+    new_text = pd.Series(['blue dogs and frogs'])
+    assert allclose(vectorize_new_text(new_text, par_vec_obj).toarray(),
+                    vectorize_new_text(new_text, vec_obj).toarray())
+
+
+# Test errors of the partitioned fit match a single process fit
+def test_partitioned_fit_errors(partitioned_actual):
+    with pytest.raises(Exception):
+        vectorize_text(partitioned_actual, n_jobs=2, vocabulary=['red'])
+    with pytest.raises(ValueError):
+        vectorize_text(partitioned_actual, n_jobs=2, min_df=3, max_df=2)
+    with pytest.raises(ValueError):
+        vectorize_text(partitioned_actual, n_jobs=2, min_df=7)
+
+
+# Testing token lists and generators give the same results as strings
+@pytest.mark.parametrize("vec_type", ['count', 'tfidf', 'hashing',
+                                      'hashing_tfidf'])
+def test_vectorize_tokens(vectorize_actual, vec_type):
+    dfm, vec_obj = vectorize_text(vectorize_actual, vec_type=vec_type)
+
+    token_lists = vectorize_actual.str.split(' ')
+    token_dfm, token_vec_obj = vectorize_text(token_lists, vec_type=vec_type)
+    assert allclose(token_dfm.toarray(), dfm.toarray())
+
+    gen_dfm, _ = vectorize_text((doc for doc in token_lists),
+                                vec_type=vec_type)
+    assert allclose(gen_dfm.toarray(), dfm.toarray())
+
+    new_dfm = vectorize_new_text(pd.Series([['blue', 'cats']]), token_vec_obj)
+    assert allclose(new_dfm.toarray(),
+                    vectorize_new_text(pd.Series(['blue cats']),
+                                       vec_obj).toarray())
+
+
+# Testing chunks (e.g. from preprocess_stream) are flattened
+def test_vectorize_chunks(vectorize_actual, count_dfm_expected):
+    chunks = (vectorize_actual[i:i + 1] for i in range(len(vectorize_actual)))
+    dfm, _ = vectorize_text(chunks)
+    assert allclose(dfm.toarray(), count_dfm_expected.toarray())
+
+
+# Testing compact matrices are float32 with int32 indices
+@pytest.mark.parametrize("vec_type", ['count', 'tfidf', 'hashing',
+                                      'hashing_tfidf'])
+def test_vectorize_compact(vectorize_actual, vec_type):
+    dfm, _ = vectorize_text(vectorize_actual, vec_type=vec_type)
+    compact_dfm, vec_obj = vectorize_text(vectorize_actual, vec_type=vec_type,
+                                          compact=True)
+    assert compact_dfm.dtype == float32
+    assert compact_dfm.indices.dtype == int32
+    assert compact_dfm.indptr.dtype == int32
+    assert allclose(compact_dfm.toarray(), dfm.toarray())
+
+    new_dfm = vectorize_new_text(pd.Series(['blue cats']), vec_obj,
+                                 compact=True)
+    assert new_dfm.dtype == float32
+    assert new_dfm.indices.dtype == int32
+
+    # The vectorizer itself keeps producing float32 values
+    assert vectorize_new_text(pd.Series(['blue cats']),
+                              vec_obj).dtype == float32
+
+
+# Testing compact_matrix keeps the values
+def test_compact_matrix():
+    mat = csr_matrix([[0, 1.5, 2], [3, 0, 0]])
+    mat.indices = mat.indices.astype(int64)
+    mat.indptr = mat.indptr.astype(int64)
+
+    compact = compact_matrix(mat)
+    assert compact.dtype == float32
+    assert compact.indices.dtype == int32
+    assert allclose(compact.toarray(), mat.toarray())
+    # The input is left untouched
+    assert mat.indices.dtype == int64
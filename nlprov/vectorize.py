@@ -2,22 +2,109 @@
 Copyright © 2020 Johnson & Johnson
 """
 
+import itertools
+import os
+from numbers import Integral
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer, \
+    HashingVectorizer, TfidfTransformer
+from sklearn.preprocessing import normalize
+
+from nlprov.instrumentation import stage
+
+# Largest row count, column count or number of non-zeros int32 indices hold
+_INT32_MAX = np.iinfo(np.int32).max
+
+
+def _analyze(doc):
+    """
+    Analyzer for pre-processed documents: whitespace separated strings are
+    split, token lists are used as they are.
+    """
+    if isinstance(doc, str):
+        return doc.split()
+
+    return doc
+
+
+def _iter_documents(text_col):
+    """
+    Iterates over the documents of a Series or iterable without copying it.
+    Iterables of Series (e.g. from preprocess_stream) are flattened.
+    """
+    if isinstance(text_col, pd.Series):
+        return iter(text_col)
+
+    documents = iter(text_col)
+    try:
+        first = next(documents)
+    except StopIteration:
+        return iter([])
+
+    documents = itertools.chain([first], documents)
+    if isinstance(first, pd.Series):
+        return itertools.chain.from_iterable(documents)
+
+    return documents
+
+
+def compact_matrix(mat,
+                   dtype=np.float32):
+    """
+    Converts a sparse matrix to a memory compact representation: values
+    stored as dtype and int32 indices whenever the number of columns and
+    non-zeros allows it. A float64 matrix with int64 indices takes half the
+    memory.
+
+    float32 keeps about 7 significant digits. Counts are exact up to 2**24
+    and similarities computed from float32 matrices differ from the float64
+    ones by about 1e-6, so only documents with (nearly) tied scores may
+    change ranks.
+
+    :param mat: scipy sparse matrix.
+    :param dtype: numpy dtype of the values, float32 is the default.
+
+    :return: scipy csr object.
+    """
+    mat = sp.csr_matrix(mat).astype(dtype, copy=False)
+    if max(mat.nnz, mat.shape[1]) <= _INT32_MAX:
+        mat.indices = mat.indices.astype(np.int32, copy=False)
+        mat.indptr = mat.indptr.astype(np.int32, copy=False)
+
+    return mat
 
 
 def vectorize_text(text_col: pd.Series,
                    vec_type: str = 'count',
+                   n_jobs: int = 1,
+                   compact: bool = False,
                    **kwargs):
     """
     Vectorizes pre-processed text. Instantiates the vectorizer and
     fit_transform it to the data provided.
 
-    :param text_col: Pandas series, containing preprocessed text.
+    :param text_col: Pandas series, containing preprocessed text as space
+        separated strings or token lists. Any iterable of those (or of such
+        Series, e.g. from preprocess_stream) is consumed in a single pass
+        without being copied into a list.
     :param vec_type: string indicating what type of vectorization
-        (count or tfidf currently).
+        (count, tfidf, hashing or hashing_tfidf currently). The hashing types
+        keep no vocabulary, so memory is fixed by n_features; hashing gives
+        hashed counts and hashing_tfidf reweights them with document
+        frequencies that can be updated with partial_fit.
+    :param n_jobs: Number of processes used to fit count and tfidf
+        vectorizers. Partitions of the text are counted in parallel and
+        merged into the same matrix and vocabulary as a single process fit;
+        -1 uses all cores. Default 1.
+    :param compact: If True, the matrix holds float32 values with int32
+        indices where possible (see compact_matrix) and the vectorizers
+        default to dtype float32, so vectorize_new_text keeps producing
+        float32 matrices. Default False.
     :param **kwargs: dict of keyworded arguments for sklearn vectorizer
-        functions.
+        functions (HashingTfidfVectorizer for hashing_tfidf).
 
     :return: A tuple containing vectorized (doc-feature matrix that as d rows
         and f columns for count and tfidf vectorization) and vectorizer_obj
@@ -25,14 +112,46 @@ def vectorize_text(text_col: pd.Series,
     """
 
     # Check if vectorization type is supported
-    assert vec_type in ['count', 'tfidf']
+    assert vec_type in ['count', 'tfidf', 'hashing', 'hashing_tfidf']
+
+    with stage('vectorize_text', _n_rows(text_col)) as record:
+        if compact:
+            kwargs.setdefault('dtype', np.float32)
+        vectorized, vectorizer_obj = _vectorize_text(text_col, vec_type,
+                                                     n_jobs, **kwargs)
+        if compact:
+            vectorized = compact_matrix(vectorized)
+        record.rows_out = vectorized.shape[0]
+
+    return vectorized, vectorizer_obj
+
+
+def _n_rows(text_col):
+    return len(text_col) if isinstance(text_col, pd.Series) else None
+
+
+def _vectorize_text(text_col,
+                    vec_type: str,
+                    n_jobs: int,
+                    **kwargs):
+    """
+    Fits the vectorizer of vectorize_text.
+    """
+
+    # Stream the documents straight into the vectorizer
+    text_raw = _iter_documents(text_col)
 
-    # Get raw values from pandas series
-    text_raw = text_col.tolist()
+    if vec_type == 'hashing_tfidf':
+        hashing_vec = HashingTfidfVectorizer(**kwargs)
+        vectorized = hashing_vec.fit_transform(text_raw)
+        return vectorized, hashing_vec
 
     # Lets the vectorizer know the input has already been pre-tokenized
-    # and is now delimited by whitespaces
-    kwargs['analyzer'] = str.split
+    # and is now delimited by whitespaces or a list of tokens
+    kwargs['analyzer'] = _analyze
+
+    if n_jobs != 1 and vec_type in ['count', 'tfidf']:
+        return _partitioned_fit(list(text_raw), vec_type, n_jobs, **kwargs)
 
     # Apply proper vectorization
     if vec_type == 'count':
@@ -43,32 +162,499 @@ def vectorize_text(text_col: pd.Series,
         tfidf_vec = TfidfVectorizer(**kwargs)
         vectorized = tfidf_vec.fit_transform(text_raw)
         vectorizer_obj = tfidf_vec
+    elif vec_type == 'hashing':
+        # Hashed counts, comparable to the count vectorizer
+        kwargs.setdefault('norm', None)
+        kwargs.setdefault('alternate_sign', False)
+        hashing_vec = HashingVectorizer(**kwargs)
+        vectorized = hashing_vec.fit_transform(text_raw)
+        vectorizer_obj = hashing_vec
 
     # Return vectorized object
     return vectorized, vectorizer_obj
 
 
+def _count_partition(text_raw: list):
+    count_vec = CountVectorizer(analyzer=_analyze)
+    counts = count_vec.fit_transform(text_raw)
+    return count_vec.get_feature_names_out(), counts
+
+
+def _limit_features(document_frequency,
+                    term_frequency,
+                    n_docs: int,
+                    min_df=1,
+                    max_df=1.0,
+                    max_features: int = None):
+    """
+    Mask of the features kept by the min_df, max_df and max_features options,
+    computed from merged document and term frequencies the same way
+    CountVectorizer computes it from the full count matrix.
+    """
+    max_doc_count = max_df if isinstance(max_df, Integral) \
+        else max_df * n_docs
+    min_doc_count = min_df if isinstance(min_df, Integral) \
+        else min_df * n_docs
+    if max_doc_count < min_doc_count:
+        raise ValueError('max_df corresponds to < documents than min_df')
+
+    mask = (document_frequency <= max_doc_count) & \
+        (document_frequency >= min_doc_count)
+    if max_features is not None and mask.sum() > max_features:
+        # Most frequent terms first, ties broken like CountVectorizer
+        kept = (-term_frequency[mask]).argsort()[:max_features]
+        limited = np.zeros(len(mask), dtype=bool)
+        limited[np.flatnonzero(mask)[kept]] = True
+        mask = limited
+
+    if not mask.any():
+        raise ValueError('After pruning, no terms remain. Try a lower min_df '
+                         'or a higher max_df.')
+
+    return mask
+
+
+def _partitioned_fit(text_raw: list,
+                     vec_type: str,
+                     n_jobs: int,
+                     **kwargs):
+    """
+    Map-reduce fit of a count or tfidf vectorizer: every partition of the
+    text is counted in its own process, then the partial vocabularies and
+    document frequencies are merged, min_df, max_df and max_features are
+    applied to the merged frequencies and the partial count matrices are
+    remapped and stacked.
+    """
+    if 'vocabulary' in kwargs:
+        raise Exception('vocabulary not supported with n_jobs != 1')
+
+    if n_jobs < 0:
+        n_jobs = os.cpu_count()
+    n_partitions = max(1, min(n_jobs, len(text_raw)))
+    bounds = np.linspace(0, len(text_raw), n_partitions + 1).astype(int)
+    partitions = [text_raw[start:end]
+                  for start, end in zip(bounds[:-1], bounds[1:])]
+
+    with ProcessPoolExecutor(n_jobs) as executor:
+        results = list(executor.map(_count_partition, partitions))
+
+    # Single process fits order the vocabulary alphabetically
+    terms = sorted(set().union(*[features for features, _ in results]))
+    merged = {term: j for j, term in enumerate(terms)}
+
+    binary = kwargs.get('binary', False)
+    mappings = []
+    document_frequency = np.zeros(len(terms), dtype=np.int64)
+    term_frequency = np.zeros(len(terms), dtype=np.int64)
+    for features, counts in results:
+        mapping = np.fromiter((merged[term] for term in features),
+                              dtype=np.int64, count=len(features))
+        mappings.append(mapping)
+        columns = mapping[counts.indices]
+        document_frequency += np.bincount(columns, minlength=len(terms))
+        if not binary:
+            term_frequency += np.bincount(
+                columns, weights=counts.data,
+                minlength=len(terms)).astype(np.int64)
+    if binary:
+        term_frequency = document_frequency
+
+    mask = _limit_features(document_frequency, term_frequency,
+                           len(text_raw), kwargs.get('min_df', 1),
+                           kwargs.get('max_df', 1.0),
+                           kwargs.get('max_features'))
+    # Merged index of every term to its final index, -1 for pruned terms
+    final = np.where(mask, np.cumsum(mask) - 1, -1)
+    vocabulary = {terms[j]: i for i, j in enumerate(np.flatnonzero(mask))}
+
+    blocks = []
+    for mapping, (_, counts) in zip(mappings, results):
+        # Both orders are alphabetical, so remapped indices stay sorted
+        columns = final[mapping][counts.indices]
+        kept = columns >= 0
+        indptr = np.concatenate([[0], np.cumsum(kept)])[counts.indptr]
+        blocks.append(sp.csr_matrix((counts.data[kept],
+                                     columns[kept].astype(
+                                         counts.indices.dtype),
+                                     indptr.astype(counts.indptr.dtype)),
+                                    shape=(counts.shape[0], len(vocabulary))))
+    counts = sp.vstack(blocks, format='csr')
+
+    if kwargs.get('binary', False):
+        counts.data = np.ones_like(counts.data)
+
+    if vec_type == 'count':
+        vectorizer_obj = CountVectorizer(**kwargs)
+        vectorizer_obj.vocabulary_ = vocabulary
+        vectorizer_obj.fixed_vocabulary_ = False
+        vectorized = counts.astype(vectorizer_obj.dtype)
+    else:
+        vectorizer_obj = TfidfVectorizer(**kwargs)
+        vectorizer_obj.vocabulary_ = vocabulary
+        vectorizer_obj.fixed_vocabulary_ = False
+        transformer = TfidfTransformer(
+            norm=vectorizer_obj.norm, use_idf=vectorizer_obj.use_idf,
+            smooth_idf=vectorizer_obj.smooth_idf,
+            sublinear_tf=vectorizer_obj.sublinear_tf)
+        vectorized = transformer.fit_transform(counts)
+        if vectorizer_obj.use_idf:
+            vectorizer_obj.idf_ = transformer.idf_
+        else:
+            # idf_ can only be assigned with use_idf, so hand over the
+            # transformer the vectorizer would have fitted itself
+            vectorizer_obj._tfidf = transformer
+        vectorized = vectorized.astype(vectorizer_obj.dtype)
+
+    return vectorized, vectorizer_obj
+
+
 def vectorize_new_text(text_col: pd.Series,
-                       vectorizer_obj):
+                       vectorizer_obj,
+                       compact: bool = False):
     """
     Vectorizes pre-processed new text. Used the provided vectorizer and
     apply/transform it to the data provided.
 
-    :param text_col: -- Pandas series, containing preprocessed text.
-    :param vectorizer_obj: -- Trained vectorizer object from vectorizing old text.
+    :param text_col: -- Pandas series, containing preprocessed text as space
+        separated strings or token lists, or an iterable of those.
+    :param vectorizer_obj: -- Trained vectorizer object from vectorizing old
+        text.
+    :param compact: -- If True, returns float32 values with int32 indices
+        where possible (see compact_matrix). Default False.
 
     :return: doc-feature matrix that has d rows and f columns for count and
         tfidf vectorization
     """
 
     # Check vectorization object
-    assert type(vectorizer_obj) is CountVectorizer or TfidfVectorizer
+    assert isinstance(vectorizer_obj, (CountVectorizer, TfidfVectorizer,
+                                       HashingVectorizer,
+                                       HashingTfidfVectorizer,
+                                       IncrementalVectorizer))
 
-    # Get raw values from pandas series
-    text_raw = text_col.tolist()
+    # Stream the documents straight into the vectorizer
+    text_raw = _iter_documents(text_col)
 
     # Apply proper vectorization
-    vectorized = vectorizer_obj.transform(text_raw)
+    with stage('vectorize_new_text', _n_rows(text_col)) as record:
+        vectorized = vectorizer_obj.transform(text_raw)
+        if compact:
+            vectorized = compact_matrix(vectorized)
+        record.rows_out = vectorized.shape[0]
 
     # Return vectorized object
     return vectorized
+
+
+def vectorize_stream(text_chunks,
+                     vectorizer_obj,
+                     compact: bool = False):
+    """
+    Vectorizes a stream of pre-processed text chunks, e.g. the output of
+    preprocess_stream, with a trained vectorizer.
+
+    :param text_chunks: -- Iterable of Pandas series, containing preprocessed
+        text.
+    :param vectorizer_obj: -- Trained vectorizer object from vectorizing old
+        text.
+    :param compact: -- If True, returns float32 values with int32 indices
+        where possible (see compact_matrix). Default False.
+
+    :return: Generator of doc-feature matrices, one per chunk, with rows in the
+        same order as the chunk's index.
+    """
+    for text_col in text_chunks:
+        yield vectorize_new_text(text_col, vectorizer_obj, compact)
+
+
+def _idf(document_frequency, n_docs: int, smooth_idf: bool):
+    if smooth_idf:
+        document_frequency = document_frequency + 1
+        n_docs = n_docs + 1
+
+    return np.log(n_docs / document_frequency) + 1
+
+
+def _tfidf_weight(counts,
+                  idf,
+                  norm: str,
+                  sublinear_tf: bool,
+                  dtype=np.float64):
+    weighted = counts.astype(dtype)
+    if sublinear_tf:
+        weighted.data = np.log(weighted.data) + 1
+    if idf is not None:
+        weighted.data *= idf[weighted.indices]
+    if norm is not None:
+        weighted = normalize(weighted, norm=norm, copy=False)
+
+    return weighted
+
+
+class IncrementalVectorizer:
+    """
+    Count or tfidf vectorizer that can be updated with new documents without
+    refitting on the whole corpus. It keeps the document frequencies of every
+    document seen so far, appends new terms to the end of the vocabulary and
+    recomputes the idf weights from the document frequencies, so the cost of
+    an update only depends on the size of the new batch. The raw counts of
+    each batch are kept as a block and only stacked when the matrix of every
+    document seen so far is asked for (transform_seen).
+
+    Weights match CountVectorizer/TfidfVectorizer fitted on all documents,
+    but features are ordered by first appearance rather than alphabetically.
+
+    :param vec_type: string indicating what type of vectorization
+        (count or tfidf currently).
+    :param binary: If True, all non zero counts are set to 1.
+    :param norm: Norm used to normalize tfidf rows ('l1', 'l2' or None).
+    :param use_idf: Whether or not to apply idf weighting for tfidf.
+    :param smooth_idf: Whether or not to add one to document frequencies for
+        tfidf, as if an extra document contained every term once.
+    :param sublinear_tf: Whether or not to replace tf with 1 + log(tf) for
+        tfidf.
+    """
+
+    def __init__(self,
+                 vec_type: str = 'count',
+                 binary: bool = False,
+                 norm: str = 'l2',
+                 use_idf: bool = True,
+                 smooth_idf: bool = True,
+                 sublinear_tf: bool = False):
+        # Check if vectorization type is supported
+        assert vec_type in ['count', 'tfidf']
+
+        self.vec_type = vec_type
+        self.binary = binary
+        self.norm = norm
+        self.use_idf = use_idf
+        self.smooth_idf = smooth_idf
+        self.sublinear_tf = sublinear_tf
+
+        self.vocabulary_ = {}
+        self.document_frequency_ = np.zeros(0, dtype=np.int64)
+        self.n_docs_ = 0
+        self._count_blocks = []
+
+    def _count(self, docs, grow: bool):
+        vocab = self.vocabulary_
+        data, indices, indptr = [], [], [0]
+        for doc in docs:
+            counter = {}
+            for token in _analyze(doc):
+                j = vocab.get(token)
+                if j is None:
+                    if not grow:
+                        continue
+                    j = vocab[token] = len(vocab)
+                counter[j] = counter.get(j, 0) + 1
+
+            indices.extend(counter.keys())
+            data.extend(counter.values())
+            indptr.append(len(indices))
+
+        counts = sp.csr_matrix((np.asarray(data, dtype=np.int64),
+                                np.asarray(indices, dtype=np.int64),
+                                np.asarray(indptr, dtype=np.int64)),
+                               shape=(len(indptr) - 1, len(vocab)))
+        counts.sort_indices()
+        return counts
+
+    @property
+    def idf_(self):
+        return _idf(self.document_frequency_, self.n_docs_, self.smooth_idf)
+
+    def _weight(self, counts):
+        if self.binary:
+            counts = counts.copy()
+            counts.data = np.ones_like(counts.data)
+
+        if self.vec_type == 'count':
+            # Never hand out the stored count blocks themselves
+            return counts if self.binary else counts.copy()
+
+        return _tfidf_weight(counts, self.idf_ if self.use_idf else None,
+                             self.norm, self.sublinear_tf)
+
+    @property
+    def counts_(self):
+        """
+        Raw term counts of every document seen so far, in the order they were
+        added.
+        """
+        n_features = len(self.vocabulary_)
+        if not self._count_blocks:
+            return sp.csr_matrix((0, n_features), dtype=np.int64)
+
+        # Widening older blocks only changes the shape, not the stored values
+        blocks = [sp.csr_matrix((block.data, block.indices, block.indptr),
+                                shape=(block.shape[0], n_features))
+                  for block in self._count_blocks]
+        counts = blocks[0] if len(blocks) == 1 else \
+            sp.vstack(blocks, format='csr')
+        self._count_blocks = [counts]
+
+        return counts
+
+    def partial_fit(self, text_col: pd.Series):
+        """
+        Adds pre-processed documents to the vectorizer, extending the
+        vocabulary and document frequencies.
+
+        :param text_col: Pandas series, containing preprocessed text.
+
+        :return: doc-feature matrix of the new documents, weighted with the
+            updated idf and with every feature seen so far as columns.
+        """
+        counts = self._count(text_col, grow=True)
+        n_features = len(self.vocabulary_)
+
+        df = np.bincount(counts.indices, minlength=n_features)
+        self.document_frequency_ = np.concatenate([
+            self.document_frequency_,
+            np.zeros(n_features - len(self.document_frequency_),
+                     dtype=np.int64)]) + df
+        self.n_docs_ += counts.shape[0]
+        self._count_blocks.append(counts)
+
+        return self._weight(counts)
+
+    def fit_transform(self, text_col: pd.Series):
+        """
+        Same as partial_fit, for compatibility with sklearn vectorizers.
+        """
+        return self.partial_fit(text_col)
+
+    def transform(self, text_col: pd.Series):
+        """
+        Vectorizes pre-processed documents with the current vocabulary and
+        idf weights, ignoring unknown terms.
+
+        :param text_col: Pandas series, containing preprocessed text.
+
+        :return: doc-feature matrix of the given documents.
+        """
+        return self._weight(self._count(text_col, grow=False))
+
+    def transform_seen(self):
+        """
+        Weights the documents seen so far with the current idf, without
+        re-tokenizing them.
+
+        :return: doc-feature matrix of every document seen so far, in the
+            order they were added.
+        """
+        return self._weight(self.counts_)
+
+    def get_feature_names_out(self):
+        """
+        :return: ndarray of the terms in feature order.
+        """
+        names = np.empty(len(self.vocabulary_), dtype=object)
+        for term, j in self.vocabulary_.items():
+            names[j] = term
+
+        return names
+
+
+class HashingTfidfVectorizer:
+    """
+    Stateless hashing vectorizer with tfidf reweighting. Terms are hashed
+    into a fixed number of features, so memory does not grow with the
+    vocabulary. The only state is a fixed size array of document frequencies
+    that can be accumulated chunk by chunk (partial_fit) and merged across
+    processes (merge).
+
+    :param n_features: Number of hashed features.
+    :param binary: If True, all non zero counts are set to 1.
+    :param norm: Norm used to normalize rows ('l1', 'l2' or None).
+    :param smooth_idf: Whether or not to add one to document frequencies, as
+        if an extra document contained every term once.
+    :param sublinear_tf: Whether or not to replace tf with 1 + log(tf).
+    :param dtype: numpy dtype of the weighted matrices, float64 by default.
+    """
+
+    def __init__(self,
+                 n_features: int = 2 ** 20,
+                 binary: bool = False,
+                 norm: str = 'l2',
+                 smooth_idf: bool = True,
+                 sublinear_tf: bool = False,
+                 dtype=np.float64):
+        self.n_features = n_features
+        self.binary = binary
+        self.norm = norm
+        self.smooth_idf = smooth_idf
+        self.sublinear_tf = sublinear_tf
+        self.dtype = dtype
+
+        self.hashing_vectorizer = HashingVectorizer(
+            analyzer=_analyze, n_features=n_features, binary=binary,
+            norm=None, alternate_sign=False, dtype=np.float64)
+        self.document_frequency_ = np.zeros(n_features, dtype=np.int64)
+        self.n_docs_ = 0
+
+    @property
+    def idf_(self):
+        return _idf(self.document_frequency_, self.n_docs_, self.smooth_idf)
+
+    def _weight(self, counts):
+        return _tfidf_weight(counts, self.idf_, self.norm, self.sublinear_tf,
+                             self.dtype)
+
+    def _count(self, text_col: pd.Series):
+        counts = self.hashing_vectorizer.transform(text_col)
+        self.document_frequency_ += np.bincount(counts.indices,
+                                                minlength=self.n_features)
+        self.n_docs_ += counts.shape[0]
+
+        return counts
+
+    def partial_fit(self, text_col: pd.Series):
+        """
+        Adds the document frequencies of pre-processed documents.
+
+        :param text_col: Pandas series, containing preprocessed text.
+
+        :return: self
+        """
+        self._count(text_col)
+
+        return self
+
+    def merge(self, other):
+        """
+        Adds the document frequencies accumulated by another vectorizer with
+        the same number of features, e.g. one fitted in another process.
+
+        :param other: HashingTfidfVectorizer object.
+
+        :return: self
+        """
+        assert other.n_features == self.n_features
+        self.document_frequency_ += other.document_frequency_
+        self.n_docs_ += other.n_docs_
+
+        return self
+
+    def fit_transform(self, text_col: pd.Series):
+        """
+        Adds the document frequencies of pre-processed documents and returns
+        their weighted doc-feature matrix.
+
+        :param text_col: Pandas series, containing preprocessed text.
+
+        :return: doc-feature matrix that has d rows and n_features columns.
+        """
+        return self._weight(self._count(text_col))
+
+    def transform(self, text_col: pd.Series):
+        """
+        Vectorizes pre-processed documents with the current idf weights.
+
+        :param text_col: Pandas series, containing preprocessed text.
+
+        :return: doc-feature matrix that has d rows and n_features columns.
+        """
+        return self._weight(self.hashing_vectorizer.transform(text_col))
@@ -4,7 +4,7 @@ Copyright © 2020 Johnson & Johnson
 
 from setuptools import setup, find_packages
 
-pkgs = find_packages()
+pkgs = find_packages(exclude=['benchmarks', 'benchmarks.*'])
 readme = open('README.md', encoding='utf-8').read()
 
 setup(
@@ -21,8 +21,11 @@ setup(
         'spacy>=3.4',
         'nltk>=3.4.3',
         'langid>=1.1.6',
-        'scikit-learn>=0.21.3'
+        'scikit-learn>=1.0'
     ],
+    extras_require={
+        'lookup': ['spacy-lookups-data']
+    },
     classifiers=[
         'Development Status :: 5 - Production/Stable',
         'License :: OSI Approved :: MIT License',